@@ -4,14 +4,17 @@ import json
 from datetime import datetime
 from typing import Dict, List, Optional
 
-from fastapi import APIRouter, Depends
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from app.config import TZINFO, logger
+from app.config import TZINFO, logger, settings
 from app.models.models import Message, User, Chat
 from app.services.auth import get_user, validate_token
+from app.services.auxiliary import answer_auxiliary, detect_auxiliary
+from app.services.checkpoint import restore_chat
 from app.services.helpers import generate_hash
-from app.services.llm import process_request
+from app.services.deadline import start_deadline
+from app.services.llm import process_request_until_deadline
 
 class ChatRequest(BaseModel):
     model: str
@@ -121,6 +124,19 @@ def stream_response(content, role="assistant", finish=False):
 
 chats = {}
 
+
+async def handle_auxiliary(kind: str, request: ChatRequest):
+    """Answers an Open WebUI title, tag or follow-up prompt directly, streamed or not."""
+    answer = await answer_auxiliary(kind, request.messages)
+    if not request.stream:
+        return Response(content=get_response_object(answer, finish=True), media_type="application/json")
+
+    async def event_stream():
+        yield stream_response(answer) + "\n"
+        yield get_response_object("", finish=True) + "\n"
+    return StreamingResponse(event_stream(), media_type="application/json")
+
+
 @router.post("/api/chat")
 async def handle_models(request: ChatRequest, user: User = Depends(get_user)):
     """
@@ -128,13 +144,21 @@ async def handle_models(request: ChatRequest, user: User = Depends(get_user)):
     """
     logger.info("Incoming request: %s", request)
 
+    auxiliary = detect_auxiliary(request.messages) if settings.AUXILIARY_FAST_PATH else None
+    if auxiliary is not None:
+        return await handle_auxiliary(auxiliary, request)
+
     chat_id = generate_hash(user.id + request.messages[0].content)
     chat = None
     if len(request.messages) == 1:
-        chat = Chat(id=chat_id, user=user)
+        # A chat whose request was interrupted, e.g. by a restart, is resumed from its checkpoint
+        chat = restore_chat(chat_id, interrupted_only=True) or Chat(id=chat_id, user=user)
         chats[chat_id] = chat
     else:
-        chat = chats[chat_id]
+        chat = chats.get(chat_id) or restore_chat(chat_id)
+        if chat is None:
+            raise HTTPException(status_code=404, detail="Chat not found.")
+        chats[chat_id] = chat
     logger.info("Incoming chat: %s", chat.user.id)
 
     if request.stream:
@@ -144,7 +168,9 @@ async def handle_models(request: ChatRequest, user: User = Depends(get_user)):
             Async generator to stream messages to the client.
             """
             try:
-                asyncio.create_task(process_request(chat=chat, messages=request.messages))
+                # The deadline is inherited by every task of the request
+                start_deadline(settings.REQUEST_DEADLINE)
+                asyncio.create_task(process_request_until_deadline(chat=chat, messages=request.messages))
 
                 while True:
                     # Wait for the next message from the queue
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends
+
+from app.services.auth import validate_token
+from app.services.auxiliary import auxiliary_counters
+from app.services.browser import browser_pool
+from app.services.fetcher import page_fetcher
+from app.services.knowledge import knowledge_counters
+from app.services.llm_cache import llm_cache
+from app.services.model_router import get_hedge_stats
+from app.services.plan_cache import plan_cache
+from app.services.speculation import speculation_counters
+
+router = APIRouter()
+
+
+@router.get("/api/stats/llm")
+def get_llm_stats(token: str = Depends(validate_token)):
+    """Returns LLM cache, plan cache, hedging, speculation, auxiliary prompt, retrieval, fetcher and browser counters for tuning."""
+    return {
+        "cache": dict(llm_cache.counters),
+        "plan_cache": dict(plan_cache.counters),
+        "hedging": get_hedge_stats(),
+        "speculation": dict(speculation_counters),
+        "auxiliary": dict(auxiliary_counters),
+        "knowledge": dict(knowledge_counters),
+        "fetcher": dict(page_fetcher.counters),
+        "browser": dict(browser_pool.counters),
+    }
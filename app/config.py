@@ -14,7 +14,8 @@ Attributes:
     settings (Settings): Singleton instance of the application settings.
     logger (logging.Logger): Configured logger for the application.
     knowledge_collection, tool_collection, config_collection, repo_collection, flow_collection,
-    web_search_cache_collection, get_knowledge_cache_collection: Initialized database clients for specific collections.
+    web_search_cache_collection, get_knowledge_cache_collection, llm_cache_collection,
+    checkpoint_collection, plan_cache_collection: Initialized database clients for specific collections.
     embedder (TextEmbedderInterface): Initialized text embedder based on configuration.
     query_collection: Initialized vector database client for query collection.
 """
@@ -65,6 +66,9 @@ class Settings(BaseSettings):
         COLLECTION_NAME_REPOS (str): Name of the repositories collection. Default is "repos".
         COLLECTION_NAME_WEB_SEARCH_CACHE (str): Name of the web search cache collection. Default is "googleSearchCache".
         COLLECTION_NAME_GET_KNOWLEDGE_CACHE (str): Name of the get knowledge cache collection. Default is "getKnowledgeCache".
+        COLLECTION_NAME_LLM_CACHE (str): Name of the LLM response cache collection. Default is "llmCache".
+        COLLECTION_NAME_CHECKPOINTS (str): Name of the chat pipeline checkpoint collection. Default is "chatCheckpoints".
+        COLLECTION_NAME_PLAN_CACHE (str): Name of the planning artifact cache collection. Default is "planCache".
         EMBEDDER (str): Embedder type to use ("vertex_ai", "ollama"). Default is "ollama".
         EMBEDDING_MODEL (str): Embedding model identifier. Default is "mxbai-embed-large".
         EMBEDDING_DIMENSIONALITY (int): Dimensionality of the embedding vectors. Default is 1024.
@@ -75,6 +79,78 @@ class Settings(BaseSettings):
         BLACKLIST_SEARCH (list[str]): List of blacklisted search terms.
         GCLOUD_PROJECT_ID (str): Google Cloud project ID. Default is "psyched-option-454007-u6".
         AUTH_SECRET (str): Secret key for authentication. Default is "notSecret".
+        TASK_PARALLELISM (int): Maximum number of subtasks solved concurrently. Default is 4.
+        DEPENDENCY_CONTEXT_MAX_CHARS (int): Characters of dependency results added to a task's prompt. Default is 20000.
+        TASK_MAX_ITERATIONS (int): Tool loop iterations per task, 0 is unlimited. Default is 20.
+        TASK_MAX_TOKENS (int): LLM tokens per task, 0 is unlimited. Default is 300000.
+        TASK_MAX_SECONDS (float): Wall-clock seconds per task, 0 is unlimited. Default is 900.
+        TASK_MAX_COMMANDS (int): Shell commands per task, 0 is unlimited. Default is 50.
+        CHAT_MAX_ITERATIONS (int): Tool loop iterations per request across all tasks, 0 is unlimited. Default is 100.
+        CHAT_MAX_TOKENS (int): LLM tokens of the tool loops per request, 0 is unlimited. Default is 1500000.
+        CHAT_MAX_SECONDS (float): Wall-clock seconds per request, 0 is unlimited. Default is 3600.
+        CHAT_MAX_COMMANDS (int): Shell commands per request, 0 is unlimited. Default is 200.
+        LOOP_DETECTION_WINDOW (int): Number of recent tool loop actions compared for repetitions. Default is 6.
+        LOOP_SIMILARITY (float): Similarity (0..1) from which two actions count as a repetition. Default is 0.9.
+        LOOP_MAX_REPEATS (int): Repetitions of an action within the window which stop the loop, 0 disables it. Default is 2.
+        REQUEST_DEADLINE (float): Seconds a request to /api/chat may take in total, 0 is unlimited. Default is 3900,
+            a little more than CHAT_MAX_SECONDS so the budget can force an answer first.
+        DEADLINE_ANSWER_RESERVE (float): Seconds before the deadline at which the tool loop stops to answer. Default is 60.
+        SHELL_COMMAND_TIMEOUT (float): Seconds to wait for the receiver to run a shell command. Default is 600.
+        SHELL_EXCHANGE_TIMEOUT (float): Seconds after which a receiver which didn't answer a command is disconnected,
+            so later commands of its user aren't blocked. Default is 900.
+        BROWSER_PAGE_LOAD_TIMEOUT (float): Seconds the browser may take to load a page. Default is 30.
+        BROWSER_POOL_SIZE (int): Maximum number of warm headless browsers rendering pages. Default is 2.
+        BROWSER_MAX_PAGES (int): Pages a browser renders before it is replaced, 0 is unlimited. Default is 50.
+        BROWSER_SETTLE_TIMEOUT (float): Maximum seconds to wait for the network to get quiet after a page loaded. Default is 5.
+        BROWSER_QUIET_WINDOW (float): Seconds without requests in flight after which a page counts as rendered. Default is 0.5.
+        BROWSER_BLOCKED_RESOURCES (list[str]): Playwright resource types not loaded when rendering pages.
+            Default is images, media, fonts and stylesheets.
+        FETCH_HTTP_TIMEOUT (float): Seconds for fetching a page without the browser. Default is 10.
+        FETCH_MIN_TEXT_CHARS (int): Visible text a static page needs to be ingested without rendering it. Default is 500.
+        FETCH_MAX_CONNECTIONS (int): Connections of the shared HTTP client used for fetching pages. Default is 20.
+        STREAM_TOKEN_DELAY (float): Delay in seconds between streamed chat tokens, 0 disables pacing. Default is 0.
+        STREAM_TOOL_CALLS (bool): Start knowledge queries while the tool call response is still streamed, commands and file updates always wait for the validated response. Default is True.
+        TOOL_CALL_MODE (str): "native" declares the agent tools as function calls, "envelope" requests the full
+            ResponseToolCall JSON, "auto" uses native tools for models litellm reports function calling for. Default is "auto".
+        PLAN_CACHE_ENABLED (bool): Adapt the plan of a similar past medium request of the same user instead of planning from scratch. Default is True.
+        PLAN_CACHE_SIMILARITY (float): Minimum cosine similarity of project descriptions to reuse a plan. Default is 0.92.
+        PLAN_CACHE_MAX_ENTRIES (int): Number of past plans kept for reuse. Default is 500.
+        CHECKPOINTS_ENABLED (bool): Persist the pipeline state of chats to resume them after a restart. Default is True.
+        SPECULATIVE_PIPELINE (bool): Gather information and draft clarification questions while the request is
+            still categorized, discarding the work for EASY requests. Default is True.
+        KNOWLEDGE_PARALLELISM (int): Maximum number of concurrent get_knowledge queries per chat. Default is 4.
+        KNOWLEDGE_INGEST_TOP_K (int): Number of new web search results loaded for a query. Default is 5.
+        KNOWLEDGE_INGEST_WORKERS (int): Web search results loaded at once per query. Default is 3.
+        KNOWLEDGE_ENOUGH_DOCS (int): Documents found for a query after which it's answered while loading goes on. Default is 2.
+        KNOWLEDGE_MAX_ROUNDS (int): Retrieval strategies tried per get_knowledge query, cheapest first. Default is 4 (all).
+        KNOWLEDGE_MAX_SECONDS (float): Seconds after which get_knowledge starts no further round. Default is 120.
+        LLM_CACHE_ENABLED (bool): Opt in to the LLM response cache for the call sites listed in LLM_CACHE_TTLS. Default is False.
+        LLM_CACHE_MAX_ENTRIES (int): Maximum number of LLM responses kept in memory. Default is 1024.
+        LLM_CACHE_TTLS (dict[str, int]): TTL in seconds per cached call site.
+        LLM_CACHE_PRUNE_INTERVAL (float): Seconds between deleting persisted LLM cache entries older than every TTL. Default is 3600.
+        LLM_CONTEXT_TOKENS (int): Context window assumed for models litellm has no limit for. Default is 32768.
+        LLM_RESPONSE_TOKEN_RESERVE (int): Tokens of the context window kept free for the response. Default is 4096.
+        LLM_LARGE_CONTEXT_MODEL (str): Model used when a tool call conversation doesn't fit after compaction. Default is "" (none).
+        COMPACTION_KEEP_RECENT (int): Number of latest messages never compacted. Default is 6.
+        COMPACTION_SNIPPET_CHARS (int): Length older tool outputs are shortened to during compaction. Default is 500.
+        CHECK_CONTEXT_MAX_CHARS (int): Maximum characters of repository context given to the Check step. Default is 40000.
+        CHECK_DIFF_CONTEXT_LINES (int): Unchanged lines shown around every change in the Check diff. Default is 10.
+        LLM_SMALL_MODEL (str): Small fast model for classification and verification calls. Default is "" (use LLM_MODEL).
+        LLM_ROUTES (dict[str, list[str]]): Models to try per call site or response_format class name, in order.
+            Entries may use the aliases "default", "small" and "large". LLM_MODEL is always the last fallback.
+        LLM_REQUEST_TIMEOUT (float): Timeout in seconds for a single LLM request. Default is 600.
+        LLM_HEDGE_ENABLED (bool): Send a duplicate request to the next routed model when a non-streamed call is slow.
+            Streamed calls, like the tool loop with STREAM_TOOL_CALLS, are never hedged. Default is True.
+        LLM_HEDGE_PERCENTILE (float): Latency percentile of a model after which a call is hedged. Default is 0.95.
+        LLM_HEDGE_MIN_SAMPLES (int): Number of recorded calls needed before a model is hedged. Default is 20.
+        LLM_LATENCY_WINDOW (int): Number of recent latencies kept per model. Default is 200.
+        LLM_MAX_RETRIES (int): Retries of a single LLM call after rate limits, overload or invalid output. Default is 3.
+        LLM_RETRY_BASE_DELAY (float): Backoff in seconds before the first retry, doubled per retry. Default is 1.
+        LLM_RETRY_MAX_DELAY (float): Upper bound in seconds of a single backoff, also for Retry-After. Default is 60.
+        LLM_RETRY_BUDGET (int): Retries allowed per model within LLM_RETRY_BUDGET_WINDOW, shared by all chats. Default is 20.
+        LLM_RETRY_BUDGET_WINDOW (float): Window in seconds of the per model retry budget. Default is 60.
+        AUXILIARY_FAST_PATH (bool): Answer Open WebUI title, tag and follow-up prompts with a single small model call
+            instead of the chat pipeline. Default is True.
         model_config (ConfigDict): Configuration for loading environment variables from a `.env` file.
     """
 
@@ -107,6 +183,9 @@ class Settings(BaseSettings):
     COLLECTION_NAME_REPOS: str = "repos"
     COLLECTION_NAME_WEB_SEARCH_CACHE: str = "googleSearchCache"
     COLLECTION_NAME_GET_KNOWLEDGE_CACHE: str = "getKnowledgeCache"
+    COLLECTION_NAME_LLM_CACHE: str = "llmCache"
+    COLLECTION_NAME_CHECKPOINTS: str = "chatCheckpoints"
+    COLLECTION_NAME_PLAN_CACHE: str = "planCache"
     EMBEDDER: str = "vertex_ai"  # vertex_ai, ollama
     EMBEDDING_MODEL: str = "mxbai-embed-large"
     VERTEX_EMBEDDING_MODEL: str = "text-embedding-005"  # Model for Vertex AI
@@ -121,6 +200,82 @@ class Settings(BaseSettings):
     GOOGLE_CLOUD_PROJECT: str = "psyched-option-454007-u6"
     GOOGLE_CLOUD_LOCATION: str = "europe-west3"
     GOOGLE_GENAI_USE_VERTEXAI: bool = True
+    TASK_PARALLELISM: int = 4
+    DEPENDENCY_CONTEXT_MAX_CHARS: int = 20000
+    TASK_MAX_ITERATIONS: int = 20
+    TASK_MAX_TOKENS: int = 300000
+    TASK_MAX_SECONDS: float = 900
+    TASK_MAX_COMMANDS: int = 50
+    CHAT_MAX_ITERATIONS: int = 100
+    CHAT_MAX_TOKENS: int = 1500000
+    CHAT_MAX_SECONDS: float = 3600
+    CHAT_MAX_COMMANDS: int = 200
+    LOOP_DETECTION_WINDOW: int = 6
+    LOOP_SIMILARITY: float = 0.9
+    LOOP_MAX_REPEATS: int = 2
+    REQUEST_DEADLINE: float = 3900
+    DEADLINE_ANSWER_RESERVE: float = 60
+    SHELL_COMMAND_TIMEOUT: float = 600
+    SHELL_EXCHANGE_TIMEOUT: float = 900
+    BROWSER_PAGE_LOAD_TIMEOUT: float = 30
+    BROWSER_POOL_SIZE: int = 2
+    BROWSER_MAX_PAGES: int = 50
+    BROWSER_SETTLE_TIMEOUT: float = 5
+    BROWSER_QUIET_WINDOW: float = 0.5
+    BROWSER_BLOCKED_RESOURCES: list[str] = ["image", "media", "font", "stylesheet"]
+    FETCH_HTTP_TIMEOUT: float = 10
+    FETCH_MIN_TEXT_CHARS: int = 500
+    FETCH_MAX_CONNECTIONS: int = 20
+    STREAM_TOKEN_DELAY: float = 0.0
+    STREAM_TOOL_CALLS: bool = True
+    TOOL_CALL_MODE: str = "auto"
+    PLAN_CACHE_ENABLED: bool = True
+    PLAN_CACHE_SIMILARITY: float = 0.92
+    PLAN_CACHE_MAX_ENTRIES: int = 500
+    CHECKPOINTS_ENABLED: bool = True
+    SPECULATIVE_PIPELINE: bool = True
+    KNOWLEDGE_PARALLELISM: int = 4
+    KNOWLEDGE_INGEST_TOP_K: int = 5
+    KNOWLEDGE_INGEST_WORKERS: int = 3
+    KNOWLEDGE_ENOUGH_DOCS: int = 2
+    KNOWLEDGE_MAX_ROUNDS: int = 4
+    KNOWLEDGE_MAX_SECONDS: float = 120
+    LLM_CACHE_ENABLED: bool = False
+    LLM_CACHE_MAX_ENTRIES: int = 1024
+    LLM_CACHE_TTLS: dict[str, int] = {
+        "categorize_request": 7 * 24 * 3600,
+        "get_clarification_questions": 24 * 3600,
+        "get_queries_for_document": 30 * 24 * 3600,
+    }
+    LLM_CACHE_PRUNE_INTERVAL: float = 3600
+    LLM_CONTEXT_TOKENS: int = 32768
+    LLM_RESPONSE_TOKEN_RESERVE: int = 4096
+    LLM_LARGE_CONTEXT_MODEL: str = ""
+    COMPACTION_KEEP_RECENT: int = 6
+    COMPACTION_SNIPPET_CHARS: int = 500
+    CHECK_CONTEXT_MAX_CHARS: int = 40000
+    CHECK_DIFF_CONTEXT_LINES: int = 10
+    LLM_SMALL_MODEL: str = ""
+    LLM_ROUTES: dict[str, list[str]] = {
+        "CategoryResponse": ["small"],
+        "Check": ["small"],
+        "merge_questions_with_response": ["small"],
+        "get_queries_for_document": ["small"],
+        "adapt_plan": ["small"],
+        "auxiliary": ["small"],
+        "rewrite_knowledge_query": ["small"],
+    }
+    LLM_REQUEST_TIMEOUT: float = 600
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_PERCENTILE: float = 0.95
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_LATENCY_WINDOW: int = 200
+    LLM_MAX_RETRIES: int = 3
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 60.0
+    LLM_RETRY_BUDGET: int = 20
+    LLM_RETRY_BUDGET_WINDOW: float = 60.0
+    AUXILIARY_FAST_PATH: bool = True
 
     # Use ConfigDict instead of class-based Config
     model_config = ConfigDict(env_file=".env")
@@ -163,6 +318,9 @@ repo_collection = get_db_client(settings.COLLECTION_NAME_REPOS)
 flow_collection = get_db_client(settings.COLLECTION_NAME_FLOWS)
 web_search_cache_collection = get_db_client(settings.COLLECTION_NAME_WEB_SEARCH_CACHE)
 get_knowledge_cache_collection = get_db_client(settings.COLLECTION_NAME_GET_KNOWLEDGE_CACHE)
+llm_cache_collection = get_db_client(settings.COLLECTION_NAME_LLM_CACHE)
+checkpoint_collection = get_db_client(settings.COLLECTION_NAME_CHECKPOINTS)
+plan_cache_collection = get_db_client(settings.COLLECTION_NAME_PLAN_CACHE)
 
 def get_text_embedder() -> TextEmbedderInterface:
     """
@@ -17,15 +17,36 @@ Attributes:
 - `app`: The FastAPI application instance.
 """
 
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI, Request
 from dotenv import load_dotenv
 from app.api import routers
 from app.config import settings, logger, query_collection, knowledge_collection
-from app.services.knowledge import get_knowledge
+from app.services.browser import browser_pool
+from app.services.fetcher import page_fetcher
+from app.services.knowledge import cancel_background_ingestions, get_knowledge
+from app.services.llm_cache import prune_llm_cache_periodically
 
 load_dotenv()
 
-app = FastAPI(title=settings.PROJECT_NAME)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Prunes the LLM cache while running, stops the background ingestions, closes the HTTP connections and the warm browsers on shutdown."""
+    pruning = asyncio.create_task(prune_llm_cache_periodically()) if settings.LLM_CACHE_ENABLED else None
+    yield
+    if pruning is not None:
+        pruning.cancel()
+        with suppress(asyncio.CancelledError):
+            await pruning
+    await cancel_background_ingestions()
+    await page_fetcher.close()
+    await browser_pool.close()
+
+
+app = FastAPI(title=settings.PROJECT_NAME, lifespan=lifespan)
 
 @app.middleware("http")
 async def log_request_headers(request: Request, call_next):
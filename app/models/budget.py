@@ -0,0 +1,93 @@
+import difflib
+import re
+import time
+from collections import Counter, deque
+from typing import Optional
+
+from app.config import settings
+
+
+class Budget:
+    """
+    Limits the work of the agent tool loop: iterations, tokens, wall-clock seconds and shell commands.
+    A limit of 0 is unlimited. Work charged to a task budget is also charged to its parent, the
+    budget of the chat, so concurrently solved tasks share the chat's limits.
+    Tokens are counted by installing usage in token_usage (see model_router.track_usage).
+    """
+
+    def __init__(self, max_iterations: int = 0, max_tokens: int = 0, max_seconds: float = 0,
+                 max_commands: int = 0, parent: "Budget" = None):
+        self.max_iterations = max_iterations
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+        self.max_commands = max_commands
+        self.parent = parent
+        self.iterations = 0
+        self.commands = 0
+        self.usage: Counter = Counter()
+        self.started = time.monotonic()
+
+    @classmethod
+    def for_chat(cls) -> "Budget":
+        return cls(max_iterations=settings.CHAT_MAX_ITERATIONS, max_tokens=settings.CHAT_MAX_TOKENS,
+                   max_seconds=settings.CHAT_MAX_SECONDS, max_commands=settings.CHAT_MAX_COMMANDS)
+
+    @classmethod
+    def for_task(cls, parent: "Budget" = None) -> "Budget":
+        return cls(max_iterations=settings.TASK_MAX_ITERATIONS, max_tokens=settings.TASK_MAX_TOKENS,
+                   max_seconds=settings.TASK_MAX_SECONDS, max_commands=settings.TASK_MAX_COMMANDS, parent=parent)
+
+    def counters(self) -> list[Counter]:
+        """Returns the usage counters of this budget and its parents."""
+        return [self.usage, *(self.parent.counters() if self.parent else [])]
+
+    def charge(self, iterations: int = 0, commands: int = 0):
+        self.iterations += iterations
+        self.commands += commands
+        if self.parent is not None:
+            self.parent.charge(iterations=iterations, commands=commands)
+
+    def exceeded(self) -> Optional[str]:
+        """Returns why this budget or its parent is used up, None while there is budget left."""
+        elapsed = time.monotonic() - self.started
+        limits = [
+            ("iterations", self.iterations, self.max_iterations),
+            ("tokens", self.usage["total_tokens"], self.max_tokens),
+            ("seconds", elapsed, self.max_seconds),
+            ("shell commands", self.commands, self.max_commands),
+        ]
+        for name, used, limit in limits:
+            if limit and used >= limit:
+                return f"{name} limit of {limit:g} reached"
+        return self.parent.exceeded() if self.parent is not None else None
+
+
+def normalize_action(action: str) -> str:
+    """Lowercases action and blanks out numbers and whitespace runs, which vary between retries."""
+    return re.sub(r"\s+", " ", re.sub(r"\d+", "0", action.lower())).strip()
+
+
+class RepetitionDetector:
+    """
+    Detects an agent going in circles, e.g. repeating a failing command or rephrasing the same
+    knowledge query. An action repeats if it is at least similarity alike (difflib ratio) to
+    max_repeats of the last window actions which had the same outcome. An action whose outcome
+    changed, like a test run after an edit which fixed some of the tests, is progress.
+    """
+
+    def __init__(self, window: int, similarity: float, max_repeats: int):
+        self.similarity = similarity
+        self.max_repeats = max_repeats
+        self._recent: deque[tuple[str, Optional[str]]] = deque(maxlen=window)
+
+    def add(self, action: str, outcome: str = None) -> bool:
+        """Records action with outcome, e.g. a hash of its results, and returns True if it repeats."""
+        action = normalize_action(action)
+        if not action:
+            return False
+        repeats = sum(
+            1 for previous, previous_outcome in self._recent
+            if previous_outcome == outcome and difflib.SequenceMatcher(None, previous, action).ratio() >= self.similarity
+        )
+        self._recent.append((action, outcome))
+        return 0 < self.max_repeats <= repeats
@@ -1,9 +1,17 @@
 import asyncio
+from contextvars import ContextVar
 from enum import Enum
 import re
-from typing import Optional
+from typing import AsyncIterator, Optional
 from pydantic import BaseModel, EmailStr, Field, PrivateAttr
 
+from app.config import settings
+from app.models.budget import Budget
+
+
+# Tag prepended to chat messages, set per asyncio task while solving a subtask
+task_tag: ContextVar[Optional[str]] = ContextVar("task_tag", default=None)
+
 
 class DifficultyLevel(str, Enum):
     """Enum representing different levels of difficulty."""
@@ -26,6 +34,7 @@ class Roles(str, Enum):
     SYSTEM = "system"
     USER = "user"
     ASSISTANT = "assistant"  # Optional: commonly used in LLM/chat roles
+    TOOL = "tool"  # Results of native tool calls
 
     def __str__(self):
         return self.value
@@ -103,29 +112,135 @@ class Chat(BaseModel):
     project_description: Optional[str] = Field(default=None, description="Description of the project.")
     # Mark queue as a private attribute that's not part of the model schema
     _queue: asyncio.Queue = PrivateAttr(default_factory=asyncio.Queue)
+    # Keeps concurrently solved tasks from interleaving the tokens of a message or of a streamed chunk
+    _queue_lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+    # The stream which queued last, a stream whose chunks were interrupted repeats its task tag
+    _last_stream: Optional[object] = PrivateAttr(default=None)
+    # Limits concurrent get_knowledge lookups across all tasks of the chat
+    _knowledge_semaphore: asyncio.Semaphore = PrivateAttr(
+        default_factory=lambda: asyncio.Semaphore(max(1, settings.KNOWLEDGE_PARALLELISM))
+    )
+    # Limits the tool loops of the current request across all of its tasks
+    _budget: Budget = PrivateAttr(default_factory=Budget.for_chat)
 
     class Config:
         arbitrary_types_allowed = True  # Needed for asyncio.Queue and custom types
 
+    @property
+    def knowledge_semaphore(self) -> asyncio.Semaphore:
+        return self._knowledge_semaphore
+
+    @property
+    def budget(self) -> Budget:
+        return self._budget
+
+    @budget.setter
+    def budget(self, budget: Budget):
+        self._budget = budget
+
+    def reset_budget(self):
+        """Starts a new chat budget, once per request."""
+        self._budget = Budget.for_chat()
+
     async def get_queue_msg(self):
         return await self._queue.get()
 
+    def has_queued_msg(self) -> bool:
+        """Returns True if output is queued which wasn't taken by get_queue_msg yet."""
+        return not self._queue.empty()
+
     async def set_message(self, content: str, role: Roles = Roles.ASSISTANT):
         """
         Add a message to the chat and optionally process it via the queue.
+        If called from within a subtask, the message is prefixed with the task tag.
+        Tokens are paced by settings.STREAM_TOKEN_DELAY, without a delay the message is queued at once.
         """
+        tag = task_tag.get()
+        if tag and content != "[DONE]":
+            content = f"[{tag}] {content}"
         self.messages.append(Message(role=role, content=content))
-        tokens = re.findall(r'\S+|\s+', content)  # Matches non-whitespace sequences or whitespace sequences
-        for token in tokens:
-            await self._queue.put(token)
-            await asyncio.sleep(0.03)
+        # Matches non-whitespace sequences or whitespace sequences
+        tokens = re.findall(r'\S+|\s+', content) if settings.STREAM_TOKEN_DELAY else [content]
+        async with self._queue_lock:
+            self._last_stream = None
+            for token in tokens:
+                await self._queue.put(token)
+                if settings.STREAM_TOKEN_DELAY:
+                    await asyncio.sleep(settings.STREAM_TOKEN_DELAY)
+
+    async def stream_message(self, chunks: AsyncIterator[str], role: Roles = Roles.ASSISTANT) -> str:
+        """
+        Forward chunks to the queue as they arrive and add the assembled text as a single message.
+        The queue is only locked per chunk, so other tasks can write while the LLM generates; if they
+        did, the next chunk starts on a new line with the task tag again.
+        If chunks fails after some of them were queued, the partial message is added to the chat
+        and marked as interrupted, so a retry doesn't continue it unnoticed.
+        Returns the assembled text without the task tag.
+        """
+        tag = task_tag.get()
+        prefix = f"[{tag}] " if tag else ""
+        stream = object()
+        parts = []
+        try:
+            async for chunk in chunks:
+                async with self._queue_lock:
+                    if self._last_stream is not stream:
+                        self._last_stream = stream
+                        resumed = f"\n\n{prefix}" if parts else prefix
+                        if resumed:
+                            await self._queue.put(resumed)
+                    await self._queue.put(chunk)
+                parts.append(chunk)
+                if settings.STREAM_TOKEN_DELAY:
+                    await asyncio.sleep(settings.STREAM_TOKEN_DELAY)
+        except Exception:
+            if parts:
+                notice = "\n\n⚠️ The answer was interrupted, starting over ...\n\n"
+                async with self._queue_lock:
+                    self._last_stream = None
+                    await self._queue.put(notice)
+                self.messages.append(Message(role=role, content=prefix + "".join(parts) + notice))
+            raise
+        content = "".join(parts)
+        self.messages.append(Message(role=role, content=prefix + content))
+        return content
+
+    def speculative_copy(self) -> "Chat":
+        """Returns a chat for the same user and request whose output is held back until relayed."""
+        copy = Chat(id=self.id, user=self.user, original_request=self.original_request)
+        copy.budget = self.budget
+        return copy
+
+    async def relay(self, source: "Chat", until: asyncio.Future):
+        """
+        Forwards the queued output of source, e.g. a speculative copy, into this chat until
+        until is done and the output of source is drained. The messages of source are added afterwards.
+        """
+        while not until.done() or source.has_queued_msg():
+            getter = asyncio.ensure_future(source.get_queue_msg())
+            await asyncio.wait([getter, until], return_when=asyncio.FIRST_COMPLETED)
+            if not getter.done():
+                getter.cancel()
+                continue
+            async with self._queue_lock:
+                self._last_stream = None
+                await self._queue.put(getter.result())
+        self.messages.extend(source.messages)
+
+
 
+class FileEdit(BaseModel):
+    """A search/replace edit of a single file."""
+    file_path: str = Field(..., description="Path of the file to edit.")
+    search: str = Field(..., description="Exact text to replace, must occur once in the file. Empty to create a new file.")
+    replace: str = Field(..., description="Text to put in place of search.")
 
 
 class ResponseToolCall(BaseModel):
     done: bool = Field(..., description="True if the task is done, False otherwise.")
     message: str = Field(..., description="Message to the user.")
     repo_update: dict = Field(..., description="Files updates format {filePath: content}.")
+    repo_edits: list[FileEdit] = Field(default_factory=list, description="Search/replace edits of existing files, applied all or nothing.")
     text_result: str = Field(..., description="Text result of the task.")
     get_knowledge: list[str] = Field(..., description="Queries to use to retrieve knowledge.")
     commands: list[str] = Field(..., description="Commands to execute.")
@@ -1,9 +1,57 @@
 import os
+import re
 import uuid
 import shutil
 from pathlib import Path
-from git import Repo as GitRepo, GitCommandError
+from git import Repo as GitRepo, GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 from app.config import logger
+from app.models.models import FileEdit
+
+
+class EditConflictError(ValueError):
+    """Raised if edits can't be applied, none of them is applied then."""
+
+    def __init__(self, conflicts: list[str]):
+        super().__init__("\n".join(conflicts))
+        self.conflicts = conflicts
+
+
+def replace_once(content: str, search: str, replace: str) -> str:
+    """
+    Replaces the single occurrence of search in content.
+    If search doesn't occur verbatim, lines are compared ignoring trailing whitespace.
+    Raises ValueError if search is empty, not found or ambiguous.
+    """
+    if not search:
+        raise ValueError("search is empty but the file exists")
+    count = content.count(search)
+    if count == 1:
+        return content.replace(search, replace)
+    if count > 1:
+        raise ValueError(f"search occurs {count} times, add surrounding lines to make it unique")
+
+    lines = content.splitlines(keepends=True)
+    search_lines = [line.rstrip() for line in search.splitlines()]
+    matches = [
+        i for i in range(len(lines) - len(search_lines) + 1)
+        if [line.rstrip() for line in lines[i:i + len(search_lines)]] == search_lines
+    ]
+    if len(matches) != 1:
+        raise ValueError("search not found" if not matches else f"search occurs {len(matches)} times, add surrounding lines to make it unique")
+    start, end = matches[0], matches[0] + len(search_lines)
+    if replace and not replace.endswith("\n") and lines[end - 1].endswith("\n"):
+        replace += "\n"
+    return "".join(lines[:start]) + replace + "".join(lines[end:])
+
+
+TRUNCATED = "\n... [truncated]"
+
+
+def read_head(path: Path, max_chars: int) -> tuple[str, bool]:
+    """Returns the first max_chars characters of the text file path and whether it is longer, without reading the rest."""
+    with path.open(encoding="utf-8", errors="replace") as file:
+        text = file.read(max_chars + 1)
+    return text[:max_chars], len(text) > max_chars
 
 
 class Repo:
@@ -43,6 +91,19 @@ class Repo:
             self.repo = GitRepo.clone_from(url, self.local_path)
 
 
+    @classmethod
+    def reopen(cls, repo_uuid: str, name: str, local_path: str) -> "Repo":
+        """Opens an existing working copy, e.g. to resume a chat. Raises ValueError if there is none."""
+        repo = cls.__new__(cls)
+        repo.uuid = repo_uuid
+        repo.name = name
+        repo.local_path = Path(local_path)
+        try:
+            repo.repo = GitRepo(repo.local_path)
+        except (InvalidGitRepositoryError, NoSuchPathError) as e:
+            raise ValueError(f"No repository at {local_path}") from e
+        return repo
+
     def load_files(self) -> dict:
         """
         Load all files in the repository into a dictionary.
@@ -73,6 +134,62 @@ class Repo:
             #self.repo.index.add([str(full_path.relative_to(self.local_path))])
         #self.repo.index.commit("Updated files")
 
+    def apply_edits(self, edits: list[FileEdit]):
+        """
+        Applies search/replace edits transactionally: all edits are checked against the current
+        files first and written only if every one of them applies, otherwise EditConflictError
+        lists the conflicts. Edits of the same file are applied in order.
+        An empty search creates a file which doesn't exist yet.
+        """
+        contents: dict[str, str] = {}
+        unreadable: set[str] = set()
+        conflicts = []
+        root = self.local_path.resolve()
+        for edit in edits:
+            full_path = (self.local_path / edit.file_path).resolve()
+            if not full_path.is_relative_to(root):
+                conflicts.append(f"{edit.file_path}: path is outside of the repository")
+                continue
+            if edit.file_path in unreadable:
+                continue
+            if edit.file_path not in contents:
+                try:
+                    contents[edit.file_path] = full_path.read_text(encoding="utf-8") if full_path.is_file() else None
+                except (OSError, UnicodeDecodeError) as e:
+                    # Binary and non UTF-8 files can't be edited as text
+                    conflicts.append(f"{edit.file_path}: file can't be read as text, {e}")
+                    unreadable.add(edit.file_path)
+                    continue
+            content = contents[edit.file_path]
+            if content is None:
+                if edit.search:
+                    conflicts.append(f"{edit.file_path}: file does not exist, use an empty search to create it")
+                else:
+                    contents[edit.file_path] = edit.replace
+                continue
+            try:
+                contents[edit.file_path] = replace_once(content, edit.search, edit.replace)
+            except ValueError as e:
+                conflicts.append(f"{edit.file_path}: {e}")
+        if conflicts:
+            raise EditConflictError(conflicts)
+
+        originals = {}
+        try:
+            for file_path, content in contents.items():
+                full_path = self.local_path / file_path
+                originals[file_path] = full_path.read_text(encoding="utf-8") if full_path.is_file() else None
+                full_path.parent.mkdir(parents=True, exist_ok=True)
+                full_path.write_text(content, encoding="utf-8")
+        except OSError:
+            for file_path, original in originals.items():
+                full_path = self.local_path / file_path
+                if original is None:
+                    full_path.unlink(missing_ok=True)
+                else:
+                    full_path.write_text(original, encoding="utf-8")
+            raise
+
     def create_branch(self, branch_name: str):
         """Create a new branch."""
         self.repo.git.branch(branch_name)
@@ -120,6 +237,68 @@ class Repo:
         except GitCommandError as e:
             raise RuntimeError(f"Error getting git diff: {e}") from e
 
+    def get_review_context(self, max_chars: int, context_lines: int = 10) -> str:
+        """
+        Builds the context to verify the uncommitted changes, limited to about max_chars characters.
+
+        It contains the diff with context_lines lines around each change, new files, the full
+        touched files if there is room left and a manifest of all files. If the diff alone exceeds
+        max_chars, it is summarized by the diff stat and the beginning of every file's diff.
+        """
+        try:
+            diff = self.repo.git.diff(f"-U{context_lines}")
+            changed = self.repo.git.diff("--name-only").splitlines()
+            untracked = self.repo.untracked_files
+            tracked = self.repo.git.ls_files().splitlines()
+        except GitCommandError as e:
+            raise RuntimeError(f"Error getting git diff: {e}") from e
+
+        new_files = {}
+        for file_path in untracked:
+            full_path = self.local_path / file_path
+            if full_path.is_file():
+                # A new file longer than the whole context, e.g. build output, can only be shown in part
+                content, truncated = read_head(full_path, max_chars)
+                new_files[file_path] = content + TRUNCATED if truncated else content
+        changes = "\n\n".join([diff, *(f"New file {path}:\n{content}" for path, content in new_files.items())]).strip()
+
+        if len(changes) > max_chars:
+            changes = self._summarize_changes(changes, diff, new_files, max_chars)
+        sections = [f"Diff:\n{changes or '(no changes)'}"]
+        budget = max_chars - len(sections[0])
+
+        for file_path in changed:
+            full_path = self.local_path / file_path
+            if not full_path.is_file():
+                continue
+            content, truncated = read_head(full_path, max(0, budget))
+            if truncated:
+                continue
+            section = f"Touched file {file_path}:\n{content}"
+            if len(section) <= budget:
+                sections.append(section)
+                budget -= len(section)
+
+        manifest = "\n".join(sorted(set(tracked) | set(new_files)))
+        if len(manifest) > budget:
+            manifest = manifest[:max(0, budget)].rsplit("\n", 1)[0] + "\n..."
+        sections.append(f"Files in the repository:\n{manifest}")
+        return "\n\n".join(sections)
+
+    def _summarize_changes(self, changes: str, diff: str, new_files: dict, max_chars: int) -> str:
+        logger.info("Changes of %d characters exceed %d, summarizing them", len(changes), max_chars)
+        stat = self.repo.git.diff("--stat")
+        new_stat = "\n".join(
+            f" {path} | new file, " + (f"over {max_chars} characters" if content.endswith(TRUNCATED) else f"{content.count(chr(10)) + 1} lines")
+            for path, content in new_files.items()
+        )
+        parts = [part for part in re.split(r"(?m)^(?=diff --git )", diff) if part.strip()]
+        parts.extend(f"New file {path}:\n{content}" for path, content in new_files.items())
+        summary = f"The changes are too large to show completely. Summary:\n{stat}\n{new_stat}".strip()
+        share = max(0, (max_chars - len(summary)) // max(1, len(parts)))
+        excerpts = [part if len(part) <= share else part[:share] + TRUNCATED for part in parts]
+        return "\n\n".join([summary, *excerpts])
+
     def create_zip(self, output_path: str = None) -> str:
         """
         Create a ZIP file of the repository.
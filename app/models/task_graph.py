@@ -0,0 +1,71 @@
+from typing import Iterator
+
+from app.models.models import Task
+
+
+class TaskGraph:
+    """
+    Index over the tasks of a plan, built once per plan.
+
+    Tasks are looked up by unique_id in O(1). Building the graph validates the dependsOn references
+    and computes a topological order and the transitive dependencies of every task.
+    Raises ValueError if a task depends on an unknown id or the dependencies form a cycle.
+    """
+
+    def __init__(self, tasks: list[Task]):
+        self._by_id: dict[str, Task] = {}
+        for task in tasks:
+            if task.unique_id in self._by_id:
+                raise ValueError(f"Task id {task.unique_id} is used more than once")
+            self._by_id[task.unique_id] = task
+        for task in tasks:
+            missing = [dep_id for dep_id in task.dependsOn or [] if dep_id not in self._by_id]
+            if missing:
+                raise ValueError(f"Task {task.unique_id} depends on unknown tasks {missing}")
+
+        self.order: list[Task] = self._sort(tasks)
+        self._position = {task.unique_id: i for i, task in enumerate(self.order)}
+        # Transitive dependencies per task in topological order, built from the dependencies' closures
+        self._closure: dict[str, list[str]] = {}
+        for task in self.order:
+            ancestors = set()
+            for dep_id in task.dependsOn or []:
+                ancestors.update(self._closure[dep_id])
+                ancestors.add(dep_id)
+            self._closure[task.unique_id] = sorted(ancestors, key=self._position.__getitem__)
+
+    def _sort(self, tasks: list[Task]) -> list[Task]:
+        ordered = []
+        state = {}  # unique_id -> "visiting" | "done"
+
+        def visit(task: Task, path: list[str]):
+            if state.get(task.unique_id) == "done":
+                return
+            if state.get(task.unique_id) == "visiting":
+                cycle = path[path.index(task.unique_id):] + [task.unique_id]
+                raise ValueError(f"Task dependencies contain a cycle: {' -> '.join(cycle)}")
+            state[task.unique_id] = "visiting"
+            for dep_id in task.dependsOn or []:
+                visit(self._by_id[dep_id], path + [task.unique_id])
+            state[task.unique_id] = "done"
+            ordered.append(task)
+
+        for task in tasks:
+            visit(task, [])
+        return ordered
+
+    def __getitem__(self, unique_id: str) -> Task:
+        return self._by_id[unique_id]
+
+    def __contains__(self, unique_id: str) -> bool:
+        return unique_id in self._by_id
+
+    def __iter__(self) -> Iterator[Task]:
+        return iter(self.order)
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def ancestors(self, unique_id: str) -> list[Task]:
+        """Returns all direct and transitive dependencies of a task once each, in topological order."""
+        return [self._by_id[dep_id] for dep_id in self._closure[unique_id]]
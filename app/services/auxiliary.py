@@ -0,0 +1,42 @@
+import re
+from collections import Counter
+from typing import Optional
+
+from app.config import logger
+from app.models.models import Message, Roles
+from app.services.llm_wrapper import llm_call_wrapper
+
+# Open WebUI sends its background tasks as new single message chats built from these templates
+AUXILIARY_PATTERNS = {
+    "title": re.compile(r"(generate|create) a concise, 3-5 word title", re.IGNORECASE),
+    "tags": re.compile(r"generate 1-3 broad tags", re.IGNORECASE),
+    "follow_ups": re.compile(r"suggest 3-5 relevant follow-up questions", re.IGNORECASE),
+    "queries": re.compile(r"determine the necessity of generating search queries", re.IGNORECASE),
+    "autocomplete": re.compile(r"you are an autocompletion system", re.IGNORECASE),
+    "emoji": re.compile(r"reflect the speaker's likely facial expression", re.IGNORECASE),
+}
+
+auxiliary_counters: Counter = Counter()
+
+
+def detect_auxiliary(messages: list[Message]) -> Optional[str]:
+    """Returns the kind of an Open WebUI auxiliary prompt, None for a regular user request."""
+    if len(messages) != 1 or messages[0].role != Roles.USER:
+        return None
+    content = messages[0].content or ""
+    for kind, pattern in AUXILIARY_PATTERNS.items():
+        if pattern.search(content):
+            return kind
+    if content.lstrip().startswith("### Task:") and "<chat_history>" in content:
+        return "other"
+    return None
+
+
+async def answer_auxiliary(kind: str, messages: list[Message]) -> str:
+    """Answers an auxiliary prompt with a single small model call, without any chat state."""
+    auxiliary_counters[kind] += 1
+    logger.info("Answering auxiliary %s prompt directly", kind)
+    return await llm_call_wrapper(
+        call_site="auxiliary",
+        messages=[message.model_dump() for message in messages],
+    )
@@ -1,86 +1,226 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.common.exceptions import TimeoutException
-from selenium_stealth import stealth
-from webdriver_manager.chrome import ChromeDriverManager
+import asyncio
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlparse
 
-from app.config import logger
+from playwright.async_api import Browser, Error as PlaywrightError, Page, Playwright, Route, TimeoutError as PlaywrightTimeoutError, async_playwright
+
+from app.config import logger, settings
+from app.services.deadline import cap_timeout
+from app.services.model_router import LatencyTracker
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36"
+LAUNCH_ARGS = ["--disable-blink-features=AutomationControlled", "--disable-notifications"]
+# Hides the automation flag from the page, like selenium-stealth did
+STEALTH_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined});"
+# Analytics and ad hosts, requests to them and their subdomains are blocked
+BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "facebook.net", "hotjar.com", "segment.io", "segment.com", "mixpanel.com", "clarity.ms",
+)
+# Per domain timeouts are TIMEOUT_FACTOR times the TIMEOUT_PERCENTILE of its recent renders
+TIMEOUT_PERCENTILE = 0.9
+TIMEOUT_FACTOR = 2
+TIMEOUT_MIN_SAMPLES = 3
+MIN_LOAD_TIMEOUT = 5
+
+
+def is_blocked_host(host: Optional[str]) -> bool:
+    return bool(host) and any(host == blocked or host.endswith(f".{blocked}") for blocked in BLOCKED_HOSTS)
 
-def create_stealth_driver():
-    """
-    Initializes a Chrome WebDriver with stealth configurations to reduce detection.
 
-    Returns:
-        webdriver.Chrome: A configured instance of Chrome WebDriver.
+class NetworkIdle:
+    """
+    Follows the requests of a page and signals once none has been in flight for quiet seconds,
+    instead of polling the page. Blocked requests count as failed and finish right away.
     """
-    chrome_options = Options()
 
-    # Browser window and behavior
-    chrome_options.add_argument("--start-maximized")
+    def __init__(self, page: Page, quiet: float):
+        self.quiet = quiet
+        self._in_flight: set = set()
+        self._idle = asyncio.Event()
+        self._timer: asyncio.TimerHandle = None
+        page.on("request", self._started)
+        page.on("requestfinished", self._finished)
+        page.on("requestfailed", self._finished)
 
-    # Uncomment for headless mode if needed (new mode is better for stealth)
-    chrome_options.add_argument("--headless=new")
+    def _started(self, request):
+        self._in_flight.add(request)
+        # A quiet gap before this request, e.g. while the document loaded, doesn't count
+        self._idle.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
 
-    # Custom user-agent to mimic a real browser
-    chrome_options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36")
+    def _finished(self, request):
+        self._in_flight.discard(request)
+        self._arm()
 
-    # Disable automation-related flags to avoid detection
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    chrome_options.add_experimental_option("useAutomationExtension", False)
-    chrome_options.add_argument("--disable-notifications")
+    def _arm(self):
+        if not self._in_flight and self._timer is None and not self._idle.is_set():
+            self._timer = asyncio.get_running_loop().call_later(self.quiet, self._idle.set)
 
-    # Initialize Chrome WebDriver
-    driver = webdriver.Chrome(
-        service=Service(ChromeDriverManager().install()),
-        options=chrome_options
-    )
+    async def wait(self, timeout: float) -> bool:
+        """Waits up to timeout seconds for the network to be quiet, returns False if it wasn't."""
+        self._arm()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except TimeoutError:
+            return False
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
 
-    # Apply stealth techniques
-    stealth(
-        driver,
-        languages=["en-US", "en"],
-        vendor="Google Inc. (Apple)",
-        platform="MacIntel",
-        webgl_vendor="Google Inc. (Apple)",
-        renderer="ANGLE (Apple, ANGLE Metal Renderer: Apple M1 Max, Unspecified Version)",
-        fix_hairline=True,
-    )
 
-    return driver
+class PooledBrowser:
+    """A warm browser of the BrowserPool and the number of pages it has rendered."""
 
+    def __init__(self, browser: Browser):
+        self.browser = browser
+        self.pages = 0
 
-def get_page_with_selenium(url: str) -> str:
-    """getPageWithSelenium
-    Fetches the HTML content of a page using a stealth-enabled Selenium driver.
 
-    Args:
-        url (str): The target webpage URL.
+class BrowserPool:
+    """
+    Keeps up to size headless Chromium browsers warm for rendering pages with Playwright.
 
-    Returns:
-        str: HTML content of the loaded page.
+    Every page is rendered in its own browser context, so pages share no cookies or storage, and
+    resources which don't add text (settings.BROWSER_BLOCKED_RESOURCES, BLOCKED_HOSTS) are not loaded.
+    A browser is recycled after max_pages pages or when it crashed. Callers wait while all
+    browsers are busy. Playwright is started with the first page.
     """
-    driver = create_stealth_driver()
-
-    try:
-        driver.get(url)
-        WebDriverWait(driver, 3).until(
-            lambda d: d.execute_script(
-                """
-                return window.performance.getEntriesByType('resource')
-                .filter(e => ['xmlhttprequest', 'fetch', 'script', 'css', 'iframe', 'beacon', 'other'].includes(e.initiatorType)).length === 0;
-                """
-            )
-        )
-        page_source = driver.page_source
-        logger.info("Could load page %s, not None", url)
-    except TimeoutException as e:
-        print("Timeout waiting for network requests:", e)
-        page_source = driver.page_source
-        logger.info("Getting page even if not fully loaded %s", url)
-        logger.info("Page source {len(page_source)}")
-        return page_source
-    finally:
-        driver.quit()
-    return None
+
+    def __init__(self, size: int, max_pages: int):
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.counters: Counter = Counter()
+        self._idle: list[PooledBrowser] = []
+        self._semaphore = asyncio.Semaphore(self.size)
+        self._lock = asyncio.Lock()
+        self._playwright: Playwright = None
+        # Recent load and settle times per domain, see page_timeouts
+        self.load_times = LatencyTracker(window=20, min_samples=TIMEOUT_MIN_SAMPLES)
+        self.settle_times = LatencyTracker(window=20, min_samples=TIMEOUT_MIN_SAMPLES)
+
+    async def _launch(self) -> PooledBrowser:
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+        browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        self.counters["launched"] += 1
+        return PooledBrowser(browser)
+
+    async def _retire(self, pooled: PooledBrowser):
+        try:
+            await pooled.browser.close()
+        except PlaywrightError as e:
+            logger.warning("Closing a browser failed: %s", e)
+
+    @asynccontextmanager
+    async def browser(self):
+        """Lends a warm browser, launching one if none is idle, and takes it back afterwards."""
+        async with self._semaphore:
+            pooled = None
+            while self._idle and pooled is None:
+                pooled = self._idle.pop()
+                if not pooled.browser.is_connected():
+                    self.counters["crashed"] += 1
+                    pooled = None
+            if pooled is None:
+                pooled = await self._launch()
+            try:
+                yield pooled
+            finally:
+                pooled.pages += 1
+                if not pooled.browser.is_connected():
+                    self.counters["crashed"] += 1
+                    await self._retire(pooled)
+                elif self.max_pages and pooled.pages >= self.max_pages:
+                    self.counters["recycled"] += 1
+                    await self._retire(pooled)
+                else:
+                    self._idle.append(pooled)
+
+    def page_timeouts(self, domain: str) -> tuple[float, float]:
+        """
+        Returns the load and settle timeouts for a page of domain. Once a domain has enough recent
+        renders, they are derived from its slow renders and only bounded by the configured maximums.
+        Renders which timed out are recorded with the time they were given, so the timeouts of a
+        domain which got slower grow again.
+        """
+        load_timeout = settings.BROWSER_PAGE_LOAD_TIMEOUT
+        settle_timeout = settings.BROWSER_SETTLE_TIMEOUT
+        load_time = self.load_times.percentile(domain, TIMEOUT_PERCENTILE)
+        if load_time is not None:
+            load_timeout = min(load_timeout, max(MIN_LOAD_TIMEOUT, load_time * TIMEOUT_FACTOR))
+        settle_time = self.settle_times.percentile(domain, TIMEOUT_PERCENTILE)
+        if settle_time is not None:
+            settle_timeout = min(settle_timeout, max(2 * settings.BROWSER_QUIET_WINDOW, settle_time * TIMEOUT_FACTOR))
+        return load_timeout, settle_timeout
+
+    async def _route(self, route: Route):
+        """Aborts requests for resources which don't add text, like images, fonts and trackers."""
+        request = route.request
+        if request.resource_type in settings.BROWSER_BLOCKED_RESOURCES or is_blocked_host(urlparse(request.url).hostname):
+            self.counters["blocked_requests"] += 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def fetch(self, url: str, timeout: float = None) -> Optional[str]:
+        """
+        Renders url and returns its HTML, None if it couldn't be loaded. After the document is loaded,
+        the page is given until the network is quiet (see NetworkIdle), if it doesn't get quiet in time
+        the HTML rendered so far is returned. The timeouts are capped to the request deadline.
+        """
+        domain = urlparse(url).netloc
+        load_timeout, settle_timeout = self.page_timeouts(domain)
+        load_timeout = cap_timeout(timeout or load_timeout, f"loading {url}")
+        async with self.browser() as pooled:
+            self.counters["pages"] += 1
+            context = await pooled.browser.new_context(user_agent=USER_AGENT, locale="en-US")
+            try:
+                await context.add_init_script(STEALTH_SCRIPT)
+                await context.route("**/*", self._route)
+                page = await context.new_page()
+                network = NetworkIdle(page, settings.BROWSER_QUIET_WINDOW)
+                started = time.monotonic()
+                try:
+                    await page.goto(url, timeout=load_timeout * 1000, wait_until="domcontentloaded")
+                    loaded = time.monotonic()
+                    self.load_times.record(domain, loaded - started)
+                    settled = await network.wait(cap_timeout(settle_timeout, f"rendering {url}"))
+                    self.settle_times.record(domain, time.monotonic() - loaded)
+                    if not settled:
+                        self.counters["settle_timeouts"] += 1
+                        logger.info("Getting page even if not fully loaded %s", url)
+                except PlaywrightTimeoutError:
+                    self.load_times.record(domain, time.monotonic() - started)
+                    self.counters["load_timeouts"] += 1
+                    logger.info("Getting page even if not fully loaded %s", url)
+                return await page.content()
+            except PlaywrightError as e:
+                self.counters["failed"] += 1
+                logger.warning("Could not load page %s: %s", url, e)
+                return None
+            finally:
+                try:
+                    await context.close()
+                except PlaywrightError:
+                    # The browser crashed, it is retired when it is taken back
+                    pass
+
+    async def close(self):
+        """Closes all idle browsers and stops Playwright."""
+        idle, self._idle = self._idle, []
+        for pooled in idle:
+            await self._retire(pooled)
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+browser_pool = BrowserPool(size=settings.BROWSER_POOL_SIZE, max_pages=settings.BROWSER_MAX_PAGES)
@@ -0,0 +1,126 @@
+import time
+from enum import Enum
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from app.config import checkpoint_collection, logger, settings
+from app.models.models import Agent, Chat
+from app.models.repo import Repo
+
+
+class Stage(str, Enum):
+    """Stages of the chat pipeline after which a checkpoint is written."""
+    CATEGORIZED = "categorized"
+    CLARIFYING = "clarifying"
+    DESCRIBED = "described"
+    PLANNED = "planned"
+    DONE = "done"
+
+
+class RepoRef(BaseModel):
+    """Locates the working copy of a chat's repository."""
+    uuid: str
+    name: str
+    local_path: str
+    created: bool = Field(default=False, description="True if the repository was created for the chat, not cloned.")
+
+
+class ChatCheckpoint(BaseModel):
+    """
+    Pipeline state of a chat, persisted after every stage and every solved task so a chat can be
+    resumed after a restart without repeating completed LLM calls and shell commands.
+    """
+    chat_id: str
+    stage: Stage
+    chat: dict = Field(description="The chat without its messages, see Chat.model_dump.")
+    agent: Optional[Agent] = None
+    repo: Optional[RepoRef] = None
+    task_results: dict[str, str] = Field(default_factory=dict, description="Results of the solved tasks by unique_id.")
+    in_progress: bool = Field(default=True, description="True while a request of the chat is processed, still True if it was interrupted, e.g. by a restart.")
+    timestamp: float = Field(default_factory=time.time)
+
+
+def load_checkpoint(chat_id: str) -> Optional[ChatCheckpoint]:
+    if not settings.CHECKPOINTS_ENABLED:
+        return None
+    doc = checkpoint_collection.find_one({"chat_id": chat_id})
+    if doc is None:
+        return None
+    try:
+        return ChatCheckpoint.model_validate(doc)
+    except ValueError as e:
+        logger.warning("Ignoring invalid checkpoint of chat %s: %s", chat_id, e)
+        return None
+
+
+def _write(checkpoint: ChatCheckpoint):
+    checkpoint.timestamp = time.time()
+    doc = checkpoint_collection.find_one({"chat_id": checkpoint.chat_id})
+    if doc is not None:
+        checkpoint_collection.delete(doc)
+    checkpoint_collection.insert(checkpoint.model_dump(mode="json"))
+
+
+def save_checkpoint(chat: Chat, stage: Stage, agent: Agent = None, repo: RepoRef = None):
+    """
+    Writes the current state of chat as reached stage, keeping agent, repo and task results saved before.
+    Stage.CATEGORIZED starts a new run, e.g. the same first message sent again after a finished
+    run, so it replaces the checkpoint instead of inheriting the state of the previous run.
+    """
+    if not settings.CHECKPOINTS_ENABLED:
+        return
+    previous = load_checkpoint(chat.id) if stage != Stage.CATEGORIZED else None
+    checkpoint = previous or ChatCheckpoint(chat_id=chat.id, stage=stage, chat={})
+    checkpoint.stage = stage
+    checkpoint.chat = chat.model_dump(mode="json", exclude={"messages"})
+    checkpoint.agent = agent or checkpoint.agent
+    checkpoint.repo = repo or checkpoint.repo
+    checkpoint.in_progress = True
+    _write(checkpoint)
+    logger.info("Checkpoint of chat %s at stage %s", chat.id, stage.value)
+
+
+def end_request(chat: Chat):
+    """Marks the checkpoint of chat as no longer in progress once a request was processed, see restore_chat."""
+    if not settings.CHECKPOINTS_ENABLED:
+        return
+    checkpoint = load_checkpoint(chat.id)
+    if checkpoint is None:
+        return
+    checkpoint.in_progress = False
+    _write(checkpoint)
+
+
+def save_task_result(chat: Chat, task_id: str, result: str):
+    """Records a solved task, result is the text result or "" for repo tasks."""
+    if not settings.CHECKPOINTS_ENABLED:
+        return
+    checkpoint = load_checkpoint(chat.id)
+    if checkpoint is None:
+        logger.warning("No checkpoint of chat %s to record task %s in", chat.id, task_id)
+        return
+    checkpoint.task_results[task_id] = result
+    _write(checkpoint)
+
+
+def restore_chat(chat_id: str, interrupted_only: bool = False) -> Optional[Chat]:
+    """
+    Returns the chat of an unfinished checkpoint, None if there is nothing to resume.
+    With interrupted_only only a chat whose request was interrupted is returned, not one which
+    ended normally, e.g. waiting for answers to its clarification questions.
+    """
+    checkpoint = load_checkpoint(chat_id)
+    if checkpoint is None or checkpoint.stage == Stage.DONE or (interrupted_only and not checkpoint.in_progress):
+        return None
+    logger.info("Resuming chat %s from stage %s", chat_id, checkpoint.stage.value)
+    return Chat.model_validate(checkpoint.chat)
+
+
+def restore_repo(ref: RepoRef) -> Optional[Repo]:
+    """Reopens the working copy of a checkpoint, None if it doesn't exist on this worker."""
+    try:
+        return Repo.reopen(repo_uuid=ref.uuid, name=ref.name, local_path=ref.local_path)
+    except (OSError, ValueError) as e:
+        logger.warning("Can't reopen repository %s at %s: %s", ref.name, ref.local_path, e)
+        return None
@@ -0,0 +1,130 @@
+import json
+import litellm
+
+from app.config import logger, settings
+from app.models.models import Message, Roles
+
+
+def count_message_tokens(message: dict[str, any], model: str) -> int:
+    """Estimates the tokens of a single message, falling back to 4 characters per token."""
+    content = str(message.get("content") or "")
+    if message.get("tool_calls"):
+        content += json.dumps(message["tool_calls"])
+    try:
+        return litellm.token_counter(model=model, messages=[{"role": str(message.get("role")), "content": content}])
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.debug("Token counter failed for model %s, estimating: %s", model, e)
+        return len(content) // 4 + 4
+
+
+def estimate_tokens(messages: list[dict[str, any]], model: str) -> int:
+    """Estimates the prompt tokens of messages for model."""
+    return sum(count_message_tokens(message, model) for message in messages)
+
+
+def get_context_window(model: str) -> int:
+    """Returns the input token limit of model, settings.LLM_CONTEXT_TOKENS if litellm doesn't know it."""
+    try:
+        max_input_tokens = litellm.get_model_info(model).get("max_input_tokens")
+    except Exception:  # pylint: disable=broad-exception-caught
+        max_input_tokens = None
+    return max_input_tokens or settings.LLM_CONTEXT_TOKENS
+
+
+def get_prompt_budget(model: str) -> int:
+    """Returns the tokens available for the prompt after reserving room for the response."""
+    return get_context_window(model) - settings.LLM_RESPONSE_TOKEN_RESERVE
+
+
+def count_head(messages: list[dict[str, any]]) -> int:
+    """Number of leading system and user messages, i.e. the system and task prompts."""
+    head = 0
+    for message in messages:
+        if str(message.get("role")) not in (Roles.SYSTEM.value, Roles.USER.value):
+            break
+        head += 1
+    return head
+
+
+def is_tool_result(message: dict[str, any]) -> bool:
+    return str(message.get("role")) == Roles.TOOL.value
+
+
+def compact_messages(messages: list[dict[str, any]], budget: int, model: str) -> bool:
+    """
+    Compacts messages in place until their estimated tokens fit into budget.
+
+    The system and task prompts at the start and the last settings.COMPACTION_KEEP_RECENT messages
+    are kept verbatim. Older tool outputs in between are first shortened to
+    settings.COMPACTION_SNIPPET_CHARS characters and, if that is not enough, dropped oldest first
+    and replaced by a single note. Returns True if the messages fit into budget afterwards.
+    """
+    tokens = [count_message_tokens(message, model) for message in messages]
+    if sum(tokens) <= budget:
+        return True
+
+    head = count_head(messages)
+    tail = max(head, len(messages) - settings.COMPACTION_KEEP_RECENT)
+    # Native tool results must stay behind the assistant message which called the tools
+    while tail > head and tail < len(messages) and is_tool_result(messages[tail]):
+        tail -= 1
+    logger.info("Compacting %d messages with %d tokens to fit %d tokens", len(messages), sum(tokens), budget)
+
+    for i in range(head, tail):
+        content = str(messages[i].get("content", ""))
+        if len(content) > settings.COMPACTION_SNIPPET_CHARS:
+            messages[i] = {**messages[i], "content": content[:settings.COMPACTION_SNIPPET_CHARS] + " ... [output shortened]"}
+            tokens[i] = count_message_tokens(messages[i], model)
+    if sum(tokens) <= budget:
+        return True
+
+    note_tokens = count_message_tokens(dropped_note(tail - head), model)
+    dropped = 0
+    while head + dropped < tail and sum(tokens) + note_tokens > budget:
+        tokens[head + dropped] = 0
+        dropped += 1
+        while head + dropped < tail and is_tool_result(messages[head + dropped]):
+            tokens[head + dropped] = 0
+            dropped += 1
+    if dropped:
+        messages[head:head + dropped] = [dropped_note(dropped)]
+        tokens[head:head + dropped] = [note_tokens]
+    return sum(tokens) <= budget
+
+
+def dropped_note(count: int) -> dict[str, any]:
+    return Message(role=Roles.ASSISTANT, content=f"{count} earlier tool outputs were removed to fit the context window.").model_dump()
+
+
+def fit_to_context(messages: list[dict[str, any]], model: str) -> str:
+    """
+    Compacts messages in place for model and returns the model to call.
+    If compaction is not enough, settings.LLM_LARGE_CONTEXT_MODEL is returned when configured,
+    with the messages compacted for its larger context instead.
+    """
+    compacted = list(messages)
+    if compact_messages(compacted, get_prompt_budget(model), model):
+        messages[:] = compacted
+        return model
+    large_model = settings.LLM_LARGE_CONTEXT_MODEL
+    if large_model and large_model != model:
+        logger.warning("Messages don't fit the context of %s, routing to %s", model, large_model)
+        compact_messages(messages, get_prompt_budget(large_model), large_model)
+        return large_model
+    logger.warning("Messages don't fit the context of %s and no larger model is configured", model)
+    messages[:] = compacted
+    return model
+
+
+def shrink_after_overflow(messages: list[dict[str, any]], model: str) -> str:
+    """
+    Handles a context overflow reported by the provider although the estimate fit, i.e. the
+    estimate was too optimistic. Returns settings.LLM_LARGE_CONTEXT_MODEL when configured,
+    otherwise compacts messages in place to three quarters of their estimated tokens and returns model.
+    """
+    large_model = settings.LLM_LARGE_CONTEXT_MODEL
+    if large_model and large_model != model:
+        logger.warning("Context of %s exceeded, retrying with %s", model, large_model)
+        return large_model
+    compact_messages(messages, estimate_tokens(messages, model) * 3 // 4, model)
+    return model
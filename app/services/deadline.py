@@ -0,0 +1,38 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+# Monotonic time by which the current request must be answered, set once per request at /api/chat
+# and inherited by every task the request starts
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the deadline of the current request has passed."""
+
+
+def start_deadline(seconds: float):
+    """Sets the deadline of the current request seconds from now, 0 for none. Returns the reset token."""
+    return request_deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def remaining() -> Optional[float]:
+    """Returns the seconds left until the request deadline, None without a deadline."""
+    deadline = request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check_deadline(stage: str):
+    """Raises DeadlineExceeded if the request deadline has passed before stage."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Request deadline exceeded before {stage}")
+
+
+def cap_timeout(timeout: Optional[float], stage: str) -> Optional[float]:
+    """Returns timeout capped to the time left for the request, raises DeadlineExceeded if none is left."""
+    check_deadline(stage)
+    left = remaining()
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
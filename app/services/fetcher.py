@@ -0,0 +1,135 @@
+import asyncio
+import re
+import time
+from collections import Counter, OrderedDict
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+from bs4 import BeautifulSoup
+
+from app.config import logger, settings
+from app.services.browser import USER_AGENT, BrowserPool, browser_pool
+from app.services.deadline import cap_timeout
+
+# Static pages failing the content check this often, without any passing, are rendered right away
+BROWSER_DOMAIN_MIN_FAILURES = 2
+# Seconds a domain is rendered right away before its static pages are checked again
+BROWSER_DOMAIN_TTL = 3600
+# Domains whose stats are kept, the least recently fetched are forgotten
+MAX_DOMAINS = 1000
+NO_SCRIPT_PATTERN = re.compile(r"(enable|requires?) javascript", re.IGNORECASE)
+
+
+def has_main_content(html: str, min_chars: int) -> bool:
+    """
+    Returns True if static html has enough visible text to be ingested without rendering it,
+    False for script shells like single page apps which only fill the page in the browser.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "template", "svg", "header", "footer", "nav", "meta"]):
+        tag.decompose()
+    text = soup.get_text(" ", strip=True)
+    if len(text) < min_chars:
+        return False
+    # A "please enable JavaScript" notice on an otherwise short page
+    return not (NO_SCRIPT_PATTERN.search(text) and len(text) < 2 * min_chars)
+
+
+class DomainStats:
+    """How the static pages of a domain did in the content check, see PageFetcher.needs_browser."""
+
+    def __init__(self):
+        self.static = 0
+        self.shells = 0
+        self.learned: float = None
+
+
+class PageFetcher:
+    """
+    Fetches pages for ingestion with a shared, connection pooled HTTP client and renders only the
+    pages whose static HTML has too little main content (see has_main_content) in the browser pool.
+    Domains whose static pages keep failing the check are learned and rendered right away for
+    BROWSER_DOMAIN_TTL seconds. Pages which couldn't be fetched without the browser, because of
+    network errors, error statuses or other content, are rendered but don't count for their domain.
+    """
+
+    def __init__(self, browser: BrowserPool, min_chars: int, timeout: float, max_connections: int):
+        self.browser = browser
+        self.min_chars = min_chars
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.counters: Counter = Counter()
+        self.domains: OrderedDict[str, DomainStats] = OrderedDict()
+        self._client: httpx.AsyncClient = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml"},
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    def domain_stats(self, domain: str) -> DomainStats:
+        stats = self.domains.pop(domain, None) or DomainStats()
+        self.domains[domain] = stats
+        while len(self.domains) > MAX_DOMAINS:
+            self.domains.popitem(last=False)
+        return stats
+
+    def needs_browser(self, domain: str) -> bool:
+        stats = self.domains.get(domain)
+        if stats is None or stats.static or stats.shells < BROWSER_DOMAIN_MIN_FAILURES:
+            return False
+        if time.monotonic() - stats.learned > BROWSER_DOMAIN_TTL:
+            # Sites change, so the static pages of the domain are checked again
+            stats.shells = 0
+            return False
+        return True
+
+    async def fetch_static(self, url: str) -> Optional[str]:
+        """Returns the HTML served for url, None on errors and for other content."""
+        try:
+            response = await self.client.get(url, timeout=cap_timeout(self.timeout, f"fetching {url}"))
+        except httpx.HTTPError as e:
+            logger.info("Plain fetch of %s failed: %s", url, e)
+            return None
+        if response.status_code >= 400 or "html" not in response.headers.get("content-type", ""):
+            logger.info("Plain fetch of %s returned %s %s", url, response.status_code, response.headers.get("content-type"))
+            return None
+        return response.text
+
+    async def fetch(self, url: str) -> Optional[str]:
+        """Returns the HTML of url, rendered in the browser only if needed, None if it couldn't be loaded."""
+        domain = urlparse(url).netloc
+        if not self.needs_browser(domain):
+            html = await self.fetch_static(url)
+            if html is not None:
+                stats = self.domain_stats(domain)
+                if await asyncio.to_thread(has_main_content, html, self.min_chars):
+                    stats.static += 1
+                    self.counters["static"] += 1
+                    return html
+                stats.shells += 1
+                if stats.shells == BROWSER_DOMAIN_MIN_FAILURES:
+                    stats.learned = time.monotonic()
+                logger.info("Static HTML of %s has too little content, rendering it", url)
+        self.counters["rendered"] += 1
+        return await self.browser.fetch(url)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+page_fetcher = PageFetcher(browser=browser_pool, min_chars=settings.FETCH_MIN_TEXT_CHARS,
+                           timeout=settings.FETCH_HTTP_TIMEOUT, max_connections=settings.FETCH_MAX_CONNECTIONS)
+
+
+async def fetch_page(url: str) -> Optional[str]:
+    """Returns the HTML of url for ingestion, None if it couldn't be loaded."""
+    return await page_fetcher.fetch(url)
@@ -0,0 +1,93 @@
+import json
+import re
+
+from app.config import logger
+
+CODE_FENCE_REGEX = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)(?:```|$)", re.DOTALL)
+LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def strip_code_fence(content: str) -> str:
+    """Returns the content of the first markdown code fence, content itself if there is none."""
+    match = CODE_FENCE_REGEX.search(content)
+    return match.group(1) if match else content
+
+
+def _strip_trailing_comma(out: list[str]):
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+
+
+def repair_json(content: str) -> str:
+    """
+    Repairs the usual defects of JSON written by LLMs without another LLM call: code fences and
+    text around the value, trailing commas, single quoted strings, raw newlines in strings and
+    Python literals.
+    Truncated output, with brackets or a string still open at the end, is not closed: a cut off
+    command list or file content must not pass as a complete response, parsing it fails and the
+    model is asked again.
+    Returns the repaired text, which still has to be parsed.
+    """
+    text = strip_code_fence(content)
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return content
+
+    out: list[str] = []
+    stack: list[str] = []
+    quote = None
+    i = min(starts)
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if ch == "\\" and i + 1 < len(text):
+                escaped = text[i + 1]
+                out.append(escaped if escaped == "'" else ch + escaped)
+                i += 2
+                continue
+            if ch == quote:
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            else:
+                out.append(ch)
+        elif ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _strip_trailing_comma(out)
+            if stack and stack[-1] == ch:
+                stack.pop()
+                out.append(ch)
+                if not stack:
+                    break
+        elif ch.isalpha():
+            word = re.match(r"\w+", text[i:]).group(0)
+            out.append(LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if stack or quote:
+        logger.warning("JSON output is truncated, leaving it to be asked again")
+    return "".join(out)
+
+
+def loads_tolerant(content: str):
+    """json.loads, falling back to repair_json for malformed content. Raises ValueError if both fail."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError as e:
+        data = json.loads(repair_json(content))
+        logger.info("Repaired malformed JSON locally: %s", e)
+        return data
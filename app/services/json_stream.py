@@ -0,0 +1,99 @@
+import json
+
+from app.config import logger
+
+
+class JsonStreamParser:
+    """
+    Incrementally parses a JSON object from text chunks.
+
+    The elements of top-level arrays and the entries of top-level objects are emitted as soon as they
+    are complete, e.g. for {"commands": ["ls", "pwd"], "repo_update": {"a.txt": "a"}} the events are
+    ("commands", "ls"), ("commands", "pwd") and ("repo_update", ("a.txt", "a")).
+    Text before the first "{" (like a code fence) is ignored.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._expect_key = False
+        self._key = None
+        self._field = None
+        self._item_start = None
+        self.done = False
+
+    def feed(self, chunk: str) -> list[tuple[str, any]]:
+        """Consumes the next chunk of text and returns the events completed by it."""
+        events = []
+        self._text += chunk
+        while self._pos < len(self._text) and not self.done:
+            i = self._pos
+            ch = self._text[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._expect_key:
+                        self._key = json.loads(self._text[self._string_start:i + 1])
+                continue
+
+            if not self._stack:
+                if ch == "{":
+                    self._stack.append(ch)
+                    self._expect_key = True
+                continue
+
+            depth = len(self._stack)
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+                self._mark_item_start(depth, i)
+            elif ch in "{[":
+                self._mark_item_start(depth, i)
+                self._stack.append(ch)
+            elif ch in "}]":
+                if depth == 2:
+                    events.extend(self._close_item(i))
+                self._stack.pop()
+                if depth == 1:
+                    self.done = True
+            elif ch == ",":
+                if depth == 1:
+                    self._expect_key = True
+                    self._field = None
+                elif depth == 2:
+                    events.extend(self._close_item(i))
+            elif ch == ":":
+                if depth == 1:
+                    self._field = self._key
+                    self._expect_key = False
+            elif not ch.isspace():
+                self._mark_item_start(depth, i)
+        return events
+
+    def _mark_item_start(self, depth: int, index: int):
+        if depth == 2 and self._item_start is None:
+            self._item_start = index
+
+    def _close_item(self, end: int) -> list[tuple[str, any]]:
+        if self._item_start is None:
+            return []
+        text = self._text[self._item_start:end].strip()
+        self._item_start = None
+        try:
+            if self._stack[-1] == "[":
+                return [(self._field, json.loads(text))]
+            entry = json.loads("{" + text + "}")
+            return [(self._field, item) for item in entry.items()]
+        except ValueError as e:
+            logger.debug("Could not parse streamed element of %s: %s", self._field, e)
+            return []
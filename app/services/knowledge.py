@@ -1,7 +1,12 @@
 
+import asyncio
+from collections import Counter
+import contextvars
 from datetime import datetime
 import json
 import re
+import time
+from typing import Optional
 from urllib.parse import urlparse, urlunparse
 import uuid
 from bson import ObjectId
@@ -14,8 +19,10 @@ from bs4 import BeautifulSoup
 from app.models.models import Chat, Message, Roles
 from app.config import settings, logger, embedder, knowledge_collection, query_collection, config_collection, web_search_cache_collection, TZINFO
 
-from app.services.browser import get_page_with_selenium
+from app.services.fetcher import fetch_page
+from app.services.deadline import cap_timeout, check_deadline, remaining, request_deadline
 from app.services.helpers import generate_hash
+from app.services.model_router import token_usage
 
 blacklist_entry = config_collection.find_one({"KEY": "BLACKLIST_SEARCH"})
 BLACKLIST = blacklist_entry.get("urls", None) if blacklist_entry else settings.BLACKLIST_SEARCH
@@ -63,7 +70,7 @@ def perform_web_search(query):
         'Content-Type': 'application/json'
     }
 
-    response = requests.request("POST", WEBSEARCH_URL, headers=headers, data=payload, timeout=10)
+    response = requests.request("POST", WEBSEARCH_URL, headers=headers, data=payload, timeout=cap_timeout(10, "web search"))
     data = response.json()
 
     # Now extract links from 'organic' results
@@ -79,7 +86,8 @@ def perform_web_search(query):
     logger.info(all_links)
 
     web_search_cache_collection.insert({"query": query, "urls": all_links})
-    return list(set(all_links))
+    # Unique, in the order of the search ranking
+    return list(dict.fromkeys(all_links))
 
 def concatenate_strings(lst, max_char):
     result = []
@@ -251,9 +259,14 @@ def add_query(query):
         logger.error("Error inserting query into Milvus: %s", e)
 
 
-def load_from_url(url, query):
+async def load_from_url(url, query):
+    html = await fetch_page(url)
+    # Parsing, query generation and indexing are blocking, keep them off the event loop
+    return await asyncio.to_thread(store_docs_from_html, html, url, query)
 
-    docs = get_docs_from_html(get_page_with_selenium(url), url)
+
+def store_docs_from_html(html, url, query):
+    docs = get_docs_from_html(html, url)
     if docs is None:
         logger.warning("Failed to load documents from URL: %s", url)
         return None
@@ -271,6 +284,93 @@ def load_from_url(url, query):
 
     return docs
 
+# Ingestions which go on after get_knowledge returned, referenced until they are done
+background_ingestions: set[asyncio.Task] = set()
+# Urls being loaded right now, by any query or background load, so none is ingested twice
+ingesting_urls: set[str] = set()
+
+
+async def ingest_urls(urls: list[str], query: str, chat: Chat = None, known_doc_ids: set[str] = None):
+    """
+    Loads and indexes the top settings.KNOWLEDGE_INGEST_TOP_K urls which are not known yet, with at
+    most settings.KNOWLEDGE_INGEST_WORKERS at once. Returns as soon as the query finds
+    settings.KNOWLEDGE_ENOUGH_DOCS documents besides known_doc_ids, e.g. the ones already summarized,
+    or all urls are loaded; the remaining loads go on in the background. Urls another query or background load is loading already are skipped.
+    """
+    new_urls = []
+    for url in urls:
+        if len(new_urls) >= settings.KNOWLEDGE_INGEST_TOP_K:
+            break
+        if url in BLACKLIST or url in ingesting_urls:
+            continue
+        if collection.find_one({"url": url}):
+            logger.info("Found URL in knowledge database, but no entries in vectordb website might be crap, or needs to be re checked for query strings: %s", url)
+            continue
+        new_urls.append(url)
+    if not new_urls:
+        return
+    ingesting_urls.update(new_urls)
+
+    workers = asyncio.Semaphore(max(1, settings.KNOWLEDGE_INGEST_WORKERS))
+    enough = asyncio.Event()
+
+    async def ingest(url: str):
+        try:
+            async with workers:
+                docs = await load_from_url(url, query)
+            if docs:
+                _, doc_ids = await asyncio.to_thread(search_vector, query)
+                new_doc_ids = [doc_id for doc_id in doc_ids if doc_id not in (known_doc_ids or ())]
+                if len(new_doc_ids) >= settings.KNOWLEDGE_ENOUGH_DOCS:
+                    enough.set()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # One broken page must not stop the others
+            logger.error("Loading %s failed: %s", url, e)
+        finally:
+            ingesting_urls.discard(url)
+
+    # Started before any await, every claimed url is released by its load. Every load gets its own
+    # copy of the request's context, cleared if the load moves to the background
+    contexts = [contextvars.copy_context() for _ in new_urls]
+    loads = [asyncio.create_task(ingest(url), context=context) for url, context in zip(new_urls, contexts)]
+    if chat:
+        # Only here, background loads must not write into the chat after it's answered
+        await chat.set_message(f"Searching in {', '.join(new_urls)} \n\n")
+    all_loaded = asyncio.gather(*loads)
+    enough_found = asyncio.ensure_future(enough.wait())
+    await asyncio.wait([all_loaded, enough_found], return_when=asyncio.FIRST_COMPLETED)
+    enough_found.cancel()
+
+    pending = [(load, context) for load, context in zip(loads, contexts) if not load.done()]
+    if pending:
+        logger.info("Enough knowledge for %s, loading %d more urls in the background", query, len(pending))
+        for load, context in pending:
+            detach_from_request(context)
+            background_ingestions.add(load)
+            load.add_done_callback(background_ingestions.discard)
+
+
+def detach_from_request(context: contextvars.Context):
+    """
+    Clears the request deadline and token usage counters in the context of a load which goes on after
+    the request, so its next steps aren't cut off by the deadline or charged to the request's budgets.
+    A step already running keeps the values it started with, e.g. a store_docs_from_html thread.
+    """
+    context.run(request_deadline.set, None)
+    context.run(token_usage.set, ())
+
+
+async def cancel_background_ingestions():
+    """
+    Cancels the background loads and waits for them, before the fetcher and browsers are closed.
+    Cancelling can't stop a store_docs_from_html thread which is already running, it finishes on its own.
+    """
+    loads = list(background_ingestions)
+    for load in loads:
+        load.cancel()
+    await asyncio.gather(*loads, return_exceptions=True)
+
+
 def update_knowledge(url: str):
     """
     Update the knowledge database with new information from a URL.
@@ -372,84 +472,162 @@ Respond only with the final answer object in JSON format:
 ''').model_dump()
         ])
 
+
+class RewrittenQuery(BaseModel):
+    """A search query rephrased to find documentation the original query didn't find."""
+    query: str = Field(..., description="The rephrased search query.")
+
+
+async def rewrite_query(query: str, tried: list[str]) -> str:
+    from app.services.llm_wrapper import llm_call_wrapper
+
+    rewritten = await llm_call_wrapper(
+        call_site="rewrite_knowledge_query",
+        response_format=RewrittenQuery,
+        messages=[
+            Message(role=Roles.USER.value, content=(
+                "The following search queries found no useful documentation:\n"
+                + "\n".join(f"- {tried_query}" for tried_query in tried)
+                + f"\n\nRephrase this query for a web search, e.g. with the product's official terms, "
+                f"more general or split down to its core question: {query}\n"
+                'Respond only with JSON: {"query": "<rephrased query>"}'
+            )).model_dump()
+        ])
+    return rewritten.query
+
+
+def load_docs(entities: list[dict], doc_ids: list[str]) -> list[str]:
+    """Returns the documents of the search results, removing vectors whose document is gone."""
+    doc_texts = []
+    for doc_id in doc_ids:
+        res = collection.find_one({"doc_id": doc_id})
+        if res:
+            doc_texts.append(res["doc"])
+        else:
+            logger.warning("No result found for doc_id: %s", doc_id)
+            logger.info("Delete the vector entry with doc_id %s", doc_id)
+            delete_vector_entries(ids=[entity["id"] for entity in entities if entity["doc_id"] == doc_id])
+    return doc_texts
+
+
+# Lookups per strategy which found the answer, and those which didn't
+knowledge_counters: Counter = Counter()
+
+
+class Retrieval:
+    """
+    State of one get_knowledge lookup: the queries searched, the documents summarized so far and
+    the best partial answer, which is returned if no round finds a relevant one.
+    """
+
+    def __init__(self, query: str, chat: Chat = None):
+        self.query = query
+        self.chat = chat
+        self.searched: list[str] = []
+        self.summarized: set[str] = set()
+        self.partial: str = None
+        self.urls: list[str] = None
+
+    async def web_search(self, search_query: str) -> list[str]:
+        # Served from the web search cache if the query was searched before
+        return await asyncio.to_thread(perform_web_search, search_query)
+
+    async def answer(self, search_query: str) -> Optional[str]:
+        """Summarizes the documents search_query finds, returns the answer if it's relevant."""
+        if search_query not in self.searched:
+            self.searched.append(search_query)
+        entities, doc_ids = await asyncio.to_thread(search_vector, search_query)
+        new_ids = [doc_id for doc_id in doc_ids if doc_id not in self.summarized]
+        if not new_ids:
+            return None
+        logger.info("Found %d new documents for query: %s", len(new_ids), search_query)
+        self.summarized.update(new_ids)
+        doc_texts = load_docs(entities, doc_ids)
+        if not doc_texts:
+            return None
+        summary = await summarize_knowledge(self.query, "\n\n".join(doc_texts), self.chat)
+        logger.info("Summary: %s", summary)
+        if summary.is_irrelevant:
+            self.partial = summary.answer or self.partial
+            return None
+        return summary.answer
+
+    async def vector_search(self) -> Optional[str]:
+        return await self.answer(self.query)
+
+    async def ingest_web_results(self) -> Optional[str]:
+        self.urls = await self.web_search(self.query)
+        await ingest_urls(self.urls, self.query, self.chat, self.summarized)
+        return await self.answer(self.query)
+
+    async def rewritten_search(self) -> Optional[str]:
+        rewritten = await rewrite_query(self.query, self.searched)
+        if rewritten in self.searched:
+            return None
+        if self.chat:
+            await self.chat.set_message(f"Searching for {rewritten} instead \n\n")
+        answer = await self.answer(rewritten)
+        if answer is None:
+            await ingest_urls(await self.web_search(rewritten), rewritten, self.chat, self.summarized)
+            answer = await self.answer(rewritten)
+        return answer
+
+    async def site_search(self) -> Optional[str]:
+        """
+        Searches only the site of the top web search result, usually the official documentation.
+        The site is searched for the original query, not a rewritten one, as its pages are indexed
+        and summarized for the original query.
+        """
+        urls = self.urls if self.urls is not None else await self.web_search(self.query)
+        if not urls:
+            return None
+        site_query = f"site:{urlparse(urls[0]).netloc} {self.query}"
+        await ingest_urls(await self.web_search(site_query), self.query, self.chat, self.summarized)
+        return await self.answer(self.query)
+
+    def strategies(self):
+        """The retrieval rounds, cheapest first."""
+        return [self.vector_search, self.ingest_web_results, self.rewritten_search, self.site_search]
+
+
 async def get_knowledge(query: str, chat: Chat = None, pre_text: bool = True):
+    """
+    Looks up knowledge for query in rounds of increasingly expensive strategies (see Retrieval.strategies)
+    until one finds relevant documentation, at most settings.KNOWLEDGE_MAX_ROUNDS rounds within
+    settings.KNOWLEDGE_MAX_SECONDS and the request deadline. Returns the best partial answer otherwise.
+    """
     if not query:
         logger.warning("Invalid query or chat object provided.")
         return None
+    check_deadline(f"getting knowledge for {query}")
     logger.info("Searching for: %s", query)
-    entities, ids_unique = search_vector(query)
 
-    hit = False
+    retrieval = Retrieval(query, chat)
+    answer = None
+    stop_at = time.monotonic() + settings.KNOWLEDGE_MAX_SECONDS
+    for strategy in retrieval.strategies()[:settings.KNOWLEDGE_MAX_ROUNDS]:
+        left = remaining()
+        if time.monotonic() >= stop_at or (left is not None and left <= 0):
+            logger.warning("Time for getting knowledge about %s is up", query)
+            break
+        logger.info("Getting knowledge for %s: %s", query, strategy.__name__)
+        answer = await strategy()
+        if answer is not None:
+            knowledge_counters[strategy.__name__] += 1
+            break
+    if answer is None:
+        knowledge_counters["partial" if retrieval.partial else "not_found"] += 1
+
     knowledge = []
     if pre_text:
         knowledge.append(f"&&& BEGIN DOCUMENTATION for query: {query} &&&")
-    if len(ids_unique)>0:
-        logger.info("First search in vectordb hit")
-        logger.info("Found %d results for query: %s", len(ids_unique), query)
-        doc_texts = []
-        for doc_id in ids_unique:
-            ids_current = [entity["id"] for entity in entities if entity["doc_id"] == doc_id]
-            res = collection.find_one({"doc_id": doc_id})
-            if res:
-                doc_texts.append(res["doc"])
-            else:
-                logger.warning("No result found for doc_id: %s", doc_id)
-                logger.info("Delete the vector entry with doc_id %s", doc_id)
-                delete_vector_entries(ids=ids_current)
-        if doc_texts:
-            summary = await summarize_knowledge(query, "n ".join(doc_texts), chat)
-            logger.info("Summary: %s", summary)
-            if summary.is_irrelevant:
-                knowledge.append(f"No relevant information found for your query: {query}. please try again with a different query. maybe splitting your original query in multiple yield better results.")
-                logger.warning("No relevant information found.")
-            #    #delete entities
-            #    delete_vector_entries(ids=ids_current)
-            else:
-                knowledge.append(summary.answer)
+    if answer is not None:
+        knowledge.append(answer)
+    elif retrieval.partial:
+        knowledge.append(f"Only partial information found for your query: {query}.\n\n{retrieval.partial}")
     else:
-
-        logger.info("First search in vectordb no hit")
-
-        urls = perform_web_search(query)
-        for url in urls:
-            # if url in mongo
-            res = collection.find_one({"url": url})
-            if res:
-                logger.info("Found URL in knowledge database, but no entries in vectordb website might be crap, or needs to be re checked for query strings: %s", url)
-            else:
-                if chat:
-                    await chat.set_message(f"Searching in {url} \n\n")
-                load_from_url(url, query)
-                break
-        entities, ids_unique = search_vector(query)
-        hit=False
-
-        if len(ids_unique)>0:
-            logger.info("Second search in vectordb hit")
-            logger.info("Found %d results for query: %s", len(ids_unique), query)
-            for doc_id in ids_unique:
-                ids_current = [entity["id"] for entity in entities if entity["doc_id"] == doc_id]
-                res = collection.find_one({"doc_id": doc_id})
-                if res:
-                    doc_texts.append(res["doc"])
-                else:
-                    logger.warning("No result found for doc_id: %s", doc_id)
-                    logger.info("Delete the vector entry with doc_id %s", doc_id)
-                    delete_vector_entries(ids=ids_current)
-            if doc_texts:
-                summary = await summarize_knowledge(query, "n ".join(doc_texts), chat)
-                logger.info("Summary: %s", summary)
-                if summary.is_irrelevant:
-                    knowledge.append(f"No relevant information found for your query: {query}. please try again with a different query. maybe splitting your original query in multiple yield better results.")
-                    logger.warning("No relevant information found.")
-                #    #delete entities
-                #    delete_vector_entries(ids=ids_current)
-                else:
-                    knowledge.append(summary.answer)
-        else:
-            logger.warning("No relevant information found.")
-            knowledge.extend(await get_knowledge(query, chat, False))
-            #return ["apple"]
+        logger.warning("No relevant information found.")
+        knowledge.append(f"No relevant information found for your query: {query}. please try again with a different query. maybe splitting your original query in multiple yield better results.")
     if pre_text:
         knowledge.append("\n\n&&& END DOCUMENTATION &&&")
 
@@ -1,7 +1,7 @@
+import asyncio
 import json
 from textwrap import dedent
 from typing import Optional
-import litellm
 from pydantic import BaseModel, Field
 
 from app.config import logger, settings
@@ -11,8 +11,15 @@ from app.models.models import Task
 from app.models.models import Tasks
 from app.models.models import DifficultyLevel
 from app.models.repo import Repo
-from app.models.models import Chat, Roles
+from app.models.task_graph import TaskGraph
+from app.models.models import Chat, Roles, task_tag
+from app.services.llm_cache import get_cache_ttl, llm_cache, make_cache_key
 from app.services.llm_wrapper import llm_call_wrapper, llm_tool_call
+from app.services.model_router import completion_with_fallbacks, get_models
+from app.services.checkpoint import ChatCheckpoint, RepoRef, Stage, end_request, load_checkpoint, restore_repo, save_checkpoint, save_task_result
+from app.services.plan_cache import plan_cache
+from app.services.deadline import DeadlineExceeded
+from app.services.speculation import Speculation
 
 
 TOKEN=settings.TOKEN
@@ -40,6 +47,7 @@ async def categorize_request(chat: Chat):
     await chat.set_message("Let me check how complex your request is... \n\n")
 
     c = await llm_call_wrapper(
+        call_site="categorize_request",
         response_format=CategoryResponse,
         messages = [
             Message(
@@ -111,119 +119,219 @@ async def answer_request(chat: Chat):
         ]
     )
 
-def add_task_results_recursively(task, messages, chat: Chat):
-    if not task.dependsOn:
-        return
-
-    for dep_id in task.dependsOn:
-        dep_task = next((t for t in chat.tasks.tasks if t.unique_id == dep_id), None)
-        if dep_task is None:
-            logger.warning("Dependency %s not found in tasks", dep_id)
+def add_dependency_context(graph: TaskGraph, task: Task, messages: list[dict[str, any]], chat: Chat):
+    """
+    Adds the results of all text tasks task depends on, directly or transitively, once each and in
+    topological order. The results share settings.DEPENDENCY_CONTEXT_MAX_CHARS characters: direct
+    dependencies get the budget first, then the transitive ones from the nearest to the farthest.
+    Results which don't fit are shortened or, once the budget is used up, only mentioned.
+    """
+    dependencies = [dep for dep in graph.ancestors(task.unique_id) if dep.result_type == ResultType.TEXT]
+    direct = set(task.dependsOn or [])
+    priority = [dep for dep in dependencies if dep.unique_id in direct] + \
+        [dep for dep in reversed(dependencies) if dep.unique_id not in direct]
+
+    budget = settings.DEPENDENCY_CONTEXT_MAX_CHARS
+    contents = {}
+    for dep in priority:
+        result = taskResults.get(chat.id, {}).get(dep.unique_id, None)
+        if result is None:
+            logger.warning("Dependency %s not yet solved", dep.unique_id)
+            contents[dep.unique_id] = f"Task Dependency:{dep.unique_id} not yet solved, you can still try to solve yours"
             continue
-        logger.info("Dependency %s found in tasks", dep_id)
-
-        # First, recurse into dependencies of this dependency
-        add_task_results_recursively(dep_task, messages, chat)
-
-        # Then, add result message for this dependency if it's a text result
-        if dep_task.result_type == ResultType.TEXT:
-            result = taskResults.get(chat.id, {}).get(dep_id, None)
-            if result is not None:
-                messages.append(Message(
-                    role=Roles.ASSISTANT.value,
-                    content=f"Task Dependency:{dep_id} was solved with result: {result}"
-                ).model_dump())
-            else:
-                logger.warning("Dependency %s not yet solved", dep_id)
-                messages.append(Message(
-                    role=Roles.ASSISTANT.value,
-                    content=f"Task Dependency:{dep_id} not yet solved, you can still try to solve yours"
-                ).model_dump())
+        if len(result) > budget:
+            logger.info("Shortening result of dependency %s from %d to %d characters", dep.unique_id, len(result), budget)
+            result = f"{result[:budget]} ... [result shortened]" if budget > 0 else "[result omitted to save space]"
+        budget = max(0, budget - len(result))
+        contents[dep.unique_id] = f"Task Dependency:{dep.unique_id} was solved with result: {result}"
+
+    for dep in dependencies:
+        messages.append(Message(role=Roles.ASSISTANT.value, content=contents[dep.unique_id]).model_dump())
+
+
+async def solve_tasks(agent:Agent, chat: Chat, repo: Repo, solved: set[str] = None):
+    """
+    Solves the chat tasks concurrently, starting each task as soon as all tasks it depends on are solved.
+    At most settings.TASK_PARALLELISM tasks run at the same time, repo tasks run one after another
+    because they share the working tree. Tasks in solved, e.g. of a resumed chat, are skipped.
+    """
+    solved = solved or set()
+    try:
+        graph = TaskGraph(chat.tasks.tasks)
+    except ValueError as e:
+        logger.error("Invalid task plan: %s", e)
+        await chat.set_message(f"{agent.role}: Can't solve the task plan, {e} \n\n")
+        return None
+
+    semaphore = asyncio.Semaphore(max(1, settings.TASK_PARALLELISM))
+    repo_lock = asyncio.Lock()
+    runners: dict[str, asyncio.Future] = {}
+
+    async def run(task: Task):
+        if task.dependsOn:
+            await asyncio.gather(*(runners[dep_id] for dep_id in task.dependsOn))
+        if task.unique_id in solved:
+            return None
+        async with semaphore:
+            task_tag.set(task.unique_id)
+            if task.result_type == ResultType.REPO:
+                async with repo_lock:
+                    return await solve_task(agent=agent, chat=chat, repo=repo, task=task, graph=graph)
+            return await solve_task(agent=agent, chat=chat, repo=repo, task=task, graph=graph)
+
+    for task in graph:
+        runners[task.unique_id] = asyncio.ensure_future(run(task))
+
+    try:
+        results = await asyncio.gather(*runners.values())
+    except Exception:
+        for runner in runners.values():
+            runner.cancel()
+        raise
+    return dict(zip(runners.keys(), results))
+
+
+async def solve_task(agent: Agent, chat: Chat, repo: Repo, task: Task, graph: TaskGraph = None):
+    """Solves a single task with the results of its dependencies as context."""
+    graph = graph or TaskGraph(chat.tasks.tasks)
+    logger.info("task %s", task)
+    await chat.set_message(f"{agent.role}: Solving subtask {task.description} \n\n")
+
+    messages=[
+        Message(role=Roles.SYSTEM.value, content=dedent(f"""
+            You are {agent.role} with background {agent.background} and skills {agent.skills}
+            the overall project description is: {chat.project_description}
+            """)).model_dump(),
+        Message(role=Roles.USER.value, content=dedent(f'''
+                You are working on task: {task.unique_id} - {task.unique_name}
+
+                ───────────────────────────────────────────────────────────────────────────────
+                🔹 **Environment & Tools Overview**
+                - Your are getting called over and over again with the new Feedback from tools you use. Until you set done=true.
+                - You have access to a Git repository. Use the `updateFile` field to update or create files.
+                - To delete a file, set its content to `"DELETE"`.
+                - Shell commands are available via the `command` field. Specify them like:
+                - `("gcloud instances list")`
+                - ❗ Avoid using file or git-related commands here.
+                - To retrieve information, use `get_knowledge` like a search engine. It returns summarized and relevant data.
+                • `get_knowledge` returns helpful summarized info—you don’t run it to do things, you run it to learn how.
+                •  Use it before running any command you’re unsure about, especially ones that might modify state.#
+                ❗ Key Difference:
+                •	get_knowledge = “How do I…?” ➜ Use when you need to learn or confirm how a command works.
+                •	command = “Do this.” ➜ Use when you’re ready to execute something (like gcloud, aws, ...)
+
+                - ⚠️ You may only call **one tool (`command`, `get_knowledge`, or `update_repo`) at a time**.
+
+                ───────────────────────────────────────────────────────────────────────────────
+                📁 **Repository Snapshot**
+                You are working inside a Git repo. Here is the current content up to this point:
+                {{REPO_LOAD_FILES}}
+
+                ───────────────────────────────────────────────────────────────────────────────
+                🎯 **Task Instructions**
+                - **Description:** {task.description}
+                - **Context:** {task.context}
+                - **Result Type:** {task.result_type}
+
+                📌 Based on the result_type:
+                - If `repo`: Change existing files with `repo_edits`: each edit has `file_path`, `search` (exact text which occurs once in the file) and `replace`. All edits are applied or none, conflicts are reported back to you.
+                  Use the `update_repo` field only for new files or complete rewrites. The key is the file path, and the value is the **full new content** of the file (not just diffs).
+                - If `text`: Use the `text_result` field to return markdown text output as final output.
+
+                🔄 Continue using tools (`commands`, `get_knowledge`, `update_repo`) until the task is complete.
+
+                ✅ When done:
+                - Set `done=true`
+                - Provide a brief and clear summary of what was accomplished in the `message` field.
+                - If `result_type=text`: Use the `text_result` field to return markdown text output as final output (it should include all needed information to answer the task).
+
+
+                🚫 Do not provide instructions to the user—*complete the task as the agent*.
+                If a command is required (e.g., listing resources), run it—*do not just describe it*.
+
+                ───────────────────────────────────────────────────────────────────────────────
+                ⚠️ **Important Execution Rules**
+                - Only **one tool call** (`command`, `get_knowledge`, or `update_repo`) is allowed at a time.
+                - Always **await the result** of that tool call before proceeding or setting `done=true`.
+
+                🧠 Your role: **{agent.role}** — Solve the task efficiently, accurately, and with minimal explanation unless explicitly requested.
+            ''')).model_dump()
+        ]
+    add_dependency_context(graph, task, messages, chat)
+
+    res =  await llm_tool_call(
+        chat = chat,
+        request=task.description,
+        messages = messages,
+        repo = repo,
+        task=task,
+        callables = {"REPO_LOAD_FILES": repo.load_files} if repo else None
+    )
+    if chat.id not in taskResults:
+        taskResults[chat.id] = {}
+    if task.result_type == ResultType.TEXT:
+        taskResults[chat.id][task.unique_id] = res.text_result
+    save_task_result(chat, task.unique_id, res.text_result if task.result_type == ResultType.TEXT else "")
+    return res
+
+
+async def plan_medium_request(chat: Chat) -> tuple[Agent, Optional[Repo], bool, bool]:
+    """
+    Chooses the agent and plans the tasks of a medium request, adapting the plan of a similar past
+    request if there is one. Returns the agent, the repo, whether the repo was created and whether the plan is new.
+    """
+    cached = await adapt_cached_plan(chat) if settings.PLAN_CACHE_ENABLED else None
+    agent, tasks = cached or await generate_plan(chat)
+    task_string = "\n\n".join([f"* {task.description}" for task in tasks.tasks]) + "\n\n ... "
 
+    await chat.set_message(f"{agent.role}: Tasks: \n\n {task_string}")
+    repo, repo_created = await open_task_repo(chat, tasks)
 
-async def solve_tasks(agent:Agent, chat: Chat, repo: Repo):
-    for task in chat.tasks.tasks:
-        logger.info("task %s", task)
-        await chat.set_message(f"{agent.role}: Solving subtask {task.description} \n\n")
+    # Creating jira Subtasks, toDO
+    chat.tasks = tasks
+    save_checkpoint(chat, Stage.PLANNED, agent=agent, repo=make_repo_ref(repo, repo_created))
+    return agent, repo, repo_created, cached is None
+
+
+async def adapt_cached_plan(chat: Chat) -> Optional[tuple[Agent, Tasks]]:
+    """Adapts the plan of a similar past request with a single call, None if there is no similar plan."""
+    try:
+        match = await asyncio.to_thread(plan_cache.find_similar, chat.user.id, chat.project_description, settings.PLAN_CACHE_SIMILARITY)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        # The cache must never keep a request from being planned
+        logger.error("Plan cache lookup failed: %s", e)
+        return None
+    if match is None:
+        return None
+    cached, similarity = match
+    agent = cached.agent
+    logger.info("Adapting cached plan with similarity %.3f: %s", similarity, cached.description[:80])
+    await chat.set_message(f"Found the plan of a similar request, {agent.role} adapts it to yours ... \n\n")
 
+    tasks = await llm_call_wrapper(
+        call_site="adapt_plan",
+        response_format=Tasks,
         messages=[
-            Message(role=Roles.SYSTEM.value, content=dedent(f"""
-                You are {agent.role} with background {agent.background} and skills {agent.skills}
-                the overall project description is: {chat.project_description}
-                """)).model_dump(),
+            Message(role=Roles.SYSTEM.value, content=f"You are {agent.role} with background {agent.background} and skill {agent.skills}").model_dump(),
             Message(role=Roles.USER.value, content=dedent(f'''
-                    You are working on task: {task.unique_id} - {task.unique_name}
-
-                    ───────────────────────────────────────────────────────────────────────────────
-                    🔹 **Environment & Tools Overview**
-                    - Your are getting called over and over again with the new Feedback from tools you use. Until you set done=true.
-                    - You have access to a Git repository. Use the `updateFile` field to update or create files.
-                    - To delete a file, set its content to `"DELETE"`.
-                    - Shell commands are available via the `command` field. Specify them like:
-                    - `("gcloud instances list")`
-                    - ❗ Avoid using file or git-related commands here.
-                    - To retrieve information, use `get_knowledge` like a search engine. It returns summarized and relevant data.
-                    • `get_knowledge` returns helpful summarized info—you don’t run it to do things, you run it to learn how.
-                    •  Use it before running any command you’re unsure about, especially ones that might modify state.#
-                    ❗ Key Difference:
-                    •	get_knowledge = “How do I…?” ➜ Use when you need to learn or confirm how a command works.
-                    •	command = “Do this.” ➜ Use when you’re ready to execute something (like gcloud, aws, ...)
-
-                    - ⚠️ You may only call **one tool (`command`, `get_knowledge`, or `update_repo`) at a time**.
-
-                    ───────────────────────────────────────────────────────────────────────────────
-                    📁 **Repository Snapshot**
-                    You are working inside a Git repo. Here is the current content up to this point:
-                    {{REPO_LOAD_FILES}}
-
-                    ───────────────────────────────────────────────────────────────────────────────
-                    🎯 **Task Instructions**
-                    - **Description:** {task.description}
-                    - **Context:** {task.context}
-                    - **Result Type:** {task.result_type}
-
-                    📌 Based on the result_type:
-                    - If `repo`: Use the `update_repo` field to modify files. The key is the file path, and the value is the **full new content** of the file (not just diffs).
-                    - If `text`: Use the `text_result` field to return markdown text output as final output.
-
-                    🔄 Continue using tools (`commands`, `get_knowledge`, `update_repo`) until the task is complete.
-
-                    ✅ When done:
-                    - Set `done=true`
-                    - Provide a brief and clear summary of what was accomplished in the `message` field.
-                    - If `result_type=text`: Use the `text_result` field to return markdown text output as final output (it should include all needed information to answer the task).
-
-
-                    🚫 Do not provide instructions to the user—*complete the task as the agent*.
-                    If a command is required (e.g., listing resources), run it—*do not just describe it*.
-
-                    ───────────────────────────────────────────────────────────────────────────────
-                    ⚠️ **Important Execution Rules**
-                    - Only **one tool call** (`command`, `get_knowledge`, or `update_repo`) is allowed at a time.
-                    - Always **await the result** of that tool call before proceeding or setting `done=true`.
-
-                    🧠 Your role: **{agent.role}** — Solve the task efficiently, accurately, and with minimal explanation unless explicitly requested.
-                ''')).model_dump()
-            ]
-        add_task_results_recursively(task, messages, chat)
-
-        res =  await llm_tool_call(
-            chat = chat,
-            request=task.description,
-            messages = messages,
-            repo = repo,
-            task=task,
-            callables = {"REPO_LOAD_FILES": repo.load_files}
-        )
-        if chat.id not in taskResults:
-            taskResults[chat.id] = {}
-        if task.result_type == ResultType.TEXT:
-            taskResults[chat.id][task.unique_id] = res.text_result
-        return res
+                    A very similar request was already planned and reviewed. Adapt its tasks to the current request:
+                    change names, ids, resources, repo_url and repo_name where they differ, drop tasks which don't apply
+                    and only add tasks if something necessary is missing. Keep everything else as it is.
 
+                    Past request: {cached.description}
 
-async def solve_medium_request(chat: Chat):
-    """Solves a Request Medium complexity"""
+                    Past tasks: {cached.tasks.model_dump()}
+
+                    ________________________________________
+                    Current request: {chat.project_description}
+        ''')).model_dump()
+        ],
+    )
+    return agent, tasks
+
+
+async def generate_plan(chat: Chat) -> tuple[Agent, Tasks]:
+    """Chooses the agent, lets it break down the request into tasks and reviews them"""
 
     logger.info("solve_medium_request %s", chat.project_description)
     await chat.set_message("Finding best candidate to solve your request ... \n\n")
@@ -282,25 +390,62 @@ async def solve_medium_request(chat: Chat):
         ''')).model_dump()
         ],
     )
-    tasks=tasks_reviewed
-    task_string = "\n\n".join([f"* {task.description}" for task in tasks.tasks]) + "\n\n ... "
-
-    await chat.set_message(f"{agent.role}: Tasks: \n\n {task_string}")
-    repo = None
-    repo_created = False
+    return agent, tasks_reviewed
+
+
+async def open_task_repo(chat: Chat, tasks: Tasks) -> tuple[Optional[Repo], bool]:
+    """Clones or creates the repository if any task has a repo result, returns it and whether it was created."""
+    if not any(task.result_type == ResultType.REPO for task in tasks.tasks):
+        return None, False
+    if tasks.repo_url != "":
+        await chat.set_message(f"Repo URL: {tasks.repo_url}")
+        return Repo(url = tasks.repo_url), False
+    return Repo(name = tasks.repo_name), True
+
+
+def make_repo_ref(repo: Optional[Repo], created: bool) -> Optional[RepoRef]:
+    if repo is None:
+        return None
+    return RepoRef(uuid=repo.uuid, name=getattr(repo, "name", ""), local_path=str(repo.local_path), created=created)
+
+
+async def resume_plan(chat: Chat, checkpoint: ChatCheckpoint) -> tuple[Agent, Optional[Repo], bool, set[str]]:
+    """Restores agent, repository and solved tasks of a planned chat."""
+    agent = checkpoint.agent
+    solved = dict(checkpoint.task_results)
+    repo, repo_created = None, False
+    if checkpoint.repo is not None:
+        repo, repo_created = restore_repo(checkpoint.repo), checkpoint.repo.created
+    if repo is None and any(task.result_type == ResultType.REPO for task in chat.tasks.tasks):
+        # The working copy is gone, so its changes have to be made again
+        repo, repo_created = await open_task_repo(chat, chat.tasks)
+        solved = {task.unique_id: solved[task.unique_id] for task in chat.tasks.tasks
+                  if task.unique_id in solved and task.result_type != ResultType.REPO}
+        save_checkpoint(chat, Stage.PLANNED, repo=make_repo_ref(repo, repo_created))
+
+    text_results = {task.unique_id: solved[task.unique_id] for task in chat.tasks.tasks
+                    if task.unique_id in solved and task.result_type == ResultType.TEXT}
+    taskResults.setdefault(chat.id, {}).update(text_results)
+    await chat.set_message(f"Resuming with agent {agent.role}, {len(solved)} of {len(chat.tasks.tasks)} tasks are already solved ... \n\n")
+    return agent, repo, repo_created, set(solved)
 
-    if any(task.result_type == ResultType.REPO for task in tasks.tasks):
-        if tasks.repo_url != "":
-            await chat.set_message(f"Repo URL: {tasks.repo_url}")
-            repo = Repo(url = tasks.repo_url)
-        else:
-            repo_created = True
-            repo = Repo(name = tasks.repo_name)
 
-    # Creating jira Subtasks, toDO
-    chat.tasks = tasks
-
-    await solve_tasks(agent=agent,chat=chat, repo=repo)
+async def solve_medium_request(chat: Chat):
+    """Solves a Request Medium complexity, resuming a planned chat from its checkpoint"""
+    checkpoint = load_checkpoint(chat.id)
+    new_plan = False
+    if checkpoint is not None and checkpoint.stage == Stage.PLANNED and checkpoint.agent is not None and chat.tasks:
+        agent, repo, repo_created, solved = await resume_plan(chat, checkpoint)
+    else:
+        agent, repo, repo_created, new_plan = await plan_medium_request(chat)
+        solved = set()
+
+    results = await solve_tasks(agent=agent,chat=chat, repo=repo, solved=solved)
+    if new_plan and results is not None and settings.PLAN_CACHE_ENABLED:
+        try:
+            await asyncio.to_thread(plan_cache.add, chat.user.id, chat.project_description, agent, chat.tasks)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Caching the plan failed: %s", e)
 
     if repo_created:
         await chat.set_message(dedent(f"""Work Repo can be downloaded using:
@@ -314,29 +459,41 @@ class Queries(BaseModel):
 
 def get_queries_for_document(doc, query):
     logger.info("getQueriesForDocument %s %s", doc[:100], query)
-    response = litellm.completion(
-        model=MODEL,
-        response_format=Queries,
-        messages=[
-            Message(role=Roles.SYSTEM.value, content="You are a research query specialist").model_dump(),
-            Message(role=Roles.USER.value, content=dedent(f'''Given the following Documentation:
+    messages=[
+        Message(role=Roles.SYSTEM.value, content="You are a research query specialist").model_dump(),
+        Message(role=Roles.USER.value, content=dedent(f'''Given the following Documentation:
+            
+                {doc}
                 
-                    {doc}
-                    
-                    ________________________________________
+                ________________________________________
 
-                    Return a list of short search queries users and ai agents might use to search for the provided information in the documentation.
-                    Each search query should contain 8-15 words
-                    If the following query can be used to find relevant information in the documentation, add it to your list of queries. 
-                    But please only add the query if the answer is not the page. The Documentation is maybe just a subpage and a different page might be better suited to answer the query:
-                    {query}
-            ''')).model_dump()
-        ],
+                Return a list of short search queries users and ai agents might use to search for the provided information in the documentation.
+                Each search query should contain 8-15 words
+                If the following query can be used to find relevant information in the documentation, add it to your list of queries. 
+                But please only add the query if the answer is not the page. The Documentation is maybe just a subpage and a different page might be better suited to answer the query:
+                {query}
+        ''')).model_dump()
+    ]
+    call_site = "get_queries_for_document"
+    models = get_models(call_site, Queries)
+    cache_ttl = get_cache_ttl(call_site)
+    cache_key = make_cache_key(models[0], messages, Queries) if cache_ttl else None
+    if cache_key:
+        cached = llm_cache.get_validated(cache_key, cache_ttl, call_site, Queries)
+        if cached is not None:
+            return cached
+
+    response = completion_with_fallbacks(
+        models,
+        response_format=Queries,
+        messages=messages,
     )
     logger.debug("solve reponse %s", response)
     content = response.choices[0].message.content
 
     queries = Queries.model_validate(json.loads(content))
+    if cache_key:
+        llm_cache.set(cache_key, content)
     return queries
 
 
@@ -346,7 +503,7 @@ async def get_clarification_questions(chat: Chat):
     """
     logger.info("%s", chat.original_request)
 
-    response = await llm_call_wrapper(response_format=ClarificationQuestions,messages=[
+    response = await llm_call_wrapper(call_site="get_clarification_questions", response_format=ClarificationQuestions, messages=[
             Message(
                 role=Roles.SYSTEM.value,
                 content="You are an expert assistant specializing in refining ambiguous or incomplete user requests by asking relevant clarification questions."
@@ -461,7 +618,7 @@ async def merge_questions_with_response(questions: list[ClarificationQuestion],
         open_questions = "\n".join(
             [f"{q.number}: {q.question}" for q in questions if q.status == "open"]
         )
-        return await llm_call_wrapper(response_format=ClarificationQuestions, messages=[
+        return await llm_call_wrapper(call_site="merge_questions_with_response", response_format=ClarificationQuestions, messages=[
                 Message(role=Roles.SYSTEM.value, content="You are an expert assistant").model_dump(),
                 Message(role=Roles.USER.value, content=dedent(f'''
                     For a given set of clarification questions and a user response, extract the relevant information from the user response and add it to the corresponding clarification question object. 
@@ -483,13 +640,15 @@ async def merge_questions_with_response(questions: list[ClarificationQuestion],
 
 async def get_project_description(chat: Chat):
     """
-    Generates a project description for a given request.
+    Generates a project description for a given request and streams it to the chat.
     """
     logger.info("getProjectDescription %s", chat.original_request)
     questions = "\n".join(
         [f"{q.number}: {q.question} \n {q.answer} \n" for q in chat.clarification_questions if q.status == "answered"]
     )
+    await chat.set_message("Revised Task Description: ")
     return await llm_call_wrapper(
+        stream_chat=chat,
         messages=[
             Message(
                 role=Roles.SYSTEM.value,
@@ -538,38 +697,90 @@ async def get_project_description(chat: Chat):
     )
 
 
+async def gather_infos_and_questions(chat: Chat) -> tuple[str, list[ClarificationQuestion]]:
+    """Gathers the first information about the request and drafts the clarification questions."""
+    chat.info = await gather_first_infos(chat)
+    return chat.info, await get_clarification_questions(chat)
+
+
+async def process_request_until_deadline(chat: Chat, messages: list[Message]):
+    """
+    Runs process_request. If the request deadline passes, the chat is closed with the results of the
+    tasks solved so far; the checkpoint isn't marked done, so the chat can go on with the next message.
+    """
+    try:
+        return await process_request(chat=chat, messages=messages)
+    except DeadlineExceeded as e:
+        end_request(chat)
+        logger.warning("Request of chat %s stopped: %s", chat.id, e)
+        solved = taskResults.get(chat.id, {})
+        partial = "\n\n".join(f"**{task_id}**: {result}" for task_id, result in solved.items())
+        await chat.set_message(f"⏱️ The request ran out of time after {settings.REQUEST_DEADLINE:g} seconds. "
+                               + (f"Results so far:\n\n{partial}" if partial else "The output above is all there is so far.")
+                               + " \n\n")
+        await chat.set_message("[DONE]")
+        return "deadline"
+
+
 async def process_request(chat: Chat, messages: list[Message]):
     """
     Processes a request from a client.
+    Once it is processed its checkpoint is no longer in progress, a request which fails or is cut off
+    by a restart stays in progress and is resumed when its first message is sent again.
     """
     logger.info("Processing request %s for chat_id %s", messages[0].content[:80], chat.id)
     first_message = len(messages)==1
+    chat.reset_budget()
+    # Results of earlier requests of the chat; a resumed plan restores its own from the checkpoint
+    taskResults.pop(chat.id, None)
 
     #request = "\n\n".join([f"{msg.role}:{msg.content}" for msg in messages])
-    if first_message:
+    speculation = None
+    # A chat resumed from a checkpoint already has the results of its completed stages
+    if first_message and chat.category is None:
         chat.original_request = messages[0].content
-        category = await categorize_request(chat)
+        if settings.SPECULATIVE_PIPELINE:
+            # Most requests are not EASY, so start their first stages before the category is known
+            speculation = Speculation(chat, gather_infos_and_questions)
+        try:
+            category = await categorize_request(chat)
+        except Exception:
+            if speculation:
+                speculation.discard()
+            raise
         chat.category = category.lvl
+        save_checkpoint(chat, Stage.CATEGORIZED)
 
 
     if chat.category:
         if chat.category == DifficultyLevel.EASY:
+            if speculation:
+                speculation.discard()
             await answer_request(chat)
+            save_checkpoint(chat, Stage.DONE)
         else:
-            if first_message:
-                chat.info = await gather_first_infos(chat)
-                chat.clarification_questions = await get_clarification_questions(chat)
+            if speculation:
+                chat.info, chat.clarification_questions = await speculation.commit()
+                save_checkpoint(chat, Stage.CLARIFYING)
+            elif chat.clarification_questions is None:
+                chat.info, chat.clarification_questions = await gather_infos_and_questions(chat)
+                save_checkpoint(chat, Stage.CLARIFYING)
 
             if any(q.status == "open" for q in chat.clarification_questions):
                 chat.clarification_questions = await merge_questions_with_response(chat.clarification_questions, messages[-1].content)
+                save_checkpoint(chat, Stage.CLARIFYING)
                 if any(q.status == "open" for q in chat.clarification_questions):
                     open_questions = "\n".join(
                         [f"{q.number}: {q.question}" for q in chat.clarification_questions if q.status == "open"]
                     )
                     await chat.set_message(f"Please answer the following open questions to clarify your request: {open_questions} \n\n")
             else:
-                chat.project_description = await get_project_description(chat)
-                await chat.set_message(f"Revised Task Description: {chat.project_description} \n\n")
+                if chat.project_description is None:
+                    chat.project_description = await get_project_description(chat)
+                    await chat.set_message("\n\n")
+                    save_checkpoint(chat, Stage.DESCRIBED)
                 await solve_medium_request(chat)
+                save_checkpoint(chat, Stage.DONE)
+    end_request(chat)
     await chat.set_message("[DONE]")
     return "fin"
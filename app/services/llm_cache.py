@@ -0,0 +1,142 @@
+import asyncio
+import json
+import re
+import time
+from collections import Counter, OrderedDict
+
+from pydantic import BaseModel
+
+from app.config import logger, settings, llm_cache_collection
+from app.services.helpers import generate_hash
+from app.services.json_repair import loads_tolerant
+
+
+def normalize_messages(messages: list[dict[str, any]]) -> list[dict[str, str]]:
+    """Reduces messages to role and whitespace normalized content."""
+    return [
+        {"role": str(msg.get("role")), "content": re.sub(r"\s+", " ", str(msg.get("content", ""))).strip()}
+        for msg in messages
+    ]
+
+
+def make_cache_key(model: str, messages: list[dict[str, any]], response_format: type[BaseModel] = None) -> str:
+    """Builds the cache key from the model, the normalized messages and the response_format schema."""
+    schema = response_format.model_json_schema() if response_format else None
+    return generate_hash(json.dumps(
+        {"model": model, "messages": normalize_messages(messages), "schema": schema},
+        sort_keys=True,
+    ))
+
+
+class LLMCache:
+    """
+    Two tier cache for raw LLM responses.
+
+    Entries are kept in an in-memory LRU limited to max_entries and persisted in the object store,
+    so they survive restarts and are shared between workers. The TTL is given per lookup, which lets
+    every call site decide how long its answers stay valid. Persisted entries older than every TTL
+    are deleted by prune.
+    """
+
+    def __init__(self, collection, max_entries: int):
+        self.collection = collection
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.counters: Counter = Counter()
+
+    def get(self, key: str, ttl: int, site: str = "") -> str:
+        """Returns the cached content for key if it is younger than ttl seconds, otherwise None."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[0] <= ttl:
+            self._entries.move_to_end(key)
+            self._count(site, "hit_memory")
+            return entry[1]
+
+        doc = self.collection.find_one({"key": key})
+        if doc is not None and now - doc.get("timestamp", 0) <= ttl:
+            self._remember(key, doc["timestamp"], doc["content"])
+            self._count(site, "hit_store")
+            return doc["content"]
+
+        if doc is not None:
+            self.collection.delete(doc)
+        self._entries.pop(key, None)
+        self._count(site, "miss")
+        return None
+
+    def get_validated(self, key: str, ttl: int, site: str = "", response_format: type[BaseModel] = None):
+        """
+        Like get, but validates the cached content against response_format.
+        Entries which no longer validate are dropped and reported as None.
+        """
+        cached = self.get(key, ttl, site)
+        if cached is None or response_format is None:
+            return cached
+        try:
+            return response_format.model_validate(loads_tolerant(cached))
+        except ValueError as e:
+            logger.warning("Cached response for %s is no longer valid: %s", site, e)
+            self.invalidate(key, site)
+            return None
+
+    def set(self, key: str, content: str):
+        """Stores content in both tiers."""
+        timestamp = time.time()
+        self._remember(key, timestamp, content)
+        doc = self.collection.find_one({"key": key})
+        if doc is not None:
+            self.collection.delete(doc)
+        self.collection.insert({"kind": "llm_response", "key": key, "content": content, "timestamp": timestamp})
+
+    def prune(self, max_age: float) -> int:
+        """Deletes the persisted entries older than max_age seconds and returns how many were deleted."""
+        cutoff = time.time() - max_age
+        expired = [doc for doc in self.collection.find({"kind": "llm_response"}) if doc.get("timestamp", 0) < cutoff]
+        if expired:
+            self.collection.delete_many(expired)
+        for key in [key for key, (timestamp, _) in self._entries.items() if timestamp < cutoff]:
+            del self._entries[key]
+        self.counters["pruned"] += len(expired)
+        logger.info("Pruned %d expired LLM cache entries", len(expired))
+        return len(expired)
+
+    def invalidate(self, key: str, site: str = ""):
+        """Drops an entry, e.g. when the cached content no longer validates."""
+        self._entries.pop(key, None)
+        doc = self.collection.find_one({"key": key})
+        if doc is not None:
+            self.collection.delete(doc)
+        self._count(site, "invalid")
+
+    def _remember(self, key: str, timestamp: float, content: str):
+        self._entries[key] = (timestamp, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _count(self, site: str, event: str):
+        self.counters[event] += 1
+        self.counters[f"{site}:{event}"] += 1
+        logger.debug("LLM cache %s for %s, counters %s", event, site, dict(self.counters))
+
+
+llm_cache = LLMCache(collection=llm_cache_collection, max_entries=settings.LLM_CACHE_MAX_ENTRIES)
+
+
+def get_cache_ttl(site: str) -> int:
+    """Returns the configured TTL for a call site, None if the call site is not cached."""
+    if not site or not settings.LLM_CACHE_ENABLED:
+        return None
+    return settings.LLM_CACHE_TTLS.get(site)
+
+
+async def prune_llm_cache_periodically():
+    """Prunes the entries no call site can hit anymore every settings.LLM_CACHE_PRUNE_INTERVAL seconds."""
+    while True:
+        if settings.LLM_CACHE_TTLS:
+            try:
+                await asyncio.to_thread(llm_cache.prune, max(settings.LLM_CACHE_TTLS.values()))
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.error("Pruning the LLM cache failed: %s", e)
+        await asyncio.sleep(settings.LLM_CACHE_PRUNE_INTERVAL)
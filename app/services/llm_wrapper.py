@@ -3,14 +3,22 @@ import json
 import re
 from textwrap import dedent
 from collections import UserDict
-import litellm
-from pydantic import BaseModel, ValidationError
-from app.models.repo import Repo
+from pydantic import BaseModel
+from app.models.budget import Budget, RepetitionDetector
+from app.models.repo import EditConflictError, Repo
+from app.services.compaction import fit_to_context, shrink_after_overflow
+from app.services.deadline import DeadlineExceeded, remaining
 from app.services.helpers import generate_hash
+from app.services.json_repair import loads_tolerant
+from app.services.json_stream import JsonStreamParser
 from app.services.knowledge import get_knowledge
+from app.services.llm_cache import get_cache_ttl, llm_cache, make_cache_key
+from app.services.model_router import acompletion_with_fallbacks, get_models, record_usage, token_usage, track_usage
+from app.services.native_tools import EDIT_FILES, EXECUTE_SHELL, FINISH, GET_KNOWLEDGE, TOOLS, UPDATE_FILES, native_tools_prompt, parse_tool_arguments, tool_call_message, tool_result_message, use_native_tools
+from app.services.retry_policy import ErrorKind, InvalidResponseError, RetryPolicy, classify_error
 from app.models.models import Task
 from app.config import logger, settings
-from app.models.models import Chat, Message, ResponseToolCall, ResultType, Roles
+from app.models.models import Chat, FileEdit, Message, ResponseToolCall, ResultType, Roles
 from app.services.wss import execute_shell
 
 
@@ -24,56 +32,139 @@ class Check(BaseModel):
 
 
 
-async def llm_call_wrapper(retry_count=0, max_retrys=3, **kwargs):
+async def stream_deltas(response):
+    """
+    Yields the text deltas of a streamed litellm completion. The usage of the completion comes with
+    the final chunk (see timed_acompletion) and is recorded once the stream is complete.
+    """
+    usage = None
+    async for chunk in response:
+        usage = getattr(chunk, "usage", None) or usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+    record_usage(usage)
+
+
+async def collect_streamed_json(response, on_stream_event) -> str:
+    """
+    Collects a streamed JSON completion and awaits on_stream_event(field, value) for every
+    top-level array element or object entry as soon as it is complete.
+    """
+    parser = JsonStreamParser()
+    parts = []
+    async for delta in stream_deltas(response):
+        parts.append(delta)
+        for field, value in parser.feed(delta):
+            await on_stream_event(field, value)
+    return "".join(parts)
+
+
+def parse_llm_content(content: str, response_format: type[BaseModel] = None):
+    """
+    Validates content against response_format if given, otherwise returns it unchanged.
+    Malformed JSON is repaired locally first (see repair_json), a re-prompt is only needed if that fails.
+    """
+    if response_format:
+        if content is None:
+            raise InvalidResponseError("The response has no content")
+        return response_format.model_validate(loads_tolerant(content))
+    return content
+
+
+def response_message(response):
+    """Returns the message of a completion, raises InvalidResponseError if it has none."""
     try:
-        if not kwargs.get("model"):
-            kwargs["model"] = settings.LLM_MODEL
-        response = await litellm.acompletion(**kwargs)
-        content = response.choices[0].message.content
-        if kwargs.get("response_format"):
-            return kwargs.get("response_format").model_validate(json.loads(content))
-        return content
-    except ValueError as e:
-        logger.error("Error json decoder error response not valid json: %s", e)
-        if retry_count > max_retrys:
-            logger.error("Max retries reached. Returning None or raising.")
-            raise e  # or return None
-        messages = []
-        messages.append(
-                Message(role=Roles.ASSISTANT, content=f"The output json is not correct. Got validation error in output {str(e)}").model_dump()
-            )
-        messages.append(
-                Message(role=Roles.USER, content=f"fix the following output to meet the requested output format: {content}").model_dump()
-            )
-        kwargs["messages"] = messages
-        return await llm_call_wrapper(retry_count=retry_count + 1, **kwargs)
-    except litellm.exceptions.BadRequestError as e:
-        logger.error("Error in LLM call, sleep for 5 before retry: %s", e)
-        await asyncio.sleep(5)
-        if retry_count > max_retrys:
-            logger.error("Max retries reached. Returning None or raising.")
-            raise e  # or return None
-        return await llm_call_wrapper(retry_count=retry_count + 1, **kwargs)
-
-    except ValidationError as e:
-        logger.error("Error parsing LLM response: %s", e)
-        if retry_count > max_retrys:
-            logger.error("Max retries reached. Returning None or raising.")
-            raise e  # or return None
-        messages = []
-        messages.append(
-                Message(role=Roles.ASSISTANT, content=f"The output format is not correct. Got validation error in output {str(e)}").model_dump()
-            )
-        messages.append(
-                Message(role=Roles.USER, content=f"fix the following output to meet the requested output format: {content}").model_dump()
-            )
-        kwargs["messages"] = messages
-        return await llm_call_wrapper(retry_count=retry_count + 1, **kwargs)
-    except (KeyError, TypeError) as e:  # Replace with specific exceptions
-        logger.error("Error parsing LLM response expecting (response.choices[0].message.content): error %s", e)
-        logger.error("Error parsing LLM response: %s", response)
-        logger.error("Error parsing LLM response, won't retry")
-        raise ValueError(f"Invalid response format: {response}") from e
+        return response.choices[0].message
+    except (AttributeError, IndexError, KeyError, TypeError) as e:
+        logger.error("Error parsing LLM response, expecting response.choices[0].message: %s", response)
+        raise InvalidResponseError(f"Invalid response format: {response}") from e
+
+
+def repair_messages(messages: list[dict[str, any]], content: str, error: Exception) -> list[dict[str, any]]:
+    """Returns the conversation extended by the invalid output and a request to fix it."""
+    return [
+        *messages,
+        Message(role=Roles.ASSISTANT, content=f"{content}").model_dump(),
+        Message(role=Roles.USER, content=f"The output format is not correct. Got validation error in output {str(error)}\n"
+                "Fix the output to meet the requested output format.").model_dump(),
+    ]
+
+
+async def llm_call_wrapper(retry_count=0, max_retrys=None, stream_chat: Chat = None, on_stream_event=None, call_site: str = None, model: str = None, **kwargs):
+    """
+    Calls the LLM and returns the content, validated against response_format if given.
+    If tools are given, the assistant message is returned as is, with its tool_calls.
+    If stream_chat is given and no response_format is requested, the completion is streamed
+    token by token into the chat queue while it is generated.
+    If on_stream_event is given together with a response_format, the completion is streamed and
+    completed elements are reported before the response is validated (see collect_streamed_json).
+    Repair retries are not streamed.
+    The model is chosen by the model router from call_site and response_format (see get_models),
+    an explicitly given model is tried first.
+    If call_site has a TTL in settings.LLM_CACHE_TTLS, responses are served from and stored in the
+    LLM cache. Cached responses are validated against response_format like fresh ones.
+    Failed calls are retried as decided by RetryPolicy: invalid output is sent back together with
+    the original conversation, a context overflow shrinks the prompt or switches to the large
+    context model, rate limits and overload back off.
+    Calls and backoffs are limited to the time left for the request, DeadlineExceeded is never retried.
+    """
+    policy = RetryPolicy(max_retries=max_retrys)
+    response_format = kwargs.get("response_format")
+    base_messages = kwargs["messages"]
+    attempt = retry_count
+    while True:
+        content = None
+        models = get_models(call_site, response_format, preferred=model)
+        try:
+            cache_ttl = get_cache_ttl(call_site) if stream_chat is None and attempt == 0 else None
+            cache_key = make_cache_key(models[0], kwargs["messages"], response_format) if cache_ttl else None
+            if cache_key:
+                cached = llm_cache.get_validated(cache_key, cache_ttl, call_site, response_format)
+                if cached is not None:
+                    return cached
+
+            if kwargs.get("tools"):
+                response = await acompletion_with_fallbacks(models, **kwargs)
+                return response_message(response)
+            if stream_chat is not None and not response_format:
+                response = await acompletion_with_fallbacks(models, stream=True, **kwargs)
+                return await stream_chat.stream_message(stream_deltas(response))
+            if on_stream_event is not None and response_format:
+                response = await acompletion_with_fallbacks(models, stream=True, **kwargs)
+                content = await collect_streamed_json(response, on_stream_event)
+            else:
+                response = await acompletion_with_fallbacks(models, **kwargs)
+                content = response_message(response).content
+            result = parse_llm_content(content, response_format)
+            if cache_key:
+                llm_cache.set(cache_key, content)
+            return result
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            kind = classify_error(e)
+            if not policy.should_retry(kind, attempt, models[0]):
+                logger.error("LLM call %s failed with %s error after %d retries: %s", call_site, kind.value, attempt, e)
+                raise
+            delay = policy.delay(kind, attempt, e)
+            left = remaining()
+            if left is not None and delay >= left:
+                raise DeadlineExceeded(f"Request deadline exceeded before retrying LLM call {call_site}") from e
+            logger.warning("LLM call %s failed with %s error, retry %d in %.1fs: %s", call_site, kind.value, attempt + 1, delay, e)
+            error = e
+
+        if kind == ErrorKind.VALIDATION:
+            # A response without content has nothing to fix, the call is just repeated
+            if content is not None:
+                kwargs["messages"] = repair_messages(base_messages, content, error)
+            on_stream_event = None
+        elif kind == ErrorKind.CONTEXT_OVERFLOW:
+            base_messages = list(base_messages)
+            model = shrink_after_overflow(base_messages, models[0])
+            kwargs["messages"] = base_messages
+        await asyncio.sleep(delay)
+        attempt += 1
 
 
 class DefaultPlaceholderDict(UserDict):
@@ -135,115 +226,417 @@ async def execute_tools(commands: list[str], messages: list[dict[str, any]], cha
             )
 
 
-async def llm_tool_call(
-    messages: list[dict[str, any]],
-    chat: Chat,
-    request: str ="",
-    model: str = None,
-    callables: dict = None,
-    repo: Repo = None,
-    task: Task = None
-):
-    last_tool_call_hash = None
-    if not model:
-        model = settings.LLM_MODEL
+async def run_knowledge_query(chat: Chat, query: str) -> str:
+    """Resolves a get_knowledge query and returns the message content for the conversation."""
+    try:
+        if chat:
+            await chat.set_message(f"🔧 `getKnowledge`: {query}  \n\n")
+        message_content = f"{'\n\n'.join(await get_knowledge(chat=chat, query=query))}"
 
-    logger.info("LLM Call with messages: %s", messages)
+        if chat:
+            await chat.set_message(f"{message_content}  \n\n")
 
-    while True:
-        update_messages(messages, callables)
-        parsed_resp = await llm_call_wrapper(model=model,
-            response_format=ResponseToolCall,
-            messages=messages
-        )
+    except (KeyError, ValueError, RuntimeError) as e:  # Replace with specific exceptions
+        message_content = f"❌ Tool `getKnowledge` execution failed for query {query}. Error: {str(e)}"
+        logger.error("Error executing tool 'getKnowledge' with query %s: %s", query, e)
 
-        current_hash = generate_hash("".join(parsed_resp.commands))
-        if last_tool_call_hash is not None and current_hash == last_tool_call_hash and parsed_resp.done:
-            logger.info("Duplicate tool call detected. Skipping execution. done %s", parsed_resp.done)
-        else:
-            commands = [command for command in parsed_resp.commands if command.strip() != ""]
-            parsed_resp.done= False if commands else parsed_resp.done
-            await execute_tools(commands=commands, messages=messages, chat=chat)
+    logger.info("Appending message to messages: %s", message_content)
+    return message_content
 
-        queries = [query for query in parsed_resp.get_knowledge if query.strip() != ""]
 
-        for query in queries:
-            try:
-                if chat:
-                    await chat.set_message(f"🔧 `getKnowledge`: {query}  \n\n")
-                message_content = f"{'\n\n'.join(await get_knowledge(chat=chat, query=query))}"
+def not_yet_started(items: list, started: list) -> list:
+    """Returns the items of the final response which were not already started while streaming."""
+    pending = list(started)
+    rest = []
+    for item in items:
+        if item in pending:
+            pending.remove(item)
+        else:
+            rest.append(item)
+    return rest
 
-                if chat:
-                    await chat.set_message(f"{message_content}  \n\n")
 
-            except (KeyError, ValueError, RuntimeError) as e:  # Replace with specific exceptions
-                message_content = f"❌ Tool `getKnowledge` execution failed for query {query}. Error: {str(e)}"
-                logger.error("Error executing tool 'getKnowledge' with query %s: %s", query, e)
+class ToolCallExecution:
+    """
+    Executes the tools of a ResponseToolCall, starting knowledge queries while the response is still streamed.
+
+    Only read-only work starts early: commands and file updates have side effects and wait until
+    the response is validated, so a response which is retried doesn't run them twice.
+    Commands run one after another in the given order, knowledge queries run concurrently
+    limited by the chat's knowledge semaphore.
+    Once the response is validated, finish starts the commands, file updates and the queries which
+    were not seen while streaming, waits for all of them and appends their results to the conversation:
+    command outputs first, then knowledge in the order the queries were given.
+    """
 
-            # Log and append the result
-            logger.info("Appending message to messages: %s", message_content)
+    def __init__(self, chat: Chat, repo: Repo = None):
+        self.chat = chat
+        self.repo = repo
+        self.commands: list[str] = []
+        self.queries: list[str] = []
+        self.repo_update: dict = {}
+        self.edited_files: list[str] = []
+        self._command_messages: list[dict[str, any]] = []
+        self._commands_done: asyncio.Future = None
+        self._query_results: list[asyncio.Future] = []
+        self._query_semaphore = chat.knowledge_semaphore if chat else asyncio.Semaphore(max(1, settings.KNOWLEDGE_PARALLELISM))
+
+    async def on_stream_event(self, field: str, value: any):
+        """Receives completed elements from the streamed response (see collect_streamed_json)."""
+        if field == "get_knowledge" and isinstance(value, str):
+            self.add_query(value)
+
+    def add_command(self, command: str) -> asyncio.Future:
+        """Starts command after the previous ones, the future resolves to its output message."""
+        if command.strip() == "":
+            return None
+        self.commands.append(command)
+        previous = self._commands_done
+
+        async def run():
+            if previous is not None:
+                await previous
+            command_messages = []
+            await execute_tools(commands=[command], messages=command_messages, chat=self.chat)
+            self._command_messages.extend(command_messages)
+            return "\n".join(message["content"] for message in command_messages)
+
+        self._commands_done = asyncio.ensure_future(run())
+        return self._commands_done
+
+    def add_query(self, query: str) -> asyncio.Future:
+        """Starts query, the future resolves to the knowledge message."""
+        if query.strip() == "":
+            return None
+        self.queries.append(query)
+        result = asyncio.ensure_future(self._run_query(query))
+        self._query_results.append(result)
+        return result
+
+    async def _run_query(self, query: str) -> str:
+        # A failing query must not cancel the others, so every error becomes its result message
+        try:
+            async with self._query_semaphore:
+                return await run_knowledge_query(self.chat, query)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Unexpected error executing tool 'getKnowledge' with query %s: %s", query, e)
+            return f"❌ Tool `getKnowledge` execution failed for query {query}. Error: {str(e)}"
+
+    def add_file_update(self, file_path: str, content: str):
+        self.repo_update[file_path] = content
+        if self.repo is not None:
+            logger.info("Updating repository file: %s", file_path)
+            self.repo.update_files({file_path: content})
+
+    def apply_edits(self, edits: list[FileEdit]) -> str:
+        """Applies edits all or nothing and returns the result message for the model."""
+        if self.repo is None:
+            logger.warning("Repository is None but repo_edits are provided. Please provide a valid repository.")
+            return "❌ No repository to edit files in."
+        try:
+            self.repo.apply_edits(edits)
+        except EditConflictError as e:
+            logger.warning("Edits were not applied: %s", e)
+            return f"❌ None of the edits were applied. Fix these conflicts and send all edits again:\n{e}"
+        files = list(dict.fromkeys(edit.file_path for edit in edits))
+        self.edited_files.extend(file_path for file_path in files if file_path not in self.edited_files)
+        return f"Edited files: {', '.join(files)}"
+
+    async def send_updated_files(self):
+        filenames = "\n".join(dict.fromkeys([*self.repo_update.keys(), *self.edited_files]))
+        if filenames and self.repo is not None and self.chat:
+            await self.chat.set_message(f"🔧 `updating files`\n\n{filenames}")
+
+    async def finish(self, parsed_resp: ResponseToolCall, messages: list[dict[str, any]]):
+        """Runs the remaining tools of the validated response and appends all results to messages."""
+        for command in parsed_resp.commands:
+            self.add_command(command)
+        for query in not_yet_started(parsed_resp.get_knowledge, self.queries):
+            self.add_query(query)
+        for file_path, content in parsed_resp.repo_update.items():
+            self.add_file_update(file_path, content)
+
+        try:
+            if self._commands_done is not None:
+                await self._commands_done
+            query_results = [await result for result in self._query_results]
+        except Exception:
+            self.cancel()
+            raise
+        messages.extend(self._command_messages)
+        for message_content in query_results:
             messages.append(
                 Message(role=Roles.ASSISTANT, content=message_content).model_dump()
             )
-        if repo is None and parsed_resp.repo_update:
+        if parsed_resp.repo_edits:
+            messages.append(
+                Message(role=Roles.ASSISTANT, content=self.apply_edits(parsed_resp.repo_edits)).model_dump()
+            )
+
+        if self.repo is None and self.repo_update:
             logger.warning("Repository is None but repo_update is provided. Please provide a valid repository.")
-        elif repo is not None and parsed_resp.repo_update:
-            # Update the repository with the provided updates
-            logger.info("Updating repository with: %s", parsed_resp.repo_update)
-            if chat:
-                filenames = "\n".join(parsed_resp.repo_update.keys())
-                await chat.set_message(f"🔧 `updating files`\n\n{filenames}")
-            repo.update_files(parsed_resp.repo_update)
-        messages.append(
-            Message(role=Roles.USER, content=dedent("Given the provided Information by the assistant continue your work process")).model_dump()
+        await self.send_updated_files()
+
+    async def finish_tool_calls(self, message, messages: list[dict[str, any]]) -> ResponseToolCall:
+        """
+        Runs the native tool calls of message and appends the call and one result per tool call to
+        messages, an answer without tool calls is appended as it is. Returns the calls as
+        ResponseToolCall, done if finish was called without commands or if the model answered
+        without calling a tool.
+        """
+        tool_calls = message.tool_calls or []
+        parsed_resp = ResponseToolCall(done=not tool_calls, message="", repo_update={}, text_result=message.content or "", get_knowledge=[], commands=[])
+        results = []
+        for tool_call in tool_calls:
+            name = tool_call.function.name
+            arguments = parse_tool_arguments(tool_call)
+            result = None
+            if name == EXECUTE_SHELL:
+                parsed_resp.commands.append(str(arguments.get("command", "")))
+                result = self.add_command(parsed_resp.commands[-1])
+            elif name == GET_KNOWLEDGE:
+                parsed_resp.get_knowledge.append(str(arguments.get("query", "")))
+                result = self.add_query(parsed_resp.get_knowledge[-1])
+            elif name == UPDATE_FILES and isinstance(arguments.get("files"), dict):
+                files = {path: str(content) for path, content in arguments["files"].items()}
+                parsed_resp.repo_update.update(files)
+                for file_path, content in files.items():
+                    self.add_file_update(file_path, content)
+                result = f"Updated files: {', '.join(files)}" if self.repo is not None else "❌ No repository to update files in."
+            elif name == EDIT_FILES and isinstance(arguments.get("edits"), list):
+                try:
+                    edits = [FileEdit.model_validate(edit) for edit in arguments["edits"]]
+                except ValueError as e:
+                    result = f"❌ Invalid edits: {e}"
+                else:
+                    parsed_resp.repo_edits.extend(edits)
+                    result = self.apply_edits(edits)
+            elif name == FINISH:
+                parsed_resp.done = True
+                parsed_resp.message = str(arguments.get("message", ""))
+                parsed_resp.text_result = str(arguments.get("text_result", ""))
+                result = "Finished."
+            results.append(result if result is not None else f"❌ Invalid call of tool {name} with arguments {tool_call.function.arguments}")
+
+        try:
+            results = [await result if isinstance(result, asyncio.Future) else result for result in results]
+        except Exception:
+            self.cancel()
+            raise
+        if any(command.strip() for command in parsed_resp.commands):
+            parsed_resp.done = False
+        if tool_calls:
+            messages.append(tool_call_message(message))
+        else:
+            # The model has to see its answer when the Check asks for another try
+            messages.append(Message(role=Roles.ASSISTANT, content=message.content or "").model_dump())
+        for tool_call, result in zip(tool_calls, results):
+            messages.append(tool_result_message(tool_call.id, result))
+
+        await self.send_updated_files()
+        return parsed_resp
+
+    def cancel(self):
+        """Cancels all tools which are still running."""
+        for future in [self._commands_done, *self._query_results]:
+            if future is not None and not future.done():
+                future.cancel()
+
+
+def action_signature(parsed_resp: ResponseToolCall) -> str:
+    """Describes what the model did in one tool loop iteration, compared by RepetitionDetector."""
+    actions = [
+        *(f"shell: {command}" for command in parsed_resp.commands if command.strip()),
+        *(f"knowledge: {query}" for query in parsed_resp.get_knowledge if query.strip()),
+        *(f"update: {file_path}" for file_path in parsed_resp.repo_update),
+        *(f"edit: {edit.file_path} {edit.search}" for edit in parsed_resp.repo_edits),
+    ]
+    # A result which keeps failing the Check is a repetition too
+    if parsed_resp.done:
+        actions.append(f"result: {parsed_resp.text_result}")
+    return "\n".join(actions)
+
+
+def action_outcome(parsed_resp: ResponseToolCall, result_messages: list[dict[str, any]]) -> str:
+    """
+    Hashes the tool results of one tool loop iteration, compared by RepetitionDetector together with
+    the actions. The commands and queries echoed in the results are left out, only what they returned counts.
+    """
+    results = "\n".join(str(message.get("content") or "") for message in result_messages)
+    for echoed in [*parsed_resp.commands, *parsed_resp.get_knowledge]:
+        if echoed.strip():
+            results = results.replace(echoed, "")
+    return generate_hash(" ".join(results.split()))
+
+
+async def force_final_answer(messages: list[dict[str, any]], chat: Chat, model: str, reason: str,
+                             repo: Repo = None, task: Task = None, native: bool = False) -> ResponseToolCall:
+    """
+    Stops the tool loop and asks the model for its best answer with the information gathered so far,
+    without running further tools or the Check. Changes made to the repository so far are committed.
+    native is the tool call mode of the conversation (see llm_tool_call).
+    """
+    logger.warning("Stopping tool loop of chat %s: %s", chat.id, reason)
+    await chat.set_message(f"⚠️ Stopping work, {reason}. Answering with what was found so far ... \n\n")
+    messages.append(Message(role=Roles.USER, content=dedent(f"""
+        Stop working, {reason}. Don't run any more commands or queries and don't change files.
+        Give your best answer to the request with the information you have so far in message and text_result
+        and point out what is missing or uncertain.""")).model_dump())
+
+    call_model = fit_to_context(messages, model)
+    if native:
+        response_message = await llm_call_wrapper(model=call_model,
+            call_site="llm_tool_call",
+            messages=messages,
+            tools=TOOLS,
+            tool_choice={"type": "function", "function": {"name": FINISH}},
         )
-        # Check if the task is done
-        if parsed_resp.done:
-            await chat.set_message(f"{parsed_resp.message} \n\n")
-            await chat.set_message(f"{parsed_resp.text_result} \n\n")
+        finish_calls = [tool_call for tool_call in response_message.tool_calls or [] if tool_call.function.name == FINISH]
+        arguments = parse_tool_arguments(finish_calls[0]) if finish_calls else {}
+        parsed_resp = ResponseToolCall(done=True, message=str(arguments.get("message", "")),
+            text_result=str(arguments.get("text_result", response_message.content or "")),
+            repo_update={}, get_knowledge=[], commands=[])
+    else:
+        parsed_resp = await llm_call_wrapper(model=call_model,
+            call_site="llm_tool_call",
+            response_format=ResponseToolCall,
+            messages=messages,
+        )
+        parsed_resp = parsed_resp.model_copy(update={"done": True, "commands": [], "get_knowledge": [], "repo_update": {}, "repo_edits": []})
 
+    await chat.set_message(f"{parsed_resp.message} \n\n")
+    await chat.set_message(f"{parsed_resp.text_result} \n\n")
+    if task is not None and task.result_type == ResultType.REPO and repo is not None:
+        repo.add_and_commit(f"Partial work on {task.unique_name}, stopped: {reason}")
+    return parsed_resp
 
-            if task is None:
-                return parsed_resp
 
-            # Define the mapping for result_type-specific content
-            result_type_mapping = {
-                ResultType.REPO: f"""Check following git diff if it solves the task. if diff is empty it probably is not solving the task. Diff:{repo.get_diff()}
+def deadline_reason() -> str:
+    """Returns why the tool loop has to answer now because of the request deadline, None if there is time left."""
+    left = remaining()
+    if left is not None and left <= settings.DEADLINE_ANSWER_RESERVE:
+        return "the request is running out of time"
+    return None
 
-                if it solves the task provide a commit_message for the changes.
-                
-                current Repo is: 
-                {repo.load_files()}""",
-                ResultType.TEXT: f"""Check the work result text if it answers/solves the request/task.
-                Message:  {parsed_resp.message}
+
+async def llm_tool_call(
+    messages: list[dict[str, any]],
+    chat: Chat,
+    request: str ="",
+    model: str = None,
+    callables: dict = None,
+    repo: Repo = None,
+    task: Task = None
+):
+    """
+    Runs the agent tool loop until the model is done and, for a task, its result passes the Check.
+    The loop is limited by a task budget drawing from the chat budget and stops early if the model
+    repeats near-identical actions with unchanged results; in both cases a best-effort answer is
+    forced (see force_final_answer).
+    The tool call mode is decided once for model (see use_native_tools) and kept for the whole
+    conversation, even if it switches to the large context model. In native mode the prompts, written
+    for the ResponseToolCall JSON, are followed by a note mapping its fields to the tools.
+    """
+    if not model:
+        model = get_models("llm_tool_call", ResponseToolCall)[0]
+    native = use_native_tools(model)
+    if native:
+        messages.append(native_tools_prompt())
+
+    logger.info("LLM Call with messages: %s", messages)
+    budget = Budget.for_task(parent=chat.budget)
+    repetitions = RepetitionDetector(settings.LOOP_DETECTION_WINDOW, settings.LOOP_SIMILARITY, settings.LOOP_MAX_REPEATS)
+    usage_token = track_usage(*budget.counters())
+    try:
+        while True:
+            stop_reason = budget.exceeded() or deadline_reason()
+            if stop_reason:
+                return await force_final_answer(messages, chat, model, stop_reason, repo=repo, task=task, native=native)
+            update_messages(messages, callables)
+            call_model = fit_to_context(messages, model)
+            execution = ToolCallExecution(chat=chat, repo=repo)
+            results_start = len(messages)
+            if native:
+                response_message = await llm_call_wrapper(model=call_model,
+                    call_site="llm_tool_call",
+                    messages=messages,
+                    tools=TOOLS,
+                )
+                parsed_resp = await execution.finish_tool_calls(response_message, messages)
+            else:
+                try:
+                    parsed_resp = await llm_call_wrapper(model=call_model,
+                        call_site="llm_tool_call",
+                        response_format=ResponseToolCall,
+                        messages=messages,
+                        on_stream_event=execution.on_stream_event if settings.STREAM_TOOL_CALLS else None
+                    )
+                except Exception:
+                    execution.cancel()
+                    raise
+
+                commands = [command for command in parsed_resp.commands if command.strip() != ""]
+                parsed_resp.done= False if commands else parsed_resp.done
+                await execution.finish(parsed_resp, messages)
+
+            budget.charge(iterations=1, commands=len(execution.commands))
+            if repetitions.add(action_signature(parsed_resp), action_outcome(parsed_resp, messages[results_start:])):
+                return await force_final_answer(messages, chat, model, "the same actions were repeated without progress", repo=repo, task=task, native=native)
+            messages.append(
+                Message(role=Roles.USER, content=dedent("Given the provided Information by the assistant continue your work process")).model_dump()
+            )
+            # Check if the task is done
+            if parsed_resp.done:
+                await chat.set_message(f"{parsed_resp.message} \n\n")
+                await chat.set_message(f"{parsed_resp.text_result} \n\n")
+
+
+                if task is None:
+                    return parsed_resp
+
+                # Define the mapping for result_type-specific content
+                result_type_mapping = {
+                    ResultType.TEXT: f"""Check the work result text if it answers/solves the request/task.
+                    Message:  {parsed_resp.message}
                 
-                Result:  {parsed_resp.text_result}""",
-            }
+                    Result:  {parsed_resp.text_result}""",
+                }
+                if task.result_type == ResultType.REPO and repo is not None:
+                    # Only the changes, the touched files and a manifest, not the whole repository
+                    review_context = repo.get_review_context(settings.CHECK_CONTEXT_MAX_CHARS, settings.CHECK_DIFF_CONTEXT_LINES)
+                    result_type_mapping[ResultType.REPO] = f"""Check following git diff if it solves the task. if diff is empty it probably is not solving the task.
 
+                    if it solves the task provide a commit_message for the changes.
 
-            message_check = [Message(role=Roles.USER, content=f"""Given Following message and work result:
-                            result_type = {task.result_type}
+                    {review_context}"""
 
-                            {result_type_mapping.get(task.result_type, "")}
-                            
-                            Please check if it's correctly solving or answering the original request. Just return correct == True or correct == False. If False, give a short feedback why it is not correct.
 
-                            Origianal request: {request}
-            
-                            """).model_dump()]
+                message_check = [Message(role=Roles.USER, content=f"""Given Following message and work result:
+                                result_type = {task.result_type}
 
-            #double check
-            logger.info("Double checking the response with messages: %s", message_check)
+                                {result_type_mapping.get(task.result_type, "")}
+                            
+                                Please check if it's correctly solving or answering the original request. Just return correct == True or correct == False. If False, give a short feedback why it is not correct.
 
-            check_response = await llm_call_wrapper(
-                model=model,
-                response_format=Check,
-                messages=message_check,
-            )
-            if check_response.correct:
-                repo.add_and_commit(check_response.commit_message)
-                return parsed_resp
-            messages.append(
-                Message(role=Roles.USER, content=dedent(f"""
-                    Your result does not seem to answer or solve my original question. 
-                    Feedback {check_response.feedback} Please check again using your available tools""")).model_dump())
+                                Origianal request: {request}
+            
+                                """).model_dump()]
+
+                #double check
+                logger.info("Double checking the response with messages: %s", message_check)
+
+                check_response = await llm_call_wrapper(
+                    call_site="check_result",
+                    response_format=Check,
+                    messages=message_check,
+                )
+                if check_response.correct:
+                    if repo is not None:
+                        repo.add_and_commit(check_response.commit_message)
+                    return parsed_resp
+                messages.append(
+                    Message(role=Roles.USER, content=dedent(f"""
+                        Your result does not seem to answer or solve my original question. 
+                        Feedback {check_response.feedback} Please check again using your available tools""")).model_dump())
+    finally:
+        token_usage.reset(usage_token)
@@ -0,0 +1,184 @@
+import asyncio
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+import litellm
+from pydantic import BaseModel
+
+from app.config import logger, settings
+from app.services.deadline import cap_timeout
+
+# Errors after which the next model of a route is tried
+FALLBACK_ERRORS = (
+    litellm.exceptions.APIConnectionError,
+    litellm.exceptions.ServiceUnavailableError,
+    litellm.exceptions.InternalServerError,
+    litellm.exceptions.NotFoundError,
+    litellm.exceptions.Timeout,
+)
+
+
+def resolve_model(name: str) -> str:
+    """Resolves the aliases "default", "small" and "large" to the configured models."""
+    aliases = {
+        "default": settings.LLM_MODEL,
+        "small": settings.LLM_SMALL_MODEL or settings.LLM_MODEL,
+        "large": settings.LLM_LARGE_CONTEXT_MODEL or settings.LLM_MODEL,
+    }
+    return aliases.get(name, name)
+
+
+def get_models(call_site: str = None, response_format: type[BaseModel] = None, preferred: str = None) -> list[str]:
+    """
+    Returns the models to try for a call, in order.
+
+    An explicitly preferred model comes first. The route is looked up in settings.LLM_ROUTES by
+    call site first and by the response_format class name second. settings.LLM_MODEL is always
+    the last fallback.
+    """
+    keys = [call_site, response_format.__name__ if response_format else None]
+    route = next((settings.LLM_ROUTES[key] for key in keys if key and key in settings.LLM_ROUTES), [])
+    models = []
+    for name in [preferred, *route, "default"]:
+        model = resolve_model(name) if name else None
+        if model and model not in models:
+            models.append(model)
+    return models
+
+
+class LatencyTracker:
+    """Keeps the latencies of the latest successful calls per model."""
+
+    def __init__(self, window: int, min_samples: int):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: dict[str, deque] = {}
+
+    def record(self, model: str, seconds: float):
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model: str, q: float) -> float:
+        """Returns the q-th percentile (0..1) of recent latencies, None until min_samples calls were seen."""
+        samples = sorted(self._samples.get(model, []))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+# Token usage counters of the LLM calls made in the current context, e.g. of a speculative
+# pipeline stage and the budgets of the running task and chat
+token_usage: ContextVar[tuple[Counter, ...]] = ContextVar("token_usage", default=())
+
+
+def track_usage(*counters: Counter):
+    """Adds counters to the ones the usage of the current context is recorded in, returns the reset token."""
+    return token_usage.set((*token_usage.get(), *counters))
+
+
+def record_usage(usage):
+    """Adds the usage of a completion to the token_usage counters of the current context, if any."""
+    if usage is None:
+        return
+    for counter in token_usage.get():
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            counter[key] += getattr(usage, key, None) or 0
+
+
+latencies = LatencyTracker(window=settings.LLM_LATENCY_WINDOW, min_samples=settings.LLM_HEDGE_MIN_SAMPLES)
+hedge_counters: Counter = Counter()
+
+
+async def timed_acompletion(model: str, **kwargs):
+    """
+    Calls litellm.acompletion and records the latency and usage of successful calls. Streamed calls
+    return with the first chunk, their latency would pull the hedging percentile down and isn't
+    recorded. Their usage is requested with the final chunk and recorded by the consumer of the
+    stream (see llm_wrapper.stream_deltas).
+    """
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    start = time.monotonic()
+    response = await litellm.acompletion(model=model, **kwargs)
+    if not kwargs.get("stream"):
+        latencies.record(model, time.monotonic() - start)
+        record_usage(getattr(response, "usage", None))
+    return response
+
+
+async def hedged_acompletion(models: list[str], **kwargs):
+    """
+    Calls the first model and, if it is slower than settings.LLM_HEDGE_PERCENTILE of its recent
+    latencies, sends the same request to the second model. The first successful response wins,
+    the other request is cancelled. Streamed calls are never hedged.
+    """
+    primary = models[0]
+    delay = None
+    if settings.LLM_HEDGE_ENABLED and len(models) > 1 and not kwargs.get("stream"):
+        delay = latencies.percentile(primary, settings.LLM_HEDGE_PERCENTILE)
+    if delay is None:
+        return await timed_acompletion(primary, **kwargs)
+
+    first = asyncio.ensure_future(timed_acompletion(primary, **kwargs))
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done:
+            return first.result()
+
+        hedge_model = models[1]
+        logger.info("%s didn't answer within %.1fs, hedging with %s", primary, delay, hedge_model)
+        hedge_counters[f"{primary}:hedged"] += 1
+        hedge = asyncio.ensure_future(timed_acompletion(hedge_model, **kwargs))
+        pending.add(hedge)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    hedge_counters[f"{primary}:{'primary' if future is first else 'hedge'}_wins"] += 1
+                    return future.result()
+                logger.warning("Hedged call failed: %s", future.exception())
+        raise first.exception()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def get_hedge_stats() -> dict[str, dict[str, float]]:
+    """Returns per model how often calls were hedged and which request won."""
+    stats = {}
+    for key, count in hedge_counters.items():
+        model, event = key.rsplit(":", 1)
+        stats.setdefault(model, {})[event] = count
+    for model, entry in stats.items():
+        entry["hedge_win_rate"] = entry.get("hedge_wins", 0) / entry["hedged"] if entry.get("hedged") else 0.0
+    return stats
+
+
+async def acompletion_with_fallbacks(models: list[str], **kwargs):
+    """Calls litellm.acompletion with the first model that is reachable, hedging slow calls."""
+    timeout = kwargs.pop("timeout", settings.LLM_REQUEST_TIMEOUT)
+    for i, model in enumerate(models):
+        try:
+            # Every fallback gets at most the time left for the request
+            return await hedged_acompletion(models[i:], timeout=cap_timeout(timeout, "LLM call"), **kwargs)
+        except FALLBACK_ERRORS as e:
+            if i == len(models) - 1:
+                raise
+            logger.warning("Model %s failed, falling back to %s: %s", model, models[i + 1], e)
+    raise ValueError("No model to call")
+
+
+def completion_with_fallbacks(models: list[str], **kwargs):
+    """Calls litellm.completion with the first model that is reachable."""
+    timeout = kwargs.pop("timeout", settings.LLM_REQUEST_TIMEOUT)
+    for i, model in enumerate(models):
+        try:
+            response = litellm.completion(model=model, timeout=cap_timeout(timeout, "LLM call"), **kwargs)
+            record_usage(getattr(response, "usage", None))
+            return response
+        except FALLBACK_ERRORS as e:
+            if i == len(models) - 1:
+                raise
+            logger.warning("Model %s failed, falling back to %s: %s", model, models[i + 1], e)
+    raise ValueError("No model to call")
@@ -0,0 +1,153 @@
+import litellm
+
+from app.config import logger, settings
+from app.models.models import Roles
+from app.services.json_repair import loads_tolerant
+
+EXECUTE_SHELL = "execute_shell"
+GET_KNOWLEDGE = "get_knowledge"
+UPDATE_FILES = "update_files"
+EDIT_FILES = "edit_files"
+FINISH = "finish"
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": EXECUTE_SHELL,
+            "description": "Executes a shell command in the user's environment and returns its status code and output.",
+            "parameters": {
+                "type": "object",
+                "properties": {"command": {"type": "string", "description": "Command to execute."}},
+                "required": ["command"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": GET_KNOWLEDGE,
+            "description": "Works like a search engine and returns summarized information for a query.",
+            "parameters": {
+                "type": "object",
+                "properties": {"query": {"type": "string", "description": "Query to retrieve knowledge for."}},
+                "required": ["query"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": UPDATE_FILES,
+            "description": "Writes files of the repository, replacing their whole content.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "files": {
+                        "type": "object",
+                        "description": "Files updates format {filePath: content}.",
+                        "additionalProperties": {"type": "string"},
+                    },
+                },
+                "required": ["files"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": EDIT_FILES,
+            "description": "Changes files of the repository with search/replace edits, prefer it over update_files for existing files. "
+                           "Either all edits are applied or none, conflicts are reported back.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "edits": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "file_path": {"type": "string", "description": "Path of the file to edit."},
+                                "search": {"type": "string", "description": "Exact text to replace, must occur once in the file. Empty to create a new file."},
+                                "replace": {"type": "string", "description": "Text to put in place of search."},
+                            },
+                            "required": ["file_path", "search", "replace"],
+                        },
+                    },
+                },
+                "required": ["edits"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": FINISH,
+            "description": "Call when the task is done (done=true) with the message to the user and the work result.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "message": {"type": "string", "description": "Message to the user."},
+                    "text_result": {"type": "string", "description": "Text result of the task."},
+                },
+                "required": ["message", "text_result"],
+            },
+        },
+    },
+]
+
+
+def use_native_tools(model: str) -> bool:
+    """Returns True if llm_tool_call should declare its tools as native function calls for model."""
+    if settings.TOOL_CALL_MODE == "native":
+        return True
+    if settings.TOOL_CALL_MODE != "auto":
+        return False
+    try:
+        return litellm.supports_function_calling(model=model)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        logger.debug("Can't tell if %s supports function calling: %s", model, e)
+        return False
+
+
+def native_tools_prompt() -> dict[str, any]:
+    """
+    Returns the message which maps the response fields the task prompts name to the native tools,
+    the prompts are written for the ResponseToolCall JSON.
+    """
+    return {"role": Roles.USER.value, "content": (
+        "Instead of answering with JSON fields, call the tools you are given: "
+        f"`commands`/`command` ➜ `{EXECUTE_SHELL}` (one call per command), `get_knowledge` ➜ `{GET_KNOWLEDGE}`, "
+        f"`repo_update`/`update_repo`/`updateFile` ➜ `{UPDATE_FILES}`, `repo_edits` ➜ `{EDIT_FILES}`. "
+        f"Instead of setting done=true, call `{FINISH}` with the `message` and the `text_result`."
+    )}
+
+
+def parse_tool_arguments(tool_call) -> dict:
+    """Returns the arguments of a tool call, an empty dict if they are not a JSON object."""
+    try:
+        arguments = loads_tolerant(tool_call.function.arguments or "{}")
+    except ValueError as e:
+        logger.error("Invalid arguments for tool %s: %s", tool_call.function.name, e)
+        return {}
+    return arguments if isinstance(arguments, dict) else {}
+
+
+def tool_call_message(message) -> dict[str, any]:
+    """Converts the assistant message of a completion with tool calls into a conversation message."""
+    return {
+        "role": Roles.ASSISTANT.value,
+        "content": message.content or "",
+        "tool_calls": [
+            {
+                "id": tool_call.id,
+                "type": "function",
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments or "{}"},
+            }
+            for tool_call in message.tool_calls or []
+        ],
+    }
+
+
+def tool_result_message(tool_call_id: str, content: str) -> dict[str, any]:
+    return {"role": Roles.TOOL.value, "tool_call_id": tool_call_id, "content": content}
@@ -0,0 +1,106 @@
+import math
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from app.config import embedder, logger, plan_cache_collection, settings
+from app.models.models import Agent, Tasks
+
+
+class CachedPlan(BaseModel):
+    """A reviewed plan of a past medium request with the embedding of its project description."""
+    kind: str = "plan"
+    plan_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = Field(default="", description="The user who made the request, plans are only reused for them.")
+    description: str
+    vector: list[float]
+    agent: Agent
+    tasks: Tasks
+    timestamp: float = Field(default_factory=time.time)
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class PlanCache:
+    """
+    Caches the Agent and reviewed Tasks of past medium requests by the embedding of their project
+    description. Plans are persisted in the object store and compared in memory, keeping the
+    newest max_entries. A plan carries the task context and repository of its request, so it is
+    only reused for the same user.
+    The methods are called from worker threads (asyncio.to_thread), the shared state is locked.
+    """
+
+    def __init__(self, collection, max_entries: int):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.counters: Counter = Counter()
+        self._plans: list[CachedPlan] = None
+        self._vectors: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self) -> list[CachedPlan]:
+        if self._plans is None:
+            plans = []
+            for doc in self.collection.find({"kind": "plan"}):
+                try:
+                    plans.append(CachedPlan.model_validate(doc))
+                except ValueError as e:
+                    logger.warning("Ignoring invalid cached plan: %s", e)
+            self._plans = sorted(plans, key=lambda plan: plan.timestamp)[-self.max_entries:]
+        return self._plans
+
+    def embed(self, text: str) -> list[float]:
+        """Embeds text, remembering the latest embeddings so a lookup and the following add embed once."""
+        with self._lock:
+            vector = self._vectors.get(text)
+        if vector is None:
+            vector = embedder.embed_text(text)
+            with self._lock:
+                self._vectors[text] = vector
+                while len(self._vectors) > 16:
+                    self._vectors.popitem(last=False)
+        return vector
+
+    def find_similar(self, user_id: str, description: str, threshold: float) -> Optional[tuple[CachedPlan, float]]:
+        """Returns the most similar cached plan of user_id and its similarity if it reaches threshold, otherwise None."""
+        with self._lock:
+            plans = [plan for plan in self._load() if plan.user_id == user_id]
+        if not plans:
+            self._count("miss")
+            return None
+        vector = self.embed(description)
+        best = max(plans, key=lambda plan: cosine_similarity(vector, plan.vector))
+        similarity = cosine_similarity(vector, best.vector)
+        if similarity < threshold:
+            logger.info("Most similar cached plan has similarity %.3f, below %.3f", similarity, threshold)
+            self._count("miss")
+            return None
+        self._count("hit")
+        return best, similarity
+
+    def add(self, user_id: str, description: str, agent: Agent, tasks: Tasks):
+        plan = CachedPlan(user_id=user_id, description=description, vector=self.embed(description), agent=agent, tasks=tasks)
+        with self._lock:
+            plans = self._load()
+            plans.append(plan)
+            self.collection.insert(plan.model_dump(mode="json"))
+            while len(plans) > self.max_entries:
+                oldest = plans.pop(0)
+                doc = self.collection.find_one({"plan_id": oldest.plan_id})
+                if doc is not None:
+                    self.collection.delete(doc)
+
+    def _count(self, event: str):
+        with self._lock:
+            self.counters[event] += 1
+
+
+plan_cache = PlanCache(collection=plan_cache_collection, max_entries=settings.PLAN_CACHE_MAX_ENTRIES)
@@ -0,0 +1,131 @@
+import json
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from enum import Enum
+
+import litellm
+from pydantic import ValidationError
+
+from app.config import logger, settings
+from app.services.deadline import DeadlineExceeded
+
+
+class ErrorKind(str, Enum):
+    """Classifies why an LLM call failed and therefore how it is retried."""
+    RATE_LIMIT = "rate_limit"
+    OVERLOAD = "overload"
+    CONTEXT_OVERFLOW = "context_overflow"
+    VALIDATION = "validation"
+    FATAL = "fatal"
+
+
+class InvalidResponseError(ValueError):
+    """Raised when an LLM response doesn't have the expected structure, e.g. no message content."""
+
+
+def classify_error(error: Exception) -> ErrorKind:
+    """Maps an exception of an LLM call to an ErrorKind."""
+    if isinstance(error, DeadlineExceeded):
+        # No time is left for a retry
+        return ErrorKind.FATAL
+    if isinstance(error, litellm.exceptions.ContextWindowExceededError):
+        return ErrorKind.CONTEXT_OVERFLOW
+    if isinstance(error, litellm.exceptions.RateLimitError):
+        return ErrorKind.RATE_LIMIT
+    if isinstance(error, (
+        litellm.exceptions.ServiceUnavailableError,
+        litellm.exceptions.InternalServerError,
+        litellm.exceptions.APIConnectionError,
+        litellm.exceptions.Timeout,
+    )):
+        return ErrorKind.OVERLOAD
+    if isinstance(error, (json.JSONDecodeError, ValidationError, InvalidResponseError)):
+        return ErrorKind.VALIDATION
+    # Bad requests, authentication errors, failing stream handlers etc. fail the same way on every retry
+    return ErrorKind.FATAL
+
+
+def get_retry_after(error: Exception) -> float:
+    """Returns the seconds a provider asked to wait via Retry-After(-ms), None if not given."""
+    headers = getattr(error, "litellm_response_headers", None)
+    response = getattr(error, "response", None)
+    if not headers and response is not None:
+        headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    headers = {str(key).lower(): value for key, value in dict(headers).items()}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError) as e:
+        logger.debug("Ignoring unparsable Retry-After header %s: %s", headers, e)
+    return None
+
+
+class RetryBudget:
+    """
+    Limits the retries per model within a sliding window. The budget is shared by all chats,
+    so a degraded provider gets a bounded number of retries instead of one storm per request.
+    """
+
+    def __init__(self, max_retries: int, window: float):
+        self.max_retries = max_retries
+        self.window = window
+        self._retries: dict[str, deque] = {}
+
+    def try_acquire(self, model: str) -> bool:
+        """Records a retry for model, returns False if the budget of model is used up."""
+        now = time.monotonic()
+        retries = self._retries.setdefault(model, deque())
+        while retries and now - retries[0] > self.window:
+            retries.popleft()
+        if len(retries) >= self.max_retries:
+            return False
+        retries.append(now)
+        return True
+
+
+retry_budget = RetryBudget(max_retries=settings.LLM_RETRY_BUDGET, window=settings.LLM_RETRY_BUDGET_WINDOW)
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed LLM call is retried.
+
+    Rate limits and overload are retried with exponential backoff and full jitter, honoring
+    Retry-After, so retries of concurrent chats don't synchronize. Context overflow and invalid
+    output are retried right away since the caller changes the request. Other errors are not retried.
+    Every retry draws from the shared per model RetryBudget.
+    """
+
+    def __init__(self, max_retries: int = None, base_delay: float = None, max_delay: float = None, budget: RetryBudget = None):
+        self.max_retries = settings.LLM_MAX_RETRIES if max_retries is None else max_retries
+        self.base_delay = settings.LLM_RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = settings.LLM_RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.budget = budget or retry_budget
+
+    def should_retry(self, kind: ErrorKind, attempt: int, model: str) -> bool:
+        """Returns True if the call failing with kind after attempt retries may be retried."""
+        if kind == ErrorKind.FATAL or attempt >= self.max_retries:
+            return False
+        if not self.budget.try_acquire(model):
+            logger.warning("Retry budget of model %s is used up, not retrying", model)
+            return False
+        return True
+
+    def delay(self, kind: ErrorKind, attempt: int, error: Exception = None) -> float:
+        """Returns the seconds to wait before retry number attempt + 1."""
+        if kind not in (ErrorKind.RATE_LIMIT, ErrorKind.OVERLOAD):
+            return 0.0
+        retry_after = get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
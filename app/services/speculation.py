@@ -0,0 +1,49 @@
+import asyncio
+from collections import Counter
+from typing import Awaitable, Callable
+
+from app.config import logger
+from app.models.models import Chat
+from app.services.model_router import track_usage
+
+# started, kept, discarded and the token usage of kept and wasted speculative work
+speculation_counters: Counter = Counter()
+
+
+class Speculation:
+    """
+    Runs work on a speculative copy of chat while the caller still decides whether it's needed.
+
+    The output of the copy is held back. commit relays it into chat and returns the result of work,
+    discard cancels work and records the tokens it used so far as wasted.
+    """
+
+    def __init__(self, chat: Chat, work: Callable[[Chat], Awaitable[any]]):
+        self.chat = chat
+        self.shadow = chat.speculative_copy()
+        self.usage: Counter = Counter()
+        self._task = asyncio.ensure_future(self._run(work))
+        speculation_counters["started"] += 1
+
+    async def _run(self, work: Callable[[Chat], Awaitable[any]]):
+        # The task runs in a copy of the context, so only the calls of work are counted here
+        track_usage(self.usage)
+        return await work(self.shadow)
+
+    async def commit(self):
+        """Waits for work while relaying its output into the chat and returns its result."""
+        await self.chat.relay(self.shadow, self._task)
+        result = await self._task
+        speculation_counters["kept"] += 1
+        speculation_counters["kept_tokens"] += self.usage["total_tokens"]
+        return result
+
+    def discard(self):
+        """Cancels work, its output is dropped."""
+        self._task.cancel()
+        # A failure of discarded work doesn't matter, retrieve it to keep it out of the logs
+        self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        speculation_counters["discarded"] += 1
+        speculation_counters["wasted_tokens"] += self.usage["total_tokens"]
+        logger.info("Discarded speculative work for chat %s, wasted %d tokens, counters %s",
+                    self.chat.id, self.usage["total_tokens"], dict(speculation_counters))
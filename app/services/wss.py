@@ -7,11 +7,14 @@ from fastapi.responses import JSONResponse
 from app.models.models import Chat
 from app.services.auth import check_executioner, check_executioner_uuid_for_user, get_uuid
 
-from app.config import logger
+from app.config import logger, settings
+from app.services.deadline import cap_timeout
 from app.services.auth import fake_executioner_clientId
 
 # A structure to store user -> websocket mapping
 connected_receivers: dict[str, WebSocket] = {}
+# Serializes the command/response exchanges on a receiver's websocket
+receiver_locks: dict[str, asyncio.Lock] = {}
 
 
 async def add_connection(websocket: WebSocket, token: str = Query(...)):
@@ -50,25 +53,56 @@ async def execute_shell(chat: Chat, command: str):
             logger.warning("No valid WebSocket found for uuid %s", chat.user.id)
             return json.dumps({"status_code":404, "content":{"error": "No receiver found for the provided token. No Command execution possible. Do not try again"}})
 
-        await ws.send_text("COMMAND")
-        cmd = command
-        if cmd:
-            logger.info("sending command %s", cmd)
-            await ws.send_text(f"{cmd}")
-
-            try:
-                response = await ws.receive_text()
-                logger.info("Client response: %s", response)
-                return response
-            except (WebSocketDisconnect, RuntimeError) as recv_error:
-                logger.error("Error receiving response from client: %s", recv_error)
-                return json.dumps({"status_code":500, "content":{"error": "No acknowledgment from client"}})
-        else:
-            pass  # Add appropriate handling here if needed
+        if command:
+            # Concurrent tasks share the websocket, and a cancelled caller must not leave an unread
+            # response behind for the next command, so the exchange is locked and shielded.
+            # The exchange itself is bounded by settings.SHELL_EXCHANGE_TIMEOUT, see exchange_command
+            lock = receiver_locks.setdefault(chat.user.id, asyncio.Lock())
+            timeout = cap_timeout(settings.SHELL_COMMAND_TIMEOUT, "shell command")
+            return await asyncio.wait_for(asyncio.shield(exchange_command(ws, lock, command)), timeout)
+    except TimeoutError as e:
+        # Also DeadlineExceeded. The shielded exchange still reads the late response, so the next command gets its own
+        logger.error("Shell command %s timed out: %s", command, e)
+        return json.dumps({"status_code":504, "content":{"error": f"Command did not finish in time. {e}".strip()}})
     except (OSError, ValueError) as e:
         logger.error("Error executing shell command: %s", e)
         return f"Error executing command: {e}"
 
+async def exchange_command(ws: WebSocket, lock: asyncio.Lock, command: str) -> str:
+    """
+    Sends a command to the receiver and waits up to settings.SHELL_EXCHANGE_TIMEOUT for its response.
+    A receiver which doesn't answer in time is disconnected, so it can't hold the lock of its user
+    forever and its late response can't be taken for the response of the next command.
+    """
+    async with lock:
+        await ws.send_text("COMMAND")
+        logger.info("sending command %s", command)
+        await ws.send_text(f"{command}")
+
+        try:
+            response = await asyncio.wait_for(ws.receive_text(), settings.SHELL_EXCHANGE_TIMEOUT)
+            logger.info("Client response: %s", response)
+            return response
+        except TimeoutError:
+            logger.error("Receiver didn't answer command %s within %ss, disconnecting it", command, settings.SHELL_EXCHANGE_TIMEOUT)
+            await disconnect_receiver(ws)
+            return json.dumps({"status_code":504, "content":{"error": "The receiver did not answer and was disconnected"}})
+        except (WebSocketDisconnect, RuntimeError) as recv_error:
+            logger.error("Error receiving response from client: %s", recv_error)
+            return json.dumps({"status_code":500, "content":{"error": "No acknowledgment from client"}})
+
+
+async def disconnect_receiver(ws: WebSocket):
+    """Removes ws from the connected receivers and closes it."""
+    for uuid, receiver in list(connected_receivers.items()):
+        if receiver is ws:
+            del connected_receivers[uuid]
+    try:
+        await ws.close(code=1011)
+    except (RuntimeError, OSError) as e:
+        logger.warning("Closing the receiver websocket failed: %s", e)
+
+
 async def send_execution_file(request_raw):
     """
     Sends an executable file to the receiver with parameters.
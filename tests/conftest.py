@@ -0,0 +1,29 @@
+import pytest
+
+from app.models.models import Chat, ResultType, Task, Tasks, User
+
+
+@pytest.fixture
+def make_task():
+    """Returns a factory for plan tasks, depends_on lists the unique_ids the task depends on."""
+    def make(unique_id, depends_on=None, result_type=ResultType.TEXT, name=None):
+        return Task(
+            unique_id=unique_id,
+            unique_name=name or unique_id,
+            description=f"task {name or unique_id}",
+            context="",
+            dependsOn=depends_on or [],
+            result_type=result_type,
+        )
+    return make
+
+
+@pytest.fixture
+def make_chat():
+    """Returns a factory for chats of a test user, planned with tasks if given."""
+    def make(chat_id="chat", tasks=None):
+        chat = Chat(id=chat_id, user=User(id="user", username="user"), original_request="request")
+        if tasks is not None:
+            chat.tasks = Tasks(repo_url="", repo_name="", tasks=tasks)
+        return chat
+    return make
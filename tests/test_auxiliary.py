@@ -0,0 +1,51 @@
+from unittest.mock import AsyncMock, patch
+import pytest
+
+from app.models.models import Message, Roles
+from app.services.auxiliary import answer_auxiliary, auxiliary_counters, detect_auxiliary
+
+
+TITLE_PROMPT = """### Task:
+Generate a concise, 3-5 word title with an emoji summarizing the chat history.
+### Output:
+JSON format: { "title": "your concise title here" }
+### Chat History:
+<chat_history>
+USER: How do I deploy a FastAPI app?
+</chat_history>"""
+
+FOLLOW_UP_PROMPT = """### Task:
+Suggest 3-5 relevant follow-up questions or prompts that the user might naturally ask next in this conversation.
+### Chat History:
+<chat_history>
+USER: How do I deploy a FastAPI app?
+</chat_history>"""
+
+
+def user_message(content):
+    return Message(role=Roles.USER, content=content)
+
+
+def test_detects_auxiliary_prompts():
+    assert detect_auxiliary([user_message(TITLE_PROMPT)]) == "title"
+    assert detect_auxiliary([user_message(FOLLOW_UP_PROMPT)]) == "follow_ups"
+    assert detect_auxiliary([user_message("### Task:\nSomething new\n<chat_history>\n</chat_history>")]) == "other"
+
+
+def test_regular_requests_are_not_auxiliary():
+    assert detect_auxiliary([user_message("Generate a title for my blog post about FastAPI")]) is None
+    assert detect_auxiliary([user_message("Hi"), Message(role=Roles.ASSISTANT, content="Hello"),
+                             user_message(TITLE_PROMPT)]) is None
+
+
+@pytest.mark.asyncio
+async def test_answers_with_single_small_model_call():
+    wrapper = AsyncMock(return_value='{"title": "🚀 Deploying FastAPI"}')
+    before = auxiliary_counters["title"]
+    with patch("app.services.auxiliary.llm_call_wrapper", wrapper):
+        answer = await answer_auxiliary("title", [user_message(TITLE_PROMPT)])
+
+    assert answer == '{"title": "🚀 Deploying FastAPI"}'
+    wrapper.assert_awaited_once()
+    assert wrapper.await_args.kwargs["call_site"] == "auxiliary"
+    assert auxiliary_counters["title"] - before == 1
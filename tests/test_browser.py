@@ -0,0 +1,195 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+import pytest
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+from app.config import settings
+from app.services.browser import BrowserPool, NetworkIdle
+
+
+class FakePage:
+    def __init__(self, browser):
+        self.browser = browser
+        self.listeners = {}
+
+    def on(self, event, listener):
+        self.listeners[event] = listener
+
+    async def goto(self, url, timeout, wait_until):
+        self.browser.active += 1
+        self.browser.max_active = max(self.browser.max_active, self.browser.active)
+        await asyncio.sleep(0.01)
+        self.browser.active -= 1
+        self.url = url
+
+    async def wait_for_load_state(self, state, timeout):
+        pass
+
+    async def content(self):
+        return f"<html>{self.url}</html>"
+
+
+class FakeContext:
+    def __init__(self, browser):
+        self.browser = browser
+        self.closed = False
+
+    async def add_init_script(self, script):
+        pass
+
+    async def route(self, pattern, handler):
+        self.handler = handler
+
+    async def new_page(self):
+        return FakePage(self.browser)
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.connected = True
+        self.closed = False
+        self.contexts = []
+
+    async def new_context(self, **kwargs):
+        self.contexts.append(FakeContext(self))
+        return self.contexts[-1]
+
+    def is_connected(self):
+        return self.connected
+
+    async def close(self):
+        self.closed = True
+
+
+class FakePlaywright:
+    def __init__(self):
+        self.browsers = []
+        self.chromium = self
+
+    async def launch(self, **kwargs):
+        self.browsers.append(FakeBrowser())
+        return self.browsers[-1]
+
+    async def start(self):
+        return self
+
+    async def stop(self):
+        pass
+
+
+@pytest.fixture
+def playwright():
+    fake = FakePlaywright()
+    with patch("app.services.browser.async_playwright", return_value=fake), \
+         patch.object(settings, "BROWSER_QUIET_WINDOW", 0.01):
+        yield fake
+
+
+def fake_route(url, resource_type):
+    return SimpleNamespace(request=SimpleNamespace(url=url, resource_type=resource_type), abort=AsyncMock(), continue_=AsyncMock())
+
+
+@pytest.mark.asyncio
+async def test_browsers_are_reused_and_recycled(playwright):
+    pool = BrowserPool(size=1, max_pages=2)
+
+    pages = [await pool.fetch(f"https://example.com/{i}") for i in range(3)]
+
+    assert pages == [f"<html>https://example.com/{i}</html>" for i in range(3)]
+    assert len(playwright.browsers) == 2
+    assert playwright.browsers[0].closed and not playwright.browsers[1].closed
+    # Every page got its own context, closed afterwards
+    assert all(context.closed for context in playwright.browsers[0].contexts)
+    assert len(playwright.browsers[0].contexts) == 2
+    assert pool.counters["recycled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_crashed_browser_is_replaced(playwright):
+    pool = BrowserPool(size=1, max_pages=0)
+    await pool.fetch("https://example.com/a")
+    playwright.browsers[0].connected = False
+
+    await pool.fetch("https://example.com/b")
+
+    assert len(playwright.browsers) == 2
+    assert pool.counters["crashed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_size_caps_concurrent_browsers(playwright):
+    pool = BrowserPool(size=2, max_pages=0)
+
+    await asyncio.gather(*(pool.fetch(f"https://example.com/{i}") for i in range(6)))
+
+    assert len(playwright.browsers) == 2
+    assert all(browser.max_active == 1 for browser in playwright.browsers)
+    await pool.close()
+    assert all(browser.closed for browser in playwright.browsers)
+
+
+@pytest.mark.asyncio
+async def test_blocks_resources_without_text():
+    pool = BrowserPool(size=1, max_pages=0)
+    image = fake_route("https://docs.example.com/logo.png", "image")
+    tracker = fake_route("https://www.google-analytics.com/collect", "xhr")
+    document = fake_route("https://docs.example.com/install", "document")
+
+    for route in (image, tracker, document):
+        await pool._route(route)
+
+    image.abort.assert_awaited_once()
+    tracker.abort.assert_awaited_once()
+    document.continue_.assert_awaited_once()
+    assert pool.counters["blocked_requests"] == 2
+
+
+@pytest.mark.asyncio
+async def test_network_idle_waits_for_requests_in_flight():
+    page = FakePage(None)
+    network = NetworkIdle(page, quiet=0.02)
+    page.listeners["request"]("api")
+
+    assert not await network.wait(0.05)
+    page.listeners["requestfinished"]("api")
+    assert await network.wait(0.05)
+    # A request started after a quiet gap makes the page busy again
+    page.listeners["request"]("lazy")
+    assert not await network.wait(0.05)
+
+
+def test_timeouts_follow_domain_render_times():
+    pool = BrowserPool(size=1, max_pages=0)
+    assert pool.page_timeouts("fast.example.com") == (settings.BROWSER_PAGE_LOAD_TIMEOUT, settings.BROWSER_SETTLE_TIMEOUT)
+
+    for load_time in (0.5, 1, 4):
+        pool.load_times.record("fast.example.com", load_time)
+        pool.settle_times.record("fast.example.com", 0.4)
+
+    assert pool.page_timeouts("fast.example.com") == (8, 1)
+
+
+@pytest.mark.asyncio
+async def test_timed_out_renders_let_timeouts_grow_again(playwright):
+    pool = BrowserPool(size=1, max_pages=0)
+    for _ in range(3):
+        pool.load_times.record("slow.example.com", 0.1)
+    assert pool.page_timeouts("slow.example.com")[0] == 5
+
+    async def time_out(page, url, timeout, wait_until):
+        page.url = url
+        await asyncio.sleep(0.01)
+        raise PlaywrightTimeoutError("Timeout exceeded")
+
+    with patch.object(FakePage, "goto", time_out):
+        for _ in range(3):
+            await pool.fetch("https://slow.example.com/page")
+
+    assert pool.counters["load_timeouts"] == 3
+    assert len(pool.load_times._samples["slow.example.com"]) == 6
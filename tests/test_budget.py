@@ -0,0 +1,142 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+import pytest
+
+from app.config import settings
+from app.models.budget import Budget, RepetitionDetector
+from app.models.models import Chat, ResponseToolCall, User
+from app.services.llm_wrapper import llm_tool_call
+from app.services.model_router import record_usage, token_usage, track_usage
+
+
+def make_response(commands=None, done=False, text_result=""):
+    return ResponseToolCall(done=done, message="", repo_update={}, text_result=text_result, get_knowledge=[], commands=commands or [])
+
+
+def test_task_budget_draws_from_chat_budget():
+    chat_budget = Budget(max_commands=3)
+    task_budget = Budget(max_iterations=5, max_tokens=100, parent=chat_budget)
+
+    task_budget.charge(iterations=1, commands=2)
+    assert task_budget.exceeded() is None
+    task_budget.charge(iterations=1, commands=1)
+    assert task_budget.exceeded() == "shell commands limit of 3 reached"
+
+    fresh = Budget(max_tokens=100)
+    reset = track_usage(*fresh.counters())
+    record_usage(SimpleNamespace(prompt_tokens=90, completion_tokens=10, total_tokens=100))
+    token_usage.reset(reset)
+    assert fresh.exceeded() == "tokens limit of 100 reached"
+
+
+def test_detects_near_identical_actions():
+    detector = RepetitionDetector(window=4, similarity=0.9, max_repeats=2)
+
+    assert not detector.add("shell: curl http://localhost:8001/health")
+    assert not detector.add("shell: ls -la")
+    assert not detector.add("shell: curl http://localhost:8002/health")
+    assert detector.add("shell: curl  http://localhost:8003/health")
+    assert not detector.add("knowledge: kubernetes ingress tls")
+
+
+def test_repeated_action_with_changed_outcome_is_progress():
+    detector = RepetitionDetector(window=6, similarity=0.9, max_repeats=2)
+
+    edits = ["edit: app.py def parse(text):", "edit: app.py import json", "edit: util.py return None"]
+    for edit, outcome in zip(edits, ["3 failed", "2 failed", "1 failed"]):
+        assert not detector.add(edit, "Edited files")
+        assert not detector.add("shell: pytest", outcome)
+    assert not detector.add("shell: pytest", "1 failed")
+    assert detector.add("shell: pytest", "1 failed")
+
+
+@pytest.mark.asyncio
+async def test_repeating_loop_is_stopped_with_best_effort_answer():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    responses = [make_response(commands=[f"curl http://localhost:800{i}/health"]) for i in range(1, 6)]
+    wrapper = AsyncMock(side_effect=[*responses[:3], make_response(done=True, text_result="best effort")])
+    shell = AsyncMock(return_value=json.dumps({"status_code": 7, "content": "connection refused"}))
+
+    with patch("app.services.llm_wrapper.llm_call_wrapper", wrapper), \
+         patch("app.services.llm_wrapper.execute_shell", shell), \
+         patch("app.services.llm_wrapper.use_native_tools", return_value=False), \
+         patch("app.services.llm_wrapper.fit_to_context", side_effect=lambda messages, model: model):
+        result = await llm_tool_call(messages=[], chat=chat, model="model")
+
+    assert result.text_result == "best effort"
+    assert result.done
+    assert shell.await_count == 3
+    assert wrapper.await_count == 4
+    assert chat.budget.iterations == 3
+
+
+@pytest.mark.asyncio
+async def test_exhausted_budget_forces_answer():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    wrapper = AsyncMock(side_effect=[
+        make_response(commands=["ls"]),
+        make_response(commands=["cat README.md"]),
+        make_response(done=True, text_result="best effort"),
+    ])
+    shell = AsyncMock(return_value=json.dumps({"status_code": 0, "content": "ok"}))
+
+    with patch.object(settings, "TASK_MAX_ITERATIONS", 2), \
+         patch("app.services.llm_wrapper.llm_call_wrapper", wrapper), \
+         patch("app.services.llm_wrapper.execute_shell", shell), \
+         patch("app.services.llm_wrapper.use_native_tools", return_value=False), \
+         patch("app.services.llm_wrapper.fit_to_context", side_effect=lambda messages, model: model):
+        result = await llm_tool_call(messages=[], chat=chat, model="model")
+
+    assert result.text_result == "best effort"
+    assert wrapper.await_count == 3
+    assert "iterations limit of 2 reached" in wrapper.await_args.kwargs["messages"][-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_test_runs_after_edits_are_not_repetitions():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    responses = [make_response(commands=["pytest"]) for _ in range(4)]
+    wrapper = AsyncMock(side_effect=[*responses, make_response(done=True, text_result="all tests pass")])
+    outputs = [f"{failed} failed" for failed in (4, 3, 2, 1)]
+    shell = AsyncMock(side_effect=[json.dumps({"status_code": 1, "content": output}) for output in outputs])
+
+    with patch("app.services.llm_wrapper.llm_call_wrapper", wrapper), \
+         patch("app.services.llm_wrapper.execute_shell", shell), \
+         patch("app.services.llm_wrapper.use_native_tools", return_value=False), \
+         patch("app.services.llm_wrapper.fit_to_context", side_effect=lambda messages, model: model):
+        result = await llm_tool_call(messages=[], chat=chat, model="model")
+
+    assert result.text_result == "all tests pass"
+    assert shell.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_streamed_tool_loop_exhausts_token_budget():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    calls = []
+
+    async def stream(content):
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+        # The usage comes with the final chunk, without choices
+        yield SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=50, completion_tokens=10, total_tokens=60))
+
+    async def acompletion(model, **kwargs):
+        calls.append(kwargs)
+        if kwargs.get("stream"):
+            return stream(make_response(commands=["ls"]).model_dump_json())
+        message = SimpleNamespace(content=make_response(done=True, text_result="best effort").model_dump_json())
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    shell = AsyncMock(return_value=json.dumps({"status_code": 0, "content": "ok"}))
+    with patch.object(settings, "TASK_MAX_TOKENS", 100), \
+         patch.object(settings, "STREAM_TOOL_CALLS", True), \
+         patch("app.services.model_router.litellm.acompletion", acompletion), \
+         patch("app.services.llm_wrapper.execute_shell", shell), \
+         patch("app.services.llm_wrapper.use_native_tools", return_value=False), \
+         patch("app.services.llm_wrapper.fit_to_context", side_effect=lambda messages, model: model):
+        result = await llm_tool_call(messages=[], chat=chat, model="model")
+
+    assert result.text_result == "best effort"
+    assert [call.get("stream_options") for call in calls] == [{"include_usage": True}] * 2 + [None]
+    assert chat.budget.usage["total_tokens"] == 120
@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+
+from app.models.models import Chat, User, task_tag
+
+
+def make_chat():
+    return Chat(id="chat", user=User(id="user", username="user"))
+
+
+async def chunks(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.mark.asyncio
+async def test_set_message_without_delay_queues_whole_message():
+    chat = make_chat()
+
+    await chat.set_message("Hello world")
+
+    assert await chat.get_queue_msg() == "Hello world"
+    assert chat.messages[-1].content == "Hello world"
+
+
+@pytest.mark.asyncio
+async def test_stream_message_forwards_chunks_and_assembles_message():
+    chat = make_chat()
+
+    content = await chat.stream_message(chunks("Hel", "lo", " world"))
+
+    assert content == "Hello world"
+    assert [await chat.get_queue_msg() for _ in range(3)] == ["Hel", "lo", " world"]
+    assert chat.messages[-1].content == "Hello world"
+
+
+@pytest.mark.asyncio
+async def test_messages_are_tagged_with_current_task():
+    chat = make_chat()
+    token = task_tag.set("DE-1")
+    try:
+        await chat.set_message("working")
+    finally:
+        task_tag.reset(token)
+
+    assert await chat.get_queue_msg() == "[DE-1] working"
+
+
+@pytest.mark.asyncio
+async def test_other_tasks_write_while_a_message_streams():
+    chat = make_chat()
+    generating = asyncio.Event()
+    written = asyncio.Event()
+
+    async def slow_chunks():
+        yield "Hel"
+        generating.set()
+        await written.wait()
+        yield "lo"
+
+    async def write_other_task():
+        await generating.wait()
+        task_tag.set("DE-2")
+        await chat.set_message("done")
+        written.set()
+
+    token = task_tag.set("DE-1")
+    try:
+        content, _ = await asyncio.gather(chat.stream_message(slow_chunks()), write_other_task())
+    finally:
+        task_tag.reset(token)
+
+    assert content == "Hello"
+    queued = [await chat.get_queue_msg() for _ in range(5)]
+    assert queued == ["[DE-1] ", "Hel", "[DE-2] done", "\n\n[DE-1] ", "lo"]
+
+
+@pytest.mark.asyncio
+async def test_interrupted_stream_is_marked_in_chat():
+    chat = make_chat()
+
+    async def failing_chunks():
+        yield "Hel"
+        raise ConnectionError("stream closed")
+
+    with pytest.raises(ConnectionError):
+        await chat.stream_message(failing_chunks())
+
+    assert chat.messages[-1].content.startswith("Hel")
+    assert "interrupted" in chat.messages[-1].content
+    assert await chat.get_queue_msg() == "Hel"
+    assert "interrupted" in await chat.get_queue_msg()
@@ -0,0 +1,69 @@
+from unittest.mock import AsyncMock, patch
+import pytest
+
+from app.models.models import Agent, DifficultyLevel
+from app.services.checkpoint import RepoRef, Stage, end_request, load_checkpoint, restore_chat, save_checkpoint, save_task_result
+from app.services.llm import solve_medium_request, taskResults
+
+
+def test_restores_unfinished_chat(make_chat):
+    chat = make_chat("checkpoint-restore")
+    chat.category = DifficultyLevel.MEDIUM
+    chat.project_description = "description"
+    chat.messages = []
+    save_checkpoint(chat, Stage.DESCRIBED)
+
+    restored = restore_chat(chat.id)
+
+    assert restored.category == DifficultyLevel.MEDIUM
+    assert restored.project_description == "description"
+
+    save_checkpoint(chat, Stage.DONE)
+    assert restore_chat(chat.id) is None
+
+
+def test_only_interrupted_requests_are_resumed_by_a_new_request(make_chat):
+    chat = make_chat("checkpoint-clarifying")
+    chat.category = DifficultyLevel.MEDIUM
+    save_checkpoint(chat, Stage.CLARIFYING)
+    # Interrupted while asking the questions, e.g. by a restart
+    assert restore_chat(chat.id, interrupted_only=True) is not None
+
+    end_request(chat)
+
+    # The same first message again starts over, an answer to the questions goes on with the chat
+    assert restore_chat(chat.id, interrupted_only=True) is None
+    assert restore_chat(chat.id).category == DifficultyLevel.MEDIUM
+
+
+@pytest.mark.asyncio
+async def test_planned_chat_resumes_with_unsolved_tasks(make_task, make_chat):
+    chat = make_chat("checkpoint-resume", tasks=[make_task("A"), make_task("B", ["A"])])
+    agent = Agent(role="role", background="background", skills="skills")
+    save_checkpoint(chat, Stage.PLANNED, agent=agent)
+    save_task_result(chat, "A", "result A")
+
+    solve_task = AsyncMock()
+    with patch("app.services.llm.solve_task", solve_task), \
+         patch("app.services.llm.plan_medium_request", AsyncMock()) as plan:
+        await solve_medium_request(restore_chat(chat.id))
+
+    plan.assert_not_awaited()
+    assert [call.kwargs["task"].unique_id for call in solve_task.await_args_list] == ["B"]
+    assert taskResults[chat.id]["A"] == "result A"
+    assert load_checkpoint(chat.id).task_results == {"A": "result A"}
+
+
+def test_new_run_of_finished_chat_starts_a_fresh_checkpoint(make_chat):
+    chat = make_chat("checkpoint-rerun")
+    agent = Agent(role="role", background="background", skills="skills")
+    save_checkpoint(chat, Stage.PLANNED, agent=agent, repo=RepoRef(uuid="uuid", name="repo", local_path="/tmp/repo"))
+    save_task_result(chat, "TASK-1", "old result")
+    save_checkpoint(chat, Stage.DONE)
+
+    save_checkpoint(chat, Stage.CATEGORIZED)
+
+    checkpoint = load_checkpoint(chat.id)
+    assert checkpoint.stage == Stage.CATEGORIZED
+    assert checkpoint.agent is None and checkpoint.repo is None
+    assert checkpoint.task_results == {}
@@ -0,0 +1,85 @@
+from unittest.mock import patch
+import pytest
+
+from app.config import settings
+from app.services.compaction import compact_messages, fit_to_context
+
+
+def count_chars(message, model):
+    return len(message["content"])
+
+
+@pytest.fixture(autouse=True)
+def char_tokens():
+    with patch("app.services.compaction.count_message_tokens", side_effect=count_chars), \
+         patch.object(settings, "COMPACTION_KEEP_RECENT", 2), \
+         patch.object(settings, "COMPACTION_SNIPPET_CHARS", 10):
+        yield
+
+
+def make_messages():
+    return [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "task"},
+        {"role": "assistant", "content": "a" * 100},
+        {"role": "assistant", "content": "b" * 100},
+        {"role": "user", "content": "continue"},
+        {"role": "assistant", "content": "c" * 100},
+    ]
+
+
+def test_messages_within_budget_are_unchanged():
+    messages = make_messages()
+
+    assert compact_messages(messages, 1000, "model")
+    assert messages == make_messages()
+
+
+def test_old_tool_outputs_are_shortened_first():
+    messages = make_messages()
+
+    assert compact_messages(messages, 200, "model")
+
+    assert messages[:2] == make_messages()[:2]
+    assert messages[2]["content"].startswith("a" * 10 + " ... ")
+    assert messages[-2:] == make_messages()[-2:]
+
+
+def test_old_tool_outputs_are_dropped_when_shortening_is_not_enough():
+    messages = make_messages()
+    messages[2:2] = [{"role": "assistant", "content": "x" * 100} for _ in range(3)]
+
+    assert compact_messages(messages, 200, "model")
+
+    assert len(messages) == 5
+    assert messages[2]["content"] == "5 earlier tool outputs were removed to fit the context window."
+    assert messages[-2:] == make_messages()[-2:]
+
+
+def test_routes_to_large_context_model_if_compaction_is_not_enough():
+    messages = make_messages()
+    windows = {"small": 50, "large": 1000}
+
+    with patch("app.services.compaction.get_prompt_budget", side_effect=windows.get), \
+         patch.object(settings, "LLM_LARGE_CONTEXT_MODEL", "large"):
+        model = fit_to_context(messages, "small")
+
+    assert model == "large"
+    assert messages == make_messages()
+
+
+def test_tool_results_are_not_separated_from_their_call():
+    call = {"role": "assistant", "content": "", "tool_calls": [{"id": "1", "type": "function", "function": {"name": "execute_shell", "arguments": "{}"}}]}
+    messages = [
+        {"role": "system", "content": "system"},
+        {"role": "user", "content": "task"},
+        {"role": "assistant", "content": "a" * 100},
+        call,
+        {"role": "tool", "tool_call_id": "1", "content": "x" * 100},
+        {"role": "assistant", "content": "recent"},
+    ]
+
+    compact_messages(messages, 10, "model")
+
+    tool_index = [m["role"] for m in messages].index("tool")
+    assert messages[tool_index - 1] is call
@@ -0,0 +1,94 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+import httpx
+import litellm
+import pytest
+from fastapi import WebSocket
+
+from app.config import settings
+from app.models.models import Chat, Message, Roles, User
+from app.services.deadline import DeadlineExceeded, cap_timeout, request_deadline, start_deadline
+from app.services.llm import process_request_until_deadline, taskResults
+from app.services.llm_wrapper import llm_call_wrapper
+from app.services.wss import connected_receivers, execute_shell, receiver_locks
+
+
+def test_timeouts_are_capped_to_the_deadline():
+    assert cap_timeout(30, "call") == 30
+
+    token = start_deadline(5)
+    try:
+        assert 4 < cap_timeout(30, "call") <= 5
+        assert cap_timeout(2, "call") == 2
+        start_deadline(-1)
+        with pytest.raises(DeadlineExceeded):
+            cap_timeout(30, "call")
+    finally:
+        request_deadline.reset(token)
+
+
+@pytest.mark.asyncio
+async def test_llm_call_is_not_retried_past_the_deadline():
+    response = httpx.Response(429, headers={"retry-after": "7"}, request=httpx.Request("POST", "http://llm"))
+    error = litellm.exceptions.RateLimitError(message="slow down", llm_provider="openai", model="gpt", response=response)
+    acompletion = AsyncMock(side_effect=error)
+    # Set in the test's own context, like the task of a request
+    start_deadline(1)
+
+    with patch("app.services.llm_wrapper.acompletion_with_fallbacks", acompletion), pytest.raises(DeadlineExceeded):
+        await asyncio.wait_for(llm_call_wrapper(model="gpt", messages=[{"role": "user", "content": "question"}]), 0.5)
+    assert acompletion.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_hanging_shell_command_times_out():
+    chat = Chat(id="chat", user=User(id="deadline-user", username="user"))
+    ws = MagicMock(spec=WebSocket)
+
+    async def hang():
+        await asyncio.sleep(10)
+    ws.receive_text = hang
+    connected_receivers[chat.user.id] = ws
+
+    try:
+        with patch.object(settings, "SHELL_COMMAND_TIMEOUT", 0.05):
+            result = await execute_shell(chat, "sleep 100")
+    finally:
+        del connected_receivers[chat.user.id]
+
+    assert json.loads(result)["status_code"] == 504
+
+
+@pytest.mark.asyncio
+async def test_hanging_receiver_is_disconnected_and_releases_the_lock():
+    chat = Chat(id="chat", user=User(id="hanging-user", username="user"))
+    ws = MagicMock(spec=WebSocket)
+
+    async def hang():
+        await asyncio.sleep(10)
+    ws.receive_text = hang
+    connected_receivers[chat.user.id] = ws
+
+    with patch.object(settings, "SHELL_COMMAND_TIMEOUT", 0.05), patch.object(settings, "SHELL_EXCHANGE_TIMEOUT", 0.1):
+        await execute_shell(chat, "sleep 100")
+        await asyncio.wait_for(receiver_locks[chat.user.id].acquire(), 1)
+    receiver_locks[chat.user.id].release()
+
+    assert chat.user.id not in connected_receivers
+    ws.close.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_deadline_message_lists_only_results_of_the_request():
+    chat = Chat(id="deadline-chat", user=User(id="user", username="user"))
+    taskResults[chat.id] = {"OLD-1": "result of an earlier request"}
+    categorize = AsyncMock(side_effect=DeadlineExceeded("Request deadline exceeded"))
+
+    with patch.object(settings, "SPECULATIVE_PIPELINE", False), \
+         patch("app.services.llm.categorize_request", categorize), \
+         patch("app.services.llm.save_checkpoint"):
+        result = await process_request_until_deadline(chat, [Message(role=Roles.USER, content="request")])
+
+    assert result == "deadline"
+    assert not any("OLD-1" in message.content for message in chat.messages)
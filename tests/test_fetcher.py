@@ -0,0 +1,74 @@
+from unittest.mock import AsyncMock, patch
+import httpx
+import pytest
+
+from app.services.fetcher import BROWSER_DOMAIN_TTL, PageFetcher, has_main_content
+
+ARTICLE = "<html><body><nav>Docs Home</nav><main><h1>Install</h1><p>" + "Run the installer and configure it. " * 30 + "</p></main></body></html>"
+SPA_SHELL = '<html><body><div id="root"></div><noscript>You need to enable JavaScript to run this app.</noscript><script src="/app.js"></script></body></html>'
+
+
+def make_fetcher(pages: dict):
+    def handler(request: httpx.Request):
+        return httpx.Response(200, text=pages[request.url.path], headers={"content-type": "text/html; charset=utf-8"})
+
+    browser = AsyncMock()
+    browser.fetch.side_effect = lambda url: f"<html>rendered {url}</html>"
+    fetcher = PageFetcher(browser=browser, min_chars=500, timeout=5, max_connections=5)
+    fetcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return fetcher, browser
+
+
+def test_detects_script_shells():
+    assert has_main_content(ARTICLE, 500)
+    assert not has_main_content(SPA_SHELL, 500)
+
+
+@pytest.mark.asyncio
+async def test_static_pages_skip_the_browser():
+    fetcher, browser = make_fetcher({"/install": ARTICLE})
+
+    assert await fetcher.fetch("https://docs.example.com/install") == ARTICLE
+    browser.fetch.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_script_shell_domains_are_rendered_right_away():
+    fetcher, browser = make_fetcher({"/a": SPA_SHELL, "/b": SPA_SHELL, "/c": SPA_SHELL})
+
+    assert await fetcher.fetch("https://app.example.com/a") == "<html>rendered https://app.example.com/a</html>"
+    await fetcher.fetch("https://app.example.com/b")
+    assert fetcher.needs_browser("app.example.com")
+
+    static = AsyncMock()
+    fetcher.fetch_static = static
+    await fetcher.fetch("https://app.example.com/c")
+    static.assert_not_awaited()
+    assert browser.fetch.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_fetches_dont_mark_a_domain_and_learning_expires():
+    fetcher, browser = make_fetcher({"/a": SPA_SHELL, "/b": SPA_SHELL})
+    fetcher.fetch_static = AsyncMock(return_value=None)
+
+    await fetcher.fetch("https://flaky.example.com/a")
+    await fetcher.fetch("https://flaky.example.com/b")
+    assert not fetcher.needs_browser("flaky.example.com")
+    assert browser.fetch.await_count == 2
+
+    del fetcher.fetch_static
+    await fetcher.fetch("https://app.example.com/a")
+    await fetcher.fetch("https://app.example.com/b")
+    assert fetcher.needs_browser("app.example.com")
+    fetcher.domains["app.example.com"].learned -= BROWSER_DOMAIN_TTL + 1
+    assert not fetcher.needs_browser("app.example.com")
+
+
+def test_domain_stats_are_bounded():
+    fetcher, _ = make_fetcher({})
+    with patch("app.services.fetcher.MAX_DOMAINS", 2):
+        for domain in ("a.com", "b.com", "a.com", "c.com"):
+            fetcher.domain_stats(domain)
+
+    assert list(fetcher.domains) == ["a.com", "c.com"]
@@ -0,0 +1,161 @@
+import asyncio
+from collections import Counter
+from unittest.mock import patch
+import pytest
+
+from app.config import settings
+from app.services import knowledge
+from app.services.deadline import remaining, request_deadline, start_deadline
+from app.services.model_router import token_usage, track_usage
+from app.services.knowledge import background_ingestions, cancel_background_ingestions, ingest_urls, ingesting_urls
+
+
+@pytest.mark.asyncio
+async def test_loads_top_urls_concurrently_and_returns_early():
+    loaded = []
+    running = 0
+    max_running = 0
+
+    async def fake_load(url, query):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.2 if url.endswith("slow") else 0.01)
+        running -= 1
+        loaded.append(url)
+        return ["doc"]
+
+    def fake_search(query):
+        return [], [f"doc-{url}" for url in loaded]
+
+    urls = ["https://a.example.com/fast", "https://b.example.com/fast", "https://c.example.com/slow",
+            "https://d.example.com/slow", "https://e.example.com/fast"]
+    with patch.object(knowledge, "load_from_url", fake_load), \
+         patch.object(knowledge, "search_vector", fake_search), \
+         patch.object(settings, "KNOWLEDGE_INGEST_TOP_K", 4), \
+         patch.object(settings, "KNOWLEDGE_INGEST_WORKERS", 3), \
+         patch.object(settings, "KNOWLEDGE_ENOUGH_DOCS", 2):
+        await asyncio.wait_for(ingest_urls(urls, "query"), 0.15)
+        assert sorted(loaded) == ["https://a.example.com/fast", "https://b.example.com/fast"]
+        assert len(background_ingestions) == 2
+
+        await asyncio.gather(*background_ingestions)
+
+    assert max_running == 3
+    assert "https://e.example.com/fast" not in loaded
+    assert not background_ingestions
+
+
+@pytest.mark.asyncio
+async def test_failing_page_does_not_stop_the_others():
+    loaded = []
+
+    async def fake_load(url, query):
+        if "broken" in url:
+            raise ValueError("unparsable")
+        await asyncio.sleep(0.01)
+        loaded.append(url)
+        return ["doc"]
+
+    with patch.object(knowledge, "load_from_url", fake_load), \
+         patch.object(knowledge, "search_vector", return_value=([], [])):
+        await ingest_urls(["https://broken.example.com", "https://ok.example.com"], "query")
+
+    assert loaded == ["https://ok.example.com"]
+    assert not background_ingestions
+
+
+@pytest.mark.asyncio
+async def test_known_documents_dont_count_as_enough():
+    loaded = []
+
+    async def fake_load(url, query):
+        await asyncio.sleep({"fast": 0.01, "slow": 0.05, "slowest": 0.3}[url.rsplit("/", 1)[-1]])
+        loaded.append(url)
+        return ["doc"]
+
+    def fake_search(query):
+        # Two irrelevant documents were found and summarized before any url was loaded
+        docs = ["irrelevant-1", "irrelevant-2", *(f"doc-{url}" for url in loaded)]
+        return [], docs
+
+    urls = ["https://a.example.com/fast", "https://b.example.com/slow", "https://c.example.com/slowest"]
+    with patch.object(knowledge, "load_from_url", fake_load), \
+         patch.object(knowledge, "search_vector", fake_search), \
+         patch.object(settings, "KNOWLEDGE_ENOUGH_DOCS", 2):
+        await ingest_urls(urls, "query", known_doc_ids={"irrelevant-1", "irrelevant-2"})
+        # Only the second new document is enough
+        assert loaded == ["https://a.example.com/fast", "https://b.example.com/slow"]
+        await asyncio.gather(*background_ingestions)
+
+
+@pytest.mark.asyncio
+async def test_url_in_flight_is_not_ingested_twice():
+    loaded = []
+
+    async def fake_load(url, query):
+        await asyncio.sleep(0.05)
+        loaded.append(url)
+        return ["doc"]
+
+    urls = ["https://a.example.com", "https://b.example.com"]
+    with patch.object(knowledge, "load_from_url", fake_load), \
+         patch.object(knowledge, "search_vector", return_value=([], [])):
+        await asyncio.gather(ingest_urls(urls, "first query"), ingest_urls(urls, "second query"))
+
+    assert sorted(loaded) == urls
+    assert not ingesting_urls
+
+
+@pytest.mark.asyncio
+async def test_background_load_blocks_the_url_until_cancelled():
+    loaded = []
+
+    async def fake_load(url, query):
+        await asyncio.sleep(0.01 if url.endswith("fast") else 10)
+        loaded.append(url)
+        return ["doc"]
+
+    urls = ["https://a.example.com/fast", "https://b.example.com/slow"]
+    with patch.object(knowledge, "load_from_url", fake_load), \
+         patch.object(knowledge, "search_vector", return_value=([], ["doc"])), \
+         patch.object(settings, "KNOWLEDGE_ENOUGH_DOCS", 1):
+        await ingest_urls(urls, "query")
+        assert len(background_ingestions) == 1
+        # A later query doesn't start the slow url again while it loads in the background
+        await ingest_urls(["https://b.example.com/slow"], "other query")
+        assert len(background_ingestions) == 1
+
+        await cancel_background_ingestions()
+
+    assert loaded == ["https://a.example.com/fast"]
+    assert not background_ingestions
+    assert not ingesting_urls
+
+
+@pytest.mark.asyncio
+async def test_background_loads_are_detached_from_the_request():
+    seen = {}
+
+    async def fake_load(url, query):
+        await asyncio.sleep(0.01 if url.endswith("fast") else 0.1)
+        seen[url] = (remaining(), token_usage.get())
+        return ["doc"]
+
+    urls = ["https://a.example.com/fast", "https://b.example.com/slow"]
+    deadline = start_deadline(60)
+    usage = track_usage(Counter())
+    try:
+        with patch.object(knowledge, "load_from_url", fake_load), \
+             patch.object(knowledge, "search_vector", return_value=([], ["doc"])), \
+             patch.object(settings, "KNOWLEDGE_ENOUGH_DOCS", 1):
+            await ingest_urls(urls, "query")
+            await asyncio.gather(*background_ingestions)
+    finally:
+        token_usage.reset(usage)
+        request_deadline.reset(deadline)
+
+    fast_remaining, fast_usage = seen["https://a.example.com/fast"]
+    assert fast_remaining is not None and len(fast_usage) == 1
+    # The request's deadline and budgets don't reach the load which went on in the background
+    assert seen["https://b.example.com/slow"] == (None, ())
@@ -0,0 +1,34 @@
+import json
+import pytest
+
+from app.services.json_repair import loads_tolerant, repair_json
+
+
+@pytest.mark.parametrize("content, expected", [
+    ('```json\n{"a": 1}\n```', {"a": 1}),
+    ('Here you go: {"a": [1, 2,], "b": {"c": 3,},} Hope it helps!', {"a": [1, 2], "b": {"c": 3}}),
+    ("{'a': 'it\\'s \"quoted\"', 'b': True, 'c': None}", {"a": "it's \"quoted\"", "b": True, "c": None}),
+    ('{"a": "line\nbreak"}', {"a": "line\nbreak"}),
+])
+def test_repairs_common_defects(content, expected):
+    assert json.loads(repair_json(content)) == expected
+
+
+@pytest.mark.parametrize("content", [
+    '{"commands": ["ls", "pwd"',
+    '{"a": {"b": "unterminated',
+    '{"a": 1, "b":',
+    '{"a": [1, {"b": true',
+])
+def test_truncated_output_is_not_closed(content):
+    with pytest.raises(json.JSONDecodeError):
+        loads_tolerant(content)
+
+
+def test_valid_json_is_parsed_unchanged():
+    assert loads_tolerant('{"a": "{[\'"}') == {"a": "{['"}
+
+
+def test_unrepairable_content_raises_value_error():
+    with pytest.raises(ValueError):
+        loads_tolerant("no json at all")
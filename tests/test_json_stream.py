@@ -0,0 +1,38 @@
+from app.services.json_stream import JsonStreamParser
+
+
+def feed_chars(parser, text):
+    events = []
+    for ch in text:
+        events.extend(parser.feed(ch))
+    return events
+
+
+def test_emits_array_elements_as_they_close():
+    parser = JsonStreamParser()
+
+    events = parser.feed('{"done": false, "commands": ["ls -la", ')
+    assert events == [("commands", "ls -la")]
+
+    events = parser.feed('"echo \\"]\\""], "message": "a, [b]"}')
+    assert events == [("commands", 'echo "]"')]
+    assert parser.done
+
+
+def test_emits_object_entries_and_nested_values():
+    text = '```json\n{"repo_update": {"a.py": "print(1)", "b.json": "{}"}, "x": [{"a": [1, 2]}, 3], "get_knowledge": []}\n```'
+
+    events = feed_chars(JsonStreamParser(), text)
+
+    assert events == [
+        ("repo_update", ("a.py", "print(1)")),
+        ("repo_update", ("b.json", "{}")),
+        ("x", {"a": [1, 2]}),
+        ("x", 3),
+    ]
+
+
+def test_ignores_scalar_fields():
+    events = feed_chars(JsonStreamParser(), '{"done": true, "message": "[1, 2]", "text_result": "{}"}')
+
+    assert events == []
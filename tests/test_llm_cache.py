@@ -0,0 +1,66 @@
+import json
+import pytest
+from pydantic import BaseModel
+
+from app.services.llm_cache import LLMCache, make_cache_key
+from app.services.object_store.mongo_local import MongoLocalStore
+
+
+class Answer(BaseModel):
+    value: int
+
+
+@pytest.fixture
+def cache():
+    return LLMCache(collection=MongoLocalStore(collection="test_llm_cache"), max_entries=2)
+
+
+def test_cache_key_normalizes_whitespace_and_includes_schema():
+    a = make_cache_key("m", [{"role": "user", "content": "  hello\n   world "}], Answer)
+    b = make_cache_key("m", [{"role": "user", "content": "hello world"}], Answer)
+    c = make_cache_key("m", [{"role": "user", "content": "hello world"}])
+
+    assert a == b
+    assert a != c
+
+
+def test_memory_tier_evicts_least_recently_used(cache):
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a", ttl=60)
+    cache.set("c", "3")
+
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.get("b", ttl=60, site="site") == "2"
+    assert cache.counters["site:hit_store"] == 1
+
+
+def test_expired_entries_are_misses(cache):
+    cache.set("a", "1")
+
+    assert cache.get("a", ttl=-1, site="site") is None
+    assert cache.counters["site:miss"] == 1
+    assert cache.collection.find_one({"key": "a"}) is None
+
+
+def test_cached_structured_result_is_revalidated(cache):
+    cache.set("valid", json.dumps({"value": 1}))
+    cache.set("invalid", json.dumps({"value": "x"}))
+
+    assert cache.get_validated("valid", 60, "site", Answer) == Answer(value=1)
+    assert cache.get_validated("invalid", 60, "site", Answer) is None
+    assert cache.counters["site:invalid"] == 1
+
+
+def test_prune_deletes_entries_older_than_max_age(cache):
+    cache.set("old", "1")
+    cache.set("new", "2")
+    old = cache.collection.find_one({"key": "old"})
+    cache.collection.delete(old)
+    cache.collection.insert({**{k: v for k, v in old.items() if k != "_id"}, "timestamp": old["timestamp"] - 120})
+    cache._entries["old"] = (old["timestamp"] - 120, "1")
+
+    assert cache.prune(max_age=60) == 1
+    assert cache.collection.find_one({"key": "old"}) is None
+    assert cache.get("new", ttl=60) == "2"
+    assert "old" not in cache._entries
@@ -0,0 +1,79 @@
+import asyncio
+from collections import Counter
+from unittest.mock import AsyncMock, patch
+import litellm
+import pytest
+from pydantic import BaseModel
+
+from app.config import settings
+from app.services.model_router import LatencyTracker, acompletion_with_fallbacks, get_hedge_stats, get_models, hedged_acompletion
+
+
+class Check(BaseModel):
+    correct: bool
+
+
+@pytest.fixture(autouse=True)
+def routes():
+    with patch.object(settings, "LLM_MODEL", "big"), \
+         patch.object(settings, "LLM_SMALL_MODEL", "tiny"), \
+         patch.object(settings, "LLM_ROUTES", {"Check": ["small"], "site": ["other", "small"]}):
+        yield
+
+
+def test_routes_by_call_site_before_response_format():
+    assert get_models("site", Check) == ["other", "tiny", "big"]
+    assert get_models("unknown", Check) == ["tiny", "big"]
+    assert get_models() == ["big"]
+
+
+def test_preferred_model_comes_first():
+    assert get_models("unknown", Check, preferred="big") == ["big", "tiny"]
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_next_model_when_unreachable():
+    error = litellm.exceptions.APIConnectionError(message="down", llm_provider="ollama", model="tiny")
+    acompletion = AsyncMock(side_effect=[error, "response"])
+
+    with patch("app.services.model_router.litellm.acompletion", acompletion):
+        assert await acompletion_with_fallbacks(["tiny", "big"], messages=[]) == "response"
+
+    assert [call.kwargs["model"] for call in acompletion.await_args_list] == ["tiny", "big"]
+
+
+@pytest.mark.asyncio
+async def test_slow_call_is_hedged_and_loser_cancelled():
+    cancelled = []
+
+    async def fake_acompletion(model, **kwargs):
+        try:
+            await asyncio.sleep(1 if model == "tiny" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return model
+
+    tracker = LatencyTracker(window=10, min_samples=1)
+    tracker.record("tiny", 0.01)
+    with patch("app.services.model_router.litellm.acompletion", side_effect=fake_acompletion), \
+         patch("app.services.model_router.latencies", tracker), \
+         patch("app.services.model_router.hedge_counters", Counter()):
+        assert await hedged_acompletion(["tiny", "big"], messages=[]) == "big"
+        stats = get_hedge_stats()
+        await asyncio.sleep(0.01)
+
+    assert cancelled == ["tiny"]
+    assert stats["tiny"]["hedge_win_rate"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_streamed_calls_dont_feed_hedging_latencies():
+    tracker = LatencyTracker(window=10, min_samples=1)
+    with patch("app.services.model_router.litellm.acompletion", AsyncMock(return_value="response")), \
+         patch("app.services.model_router.latencies", tracker):
+        await hedged_acompletion(["tiny", "big"], messages=[], stream=True)
+        assert tracker.percentile("tiny", 0.5) is None
+        await hedged_acompletion(["tiny", "big"], messages=[])
+
+    assert tracker.percentile("tiny", 0.5) is not None
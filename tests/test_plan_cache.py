@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+import pytest
+
+from app.models.models import Agent, Tasks
+from app.services.object_store.mongo_local import MongoLocalStore
+from app.services.plan_cache import PlanCache
+
+
+VECTORS = {
+    "build a todo app": [1.0, 0.0, 0.0],
+    "build a todo application": [0.99, 0.1, 0.0],
+    "write a poem": [0.0, 1.0, 0.0],
+    "summarize a paper": [0.0, 0.0, 1.0],
+}
+
+
+@pytest.fixture
+def collection():
+    return MongoLocalStore(collection="test_plan_cache")
+
+
+@pytest.fixture
+def embedder():
+    fake = MagicMock()
+    fake.embed_text.side_effect = VECTORS.__getitem__
+    with patch("app.services.plan_cache.embedder", fake):
+        yield fake
+
+
+@pytest.fixture
+def make_plan(make_task):
+    def make(name):
+        tasks = Tasks(repo_url="", repo_name="", tasks=[make_task("1", name=name)])
+        return Agent(role="role", background="background", skills="skills"), tasks
+    return make
+
+
+def test_similar_request_hits_and_different_request_misses(embedder, collection, make_plan):
+    cache = PlanCache(collection, max_entries=10)
+    cache.add("user", "build a todo app", *make_plan("todo"))
+
+    plan, similarity = cache.find_similar("user", "build a todo application", 0.9)
+    assert plan.tasks.tasks[0].unique_name == "todo"
+    assert similarity > 0.9
+    assert cache.find_similar("user", "write a poem", 0.9) is None
+    assert cache.counters == {"hit": 1, "miss": 1}
+    # Descriptions embedded before aren't embedded again
+    cache.find_similar("user", "build a todo app", 0.9)
+    assert embedder.embed_text.call_count == 3
+
+
+def test_plans_are_only_reused_for_the_same_user(embedder, collection, make_plan):
+    cache = PlanCache(collection, max_entries=10)
+    cache.add("alice", "build a todo app", *make_plan("todo"))
+
+    assert cache.find_similar("bob", "build a todo app", 0.9) is None
+    assert cache.find_similar("alice", "build a todo app", 0.9) is not None
+
+
+def test_plans_are_persisted_and_oldest_evicted(embedder, collection, make_plan):
+    cache = PlanCache(collection, max_entries=2)
+    cache.add("user", "build a todo app", *make_plan("todo"))
+    cache.add("user", "write a poem", *make_plan("poem"))
+    cache.add("user", "summarize a paper", *make_plan("paper"))
+
+    reloaded = PlanCache(collection, max_entries=2)
+    assert len(collection.find({"kind": "plan"})) == 2
+    assert reloaded.find_similar("user", "build a todo app", 0.9) is None
+    assert reloaded.find_similar("user", "write a poem", 0.9)[0].tasks.tasks[0].unique_name == "poem"
+
+
+def test_concurrent_adds_keep_max_entries(embedder, collection, make_plan):
+    cache = PlanCache(collection, max_entries=3)
+    descriptions = list(VECTORS) * 5
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda description: cache.add("user", description, *make_plan(description)), descriptions))
+
+    assert len(cache._load()) == 3
+    assert len(collection.find({"kind": "plan"})) == 3
@@ -0,0 +1,56 @@
+import pytest
+
+from app.models.models import FileEdit
+from app.models.repo import EditConflictError, Repo, replace_once
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    repo = Repo(name="test")
+    repo.update_files({"a.py": "def a():\n    return 1\n", "b.py": "x = 1\nx = 1\n"})
+    return repo
+
+
+def test_replace_once_tolerates_trailing_whitespace():
+    assert replace_once("a = 1   \nb = 2\n", "a = 1\nb = 2", "c = 3") == "c = 3\n"
+
+
+def test_edits_are_applied_in_order(repo):
+    repo.apply_edits([
+        FileEdit(file_path="a.py", search="return 1", replace="return 2"),
+        FileEdit(file_path="a.py", search="return 2", replace="return 3"),
+        FileEdit(file_path="new/c.py", search="", replace="c = 1\n"),
+    ])
+
+    assert (repo.local_path / "a.py").read_text() == "def a():\n    return 3\n"
+    assert (repo.local_path / "new/c.py").read_text() == "c = 1\n"
+
+
+def test_conflicts_apply_nothing(repo):
+    with pytest.raises(EditConflictError) as error:
+        repo.apply_edits([
+            FileEdit(file_path="a.py", search="return 1", replace="return 2"),
+            FileEdit(file_path="b.py", search="x = 1", replace="x = 2"),
+            FileEdit(file_path="missing.py", search="y", replace="z"),
+            FileEdit(file_path="../outside.py", search="", replace="z"),
+        ])
+
+    assert len(error.value.conflicts) == 3
+    assert "occurs 2 times" in error.value.conflicts[0]
+    assert (repo.local_path / "a.py").read_text() == "def a():\n    return 1\n"
+
+
+def test_binary_file_is_reported_as_conflict(repo):
+    (repo.local_path / "logo.png").write_bytes(b"\x89PNG\r\n\x1a\n\xff\xfe")
+
+    with pytest.raises(EditConflictError) as error:
+        repo.apply_edits([
+            FileEdit(file_path="logo.png", search="PNG", replace="GIF"),
+            FileEdit(file_path="logo.png", search="GIF", replace="JPG"),
+            FileEdit(file_path="a.py", search="return 1", replace="return 2"),
+        ])
+
+    assert len(error.value.conflicts) == 1
+    assert "can't be read as text" in error.value.conflicts[0]
+    assert (repo.local_path / "a.py").read_text() == "def a():\n    return 1\n"
@@ -0,0 +1,48 @@
+import pytest
+
+from app.models.repo import Repo
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    repo = Repo(name="test")
+    repo.update_files({
+        "small.py": "a = 1\n",
+        "large.py": "".join(f"line {i}\n" for i in range(2000)),
+        "other.py": "b = 1\n",
+    })
+    repo.add_and_commit("files")
+    return repo
+
+
+def test_contains_diff_touched_files_and_manifest(repo):
+    repo.update_files({"small.py": "a = 2\n", "new.py": "c = 1\n"})
+
+    context = repo.get_review_context(max_chars=5000)
+
+    assert "+a = 2" in context
+    assert "New file new.py:\nc = 1" in context
+    assert "Touched file small.py:\na = 2" in context
+    assert "line 1999" not in context
+    assert context.endswith("Files in the repository:\n.gitignore\nlarge.py\nnew.py\nother.py\nsmall.py")
+
+
+def test_huge_diff_is_summarized_within_cap(repo):
+    repo.update_files({"large.py": "".join(f"changed {i}\n" for i in range(2000)), "small.py": "a = 2\n"})
+
+    context = repo.get_review_context(max_chars=3000)
+
+    assert len(context) < 3500
+    assert "The changes are too large to show completely" in context
+    assert "large.py | 4000" in context
+    assert "+a = 2" in context
+
+
+def test_large_untracked_file_is_read_only_up_to_the_cap(repo):
+    (repo.local_path / "dump.log").write_text("x" * 1_000_000)
+
+    context = repo.get_review_context(max_chars=3000)
+
+    assert len(context) < 3500
+    assert "dump.log | new file, over 3000 characters" in context
@@ -0,0 +1,99 @@
+from unittest.mock import AsyncMock, patch
+import pytest
+
+from app.config import settings
+from app.services import knowledge
+from app.services.knowledge import KnowledgeSummary, get_knowledge
+
+
+@pytest.fixture
+def sources():
+    """Fake vector store filled by ingestion, fake web search, summaries and query rewrites."""
+    indexed = {}
+
+    def search_vector(query):
+        docs = indexed.get(query, [])
+        return [{"id": f"v-{doc_id}", "doc_id": doc_id} for doc_id in docs], docs
+
+    async def ingest_urls(urls, query, chat=None, known_doc_ids=None):
+        if urls:
+            indexed.setdefault(query, []).extend(f"doc-{url}" for url in urls)
+
+    web = {}
+    summaries = {}
+
+    async def summarize(query, text, chat):
+        return summaries.get(text, KnowledgeSummary(answer="", is_irrelevant=True))
+
+    rewrite = AsyncMock(return_value="rewritten query")
+    with patch.object(knowledge, "search_vector", search_vector), \
+         patch.object(knowledge, "ingest_urls", ingest_urls), \
+         patch.object(knowledge, "perform_web_search", lambda query: web.get(query, [])), \
+         patch.object(knowledge, "summarize_knowledge", summarize), \
+         patch.object(knowledge, "load_docs", lambda entities, doc_ids: list(doc_ids)), \
+         patch.object(knowledge, "rewrite_query", rewrite):
+        yield web, summaries, rewrite
+
+
+@pytest.mark.asyncio
+async def test_stops_at_first_strategy_with_relevant_answer(sources):
+    web, summaries, rewrite = sources
+    web["query"] = ["https://docs.example.com/a"]
+    summaries["doc-https://docs.example.com/a"] = KnowledgeSummary(answer="the answer")
+
+    result = await get_knowledge("query")
+
+    assert result[1] == "the answer"
+    rewrite.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_rounds_are_bounded_and_partial_answer_returned(sources):
+    web, summaries, rewrite = sources
+    web["query"] = ["https://docs.example.com/a"]
+    summaries["doc-https://docs.example.com/a"] = KnowledgeSummary(answer="only the install steps", is_irrelevant=True)
+
+    with patch.object(settings, "KNOWLEDGE_MAX_ROUNDS", 2):
+        result = await get_knowledge("query")
+
+    assert "Only partial information" in result[1]
+    assert "only the install steps" in result[1]
+    rewrite.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_rewritten_and_site_searches_are_tried_last(sources):
+    web, summaries, rewrite = sources
+    web["query"] = ["https://docs.example.com/a"]
+    # The site is searched for the original query, under which its pages are indexed
+    web["site:docs.example.com query"] = ["https://docs.example.com/b"]
+    # All documents found for the query are summarized together
+    summaries["doc-https://docs.example.com/a\n\ndoc-https://docs.example.com/b"] = KnowledgeSummary(answer="found on the docs site")
+
+    result = await get_knowledge("query")
+
+    assert result[1] == "found on the docs site"
+    rewrite.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_site_search_without_a_rewritten_round(sources):
+    web, summaries, rewrite = sources
+    # The rewrite was tried already, so the rewritten round searches nothing
+    rewrite.return_value = "query"
+    web["query"] = ["https://docs.example.com/a"]
+    web["site:docs.example.com query"] = ["https://docs.example.com/b"]
+    summaries["doc-https://docs.example.com/a\n\ndoc-https://docs.example.com/b"] = KnowledgeSummary(answer="found on the docs site")
+
+    result = await get_knowledge("query")
+
+    assert result[1] == "found on the docs site"
+    rewrite.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_no_round_starts_after_the_time_budget(sources):
+    with patch.object(settings, "KNOWLEDGE_MAX_SECONDS", 0):
+        result = await get_knowledge("query")
+
+    assert result[1].startswith("No relevant information found")
@@ -0,0 +1,95 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+import httpx
+import litellm
+import pytest
+from pydantic import BaseModel, ValidationError
+
+from app.services.llm_wrapper import llm_call_wrapper
+from app.services.retry_policy import ErrorKind, InvalidResponseError, RetryBudget, RetryPolicy, classify_error, get_retry_after
+
+
+class Answer(BaseModel):
+    answer: str
+
+
+def rate_limit_error(headers: dict = None):
+    response = httpx.Response(429, headers=headers or {}, request=httpx.Request("POST", "http://llm"))
+    return litellm.exceptions.RateLimitError(message="slow down", llm_provider="openai", model="gpt", response=response)
+
+
+def completion(content: str):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def test_classifies_errors():
+    assert classify_error(rate_limit_error()) == ErrorKind.RATE_LIMIT
+    assert classify_error(litellm.exceptions.ServiceUnavailableError(message="busy", llm_provider="openai", model="gpt")) == ErrorKind.OVERLOAD
+    assert classify_error(litellm.exceptions.ContextWindowExceededError(message="long", llm_provider="openai", model="gpt")) == ErrorKind.CONTEXT_OVERFLOW
+    assert classify_error(litellm.exceptions.BadRequestError(message="bad", llm_provider="openai", model="gpt")) == ErrorKind.FATAL
+    assert classify_error(json.JSONDecodeError("invalid json", "{", 1)) == ErrorKind.VALIDATION
+    with pytest.raises(ValidationError) as validation_error:
+        Answer.model_validate({})
+    assert classify_error(validation_error.value) == ErrorKind.VALIDATION
+    assert classify_error(InvalidResponseError("no content")) == ErrorKind.VALIDATION
+    assert classify_error(ValueError("No model to call")) == ErrorKind.FATAL
+
+
+def test_honors_retry_after():
+    policy = RetryPolicy(max_retries=3, base_delay=1, max_delay=10, budget=RetryBudget(10, 60))
+
+    assert get_retry_after(rate_limit_error({"Retry-After": "7"})) == 7
+    assert policy.delay(ErrorKind.RATE_LIMIT, 0, rate_limit_error({"retry-after": "7"})) == 7
+    assert policy.delay(ErrorKind.RATE_LIMIT, 0, rate_limit_error({"retry-after": "120"})) == 10
+    assert 0 <= policy.delay(ErrorKind.OVERLOAD, 2, rate_limit_error()) <= 4
+    assert policy.delay(ErrorKind.VALIDATION, 2) == 0
+
+
+def test_budget_is_shared_per_model():
+    budget = RetryBudget(max_retries=2, window=60)
+    policy = RetryPolicy(max_retries=5, budget=budget)
+
+    assert policy.should_retry(ErrorKind.OVERLOAD, 0, "gpt")
+    assert RetryPolicy(max_retries=5, budget=budget).should_retry(ErrorKind.OVERLOAD, 0, "gpt")
+    assert not policy.should_retry(ErrorKind.OVERLOAD, 1, "gpt")
+    assert policy.should_retry(ErrorKind.OVERLOAD, 0, "other")
+    assert not policy.should_retry(ErrorKind.FATAL, 0, "other")
+
+
+@pytest.mark.asyncio
+async def test_repair_keeps_the_conversation():
+    acompletion = AsyncMock(side_effect=[completion("not json"), completion('{"answer": "42"}')])
+    messages = [{"role": "user", "content": "question"}]
+
+    with patch("app.services.llm_wrapper.acompletion_with_fallbacks", acompletion):
+        result = await llm_call_wrapper(model="gpt", response_format=Answer, messages=messages)
+
+    assert result.answer == "42"
+    repair = acompletion.call_args_list[1].kwargs["messages"]
+    assert repair[0] == messages[0]
+    assert repair[1]["content"] == "not json"
+    assert len(messages) == 1
+
+
+@pytest.mark.asyncio
+async def test_bad_request_is_not_retried():
+    error = litellm.exceptions.BadRequestError(message="bad", llm_provider="openai", model="gpt")
+    acompletion = AsyncMock(side_effect=error)
+
+    with patch("app.services.llm_wrapper.acompletion_with_fallbacks", acompletion), pytest.raises(litellm.exceptions.BadRequestError):
+        await llm_call_wrapper(model="gpt", messages=[{"role": "user", "content": "question"}])
+    assert acompletion.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_response_without_message_is_asked_again():
+    acompletion = AsyncMock(side_effect=[SimpleNamespace(choices=[]), completion('{"answer": "42"}')])
+    messages = [{"role": "user", "content": "question"}]
+
+    with patch("app.services.llm_wrapper.acompletion_with_fallbacks", acompletion):
+        result = await llm_call_wrapper(model="gpt", response_format=Answer, messages=messages)
+
+    assert result.answer == "42"
+    # There was no output to repair, the same conversation is sent again
+    assert acompletion.call_args_list[1].kwargs["messages"] == messages
@@ -0,0 +1,32 @@
+import asyncio
+from unittest.mock import patch
+import pytest
+
+from app.models.models import Agent
+from app.services.llm import solve_tasks
+
+
+@pytest.mark.asyncio
+async def test_solve_tasks_runs_independent_tasks_concurrently(make_task, make_chat):
+    tasks = [make_task("A"), make_task("B"), make_task("C", ["A", "B"])]
+    chat = make_chat(tasks=tasks)
+    agent = Agent(role="dev", background="", skills="")
+    running = set()
+    max_running = 0
+    started = []
+
+    async def fake_solve_task(agent, chat, repo, task, graph=None):
+        nonlocal max_running
+        started.append(task.unique_id)
+        running.add(task.unique_id)
+        max_running = max(max_running, len(running))
+        await asyncio.sleep(0.01)
+        running.discard(task.unique_id)
+        return task.unique_id
+
+    with patch("app.services.llm.solve_task", side_effect=fake_solve_task):
+        results = await solve_tasks(agent=agent, chat=chat, repo=None)
+
+    assert max_running == 2
+    assert started[-1] == "C"
+    assert results == {"A": "A", "B": "B", "C": "C"}
@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+from app.models.models import Chat, User
+from app.services.model_router import record_usage
+from app.services.speculation import Speculation, speculation_counters
+
+
+def make_chat():
+    return Chat(id="chat", user=User(id="user", username="user"), original_request="request")
+
+
+async def drain(chat):
+    items = []
+    while True:
+        try:
+            items.append(await asyncio.wait_for(chat.get_queue_msg(), 0.01))
+        except asyncio.TimeoutError:
+            return items
+
+
+@pytest.mark.asyncio
+async def test_commit_relays_held_back_output():
+    chat = make_chat()
+
+    async def work(shadow):
+        await shadow.set_message("first ")
+        await asyncio.sleep(0.01)
+        await shadow.set_message("second")
+        return shadow.original_request
+
+    speculation = Speculation(chat, work)
+    await chat.set_message("category ")
+    assert await speculation.commit() == "request"
+
+    assert await drain(chat) == ["category ", "first ", "second"]
+    assert [m.content for m in chat.messages] == ["category ", "first ", "second"]
+
+
+@pytest.mark.asyncio
+async def test_discard_cancels_and_counts_wasted_tokens():
+    chat = make_chat()
+    cancelled = asyncio.Event()
+
+    async def work(shadow):
+        record_usage(SimpleNamespace(prompt_tokens=80, completion_tokens=20, total_tokens=100))
+        await shadow.set_message("never shown")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    wasted = speculation_counters["wasted_tokens"]
+    speculation = Speculation(chat, work)
+    await asyncio.sleep(0.01)
+    speculation.discard()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+    assert speculation_counters["wasted_tokens"] - wasted == 100
+    assert await drain(chat) == []
+    assert chat.messages == []
@@ -0,0 +1,48 @@
+from unittest.mock import patch
+import pytest
+
+from app.config import settings
+from app.models.models import Chat, User
+from app.models.task_graph import TaskGraph
+from app.services.llm import add_dependency_context, taskResults
+
+
+def test_orders_dependencies_first(make_task):
+    graph = TaskGraph([make_task("A", ["B", "C"]), make_task("B", ["C"]), make_task("C")])
+
+    assert [task.unique_id for task in graph] == ["C", "B", "A"]
+    assert graph["B"].dependsOn == ["C"]
+
+
+def test_detects_cycle(make_task):
+    with pytest.raises(ValueError, match="cycle"):
+        TaskGraph([make_task("A", ["B"]), make_task("B", ["A"])])
+
+
+def test_detects_missing_dependency(make_task):
+    with pytest.raises(ValueError, match="unknown"):
+        TaskGraph([make_task("A", ["X"])])
+
+
+def test_ancestors_of_diamond_are_unique(make_task):
+    graph = TaskGraph([make_task("D", ["B", "C"]), make_task("B", ["A"]), make_task("C", ["A"]), make_task("A")])
+
+    assert [task.unique_id for task in graph.ancestors("D")] == ["A", "B", "C"]
+    assert graph.ancestors("A") == []
+
+
+def test_dependency_context_is_deduplicated_and_budgeted(make_task):
+    tasks = [make_task("A"), make_task("B", ["A"]), make_task("C", ["A"]), make_task("D", ["B", "C"])]
+    graph = TaskGraph(tasks)
+    chat = Chat(id="graph-chat", user=User(id="user", username="user"))
+    taskResults[chat.id] = {"A": "a" * 50, "B": "b" * 30, "C": "c" * 30}
+    messages = []
+
+    with patch.object(settings, "DEPENDENCY_CONTEXT_MAX_CHARS", 80):
+        add_dependency_context(graph, graph["D"], messages, chat)
+
+    contents = [message["content"] for message in messages]
+    assert len(contents) == 3
+    assert contents[0].startswith("Task Dependency:A") and "a" * 20 + " ... [result shortened]" in contents[0]
+    assert contents[1].endswith("b" * 30)
+    assert contents[2].endswith("c" * 30)
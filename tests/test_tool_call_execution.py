@@ -0,0 +1,162 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+
+from app.models.models import Chat, ResponseToolCall, User
+from app.services.llm_wrapper import ToolCallExecution, llm_tool_call, parse_llm_content
+from app.services.retry_policy import ErrorKind, classify_error
+
+
+def make_response(commands=None, get_knowledge=None):
+    return ResponseToolCall(
+        done=False,
+        message="",
+        repo_update={},
+        text_result="",
+        get_knowledge=get_knowledge or [],
+        commands=commands or [],
+    )
+
+
+@pytest.mark.asyncio
+async def test_streamed_tools_are_not_executed_twice():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    shell = AsyncMock(side_effect=lambda chat, command: json.dumps({"status_code": 0, "content": command}))
+    knowledge = AsyncMock(side_effect=lambda chat, query: [f"answer {query}"])
+    repo = MagicMock()
+    messages = []
+
+    with patch("app.services.llm_wrapper.execute_shell", shell), \
+         patch("app.services.llm_wrapper.get_knowledge", knowledge):
+        execution = ToolCallExecution(chat=chat, repo=repo)
+        await execution.on_stream_event("commands", "ls")
+        await execution.on_stream_event("get_knowledge", "q1")
+        await execution.on_stream_event("repo_update", ("main.py", "print()"))
+        await asyncio.sleep(0)
+        # Side effects wait for the validated response
+        assert shell.await_count == 0 and not repo.update_files.called
+        assert knowledge.await_count == 1
+        await execution.finish(make_response(commands=["ls", "pwd"], get_knowledge=["q1", "q2"]), messages)
+
+    assert [call.args[1] for call in shell.await_args_list] == ["ls", "pwd"]
+    assert [call.kwargs["query"] for call in knowledge.await_args_list] == ["q1", "q2"]
+    assert [m["content"] for m in messages] == [
+        "Command 'ls' success with status code 0. Output: ls",
+        "Command 'pwd' success with status code 0. Output: pwd",
+        "answer q1",
+        "answer q2",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_knowledge_queries_run_concurrently_and_keep_order():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    running = 0
+    max_running = 0
+
+    async def fake_get_knowledge(chat, query):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.03 if query == "slow" else 0.01)
+        running -= 1
+        if query == "broken":
+            raise ConnectionError("down")
+        return [f"answer {query}"]
+
+    messages = []
+    with patch("app.services.llm_wrapper.get_knowledge", side_effect=fake_get_knowledge):
+        execution = ToolCallExecution(chat=chat)
+        await execution.finish(make_response(get_knowledge=["slow", "broken", "fast"]), messages)
+
+    assert max_running == 3
+    assert messages[0]["content"] == "answer slow"
+    assert "failed for query broken" in messages[1]["content"]
+    assert messages[2]["content"] == "answer fast"
+
+
+def tool_call(call_id, name, arguments):
+    return SimpleNamespace(id=call_id, function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+@pytest.mark.asyncio
+async def test_native_tool_calls_get_one_result_each():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    shell = AsyncMock(side_effect=lambda chat, command: json.dumps({"status_code": 0, "content": command}))
+    knowledge = AsyncMock(side_effect=lambda chat, query: [f"answer {query}"])
+    message = SimpleNamespace(content="", tool_calls=[
+        tool_call("1", "get_knowledge", {"query": "q1"}),
+        tool_call("2", "execute_shell", {"command": "ls"}),
+        tool_call("3", "finish", {"message": "done", "text_result": "result"}),
+    ])
+    messages = []
+
+    with patch("app.services.llm_wrapper.execute_shell", shell), \
+         patch("app.services.llm_wrapper.get_knowledge", knowledge):
+        parsed_resp = await ToolCallExecution(chat=chat).finish_tool_calls(message, messages)
+
+    assert parsed_resp.commands == ["ls"] and parsed_resp.get_knowledge == ["q1"]
+    assert not parsed_resp.done
+    assert [call["id"] for call in messages[0]["tool_calls"]] == ["1", "2", "3"]
+    assert [(m["role"], m["tool_call_id"], m["content"]) for m in messages[1:]] == [
+        ("tool", "1", "answer q1"),
+        ("tool", "2", "Command 'ls' success with status code 0. Output: ls"),
+        ("tool", "3", "Finished."),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_native_answer_without_tool_calls_is_done():
+    message = SimpleNamespace(content="the answer", tool_calls=None)
+    messages = []
+
+    parsed_resp = await ToolCallExecution(chat=None).finish_tool_calls(message, messages)
+
+    assert parsed_resp.done and parsed_resp.text_result == "the answer"
+    assert messages == [{"role": "assistant", "content": "the answer"}]
+
+
+@pytest.mark.asyncio
+async def test_tool_mode_is_kept_when_switching_to_the_large_model():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    shell = AsyncMock(return_value=json.dumps({"status_code": 0, "content": "ok"}))
+    wrapper = AsyncMock(side_effect=[
+        SimpleNamespace(content="", tool_calls=[tool_call("1", "execute_shell", {"command": "ls"})]),
+        SimpleNamespace(content="", tool_calls=[tool_call("2", "finish", {"message": "done", "text_result": "result"})]),
+    ])
+    # The conversation outgrows the model, the large context model has no function calling
+    models = iter(["model", "large"])
+    messages = [{"role": "user", "content": "List the files with `command`."}]
+
+    with patch("app.services.llm_wrapper.llm_call_wrapper", wrapper), \
+         patch("app.services.llm_wrapper.execute_shell", shell), \
+         patch("app.services.llm_wrapper.use_native_tools", side_effect=lambda model: model == "model"), \
+         patch("app.services.llm_wrapper.fit_to_context", side_effect=lambda messages, model: next(models)):
+        result = await llm_tool_call(messages=messages, chat=chat, model="model")
+
+    assert result.text_result == "result"
+    assert all(call.kwargs.get("tools") for call in wrapper.await_args_list)
+    assert [call.kwargs["model"] for call in wrapper.await_args_list] == ["model", "large"]
+    # The prompt is followed by the mapping of its fields to the tools
+    assert "execute_shell" in messages[1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_truncated_command_is_not_executed():
+    chat = Chat(id="chat", user=User(id="user", username="user"))
+    shell = AsyncMock(side_effect=lambda chat, command: json.dumps({"status_code": 0, "content": command}))
+    truncated = ('{"done": false, "message": "", "repo_update": {}, "text_result": "", "get_knowledge": [], '
+                 '"commands": ["ls", "rm -rf build/ca')
+
+    execution = ToolCallExecution(chat=chat)
+    with patch("app.services.llm_wrapper.execute_shell", shell):
+        # The complete first command was streamed before the output broke off
+        await execution.on_stream_event("commands", "ls")
+        with pytest.raises(ValueError) as error:
+            parse_llm_content(truncated, ResponseToolCall)
+
+    # The response is asked for again, not even the complete command ran
+    assert classify_error(error.value) == ErrorKind.VALIDATION
+    shell.assert_not_awaited()
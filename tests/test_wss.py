@@ -0,0 +1,32 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from fastapi import WebSocket
+
+from app.models.models import Chat, User
+from app.services.wss import connected_receivers, execute_shell, receiver_locks
+
+
+@pytest.mark.asyncio
+async def test_concurrent_commands_get_their_own_output():
+    chat = Chat(id="chat", user=User(id="wss-user", username="user"))
+    sent = []
+
+    async def receive_text():
+        # The receiver answers the last command it got, after a while
+        await asyncio.sleep(0.01)
+        return json.dumps({"status_code": 0, "content": sent[-1]})
+
+    ws = MagicMock(spec=WebSocket)
+    ws.send_text = AsyncMock(side_effect=sent.append)
+    ws.receive_text = receive_text
+    connected_receivers[chat.user.id] = ws
+    try:
+        outputs = await asyncio.gather(execute_shell(chat, "ls"), execute_shell(chat, "pwd"))
+    finally:
+        del connected_receivers[chat.user.id]
+        receiver_locks.pop(chat.user.id, None)
+
+    assert [json.loads(output)["content"] for output in outputs] == ["ls", "pwd"]
+    assert sent == ["COMMAND", "ls", "COMMAND", "pwd"]